@@ -1,10 +1,18 @@
-from fastapi import APIRouter, Query
-from app.processor import start_processing
-from app.journal import load_journal
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import FileResponse, StreamingResponse
+from app.processor import options_error, start_prefixes, start_processing, start_replay
+from app.ledger import reconcile
+from app.scan import load_scan_report, start_scan
+from app.profiling import MAX_SECONDS, MIN_INTERVAL, PROFILE_MODES, request_profile, list_profiles, profile_path
+from app.schemas import JobOptions, MultiStartRequest
+from app.export import EXPORT_FORMATS, MEDIA_TYPES, arrow_available, export_stream
+from app.models import load_event_models
+from app.journal import load_journal, prefix_journal
 from app.database import init_db
-from app.s3_client import S3Client
+from app.sources import get_source
 from app.logger import logger
 from typing import Optional, List
+from datetime import datetime
 
 router = APIRouter()
 
@@ -18,7 +26,10 @@ async def startup_event():
 @router.post("/start")
 async def start_transfer(
     prefix: str = Query(..., description="S3 folder prefix"),
-    table_name: str = Query(..., description="Table: 'web' or 'mp'"),
+    table_name: str = Query(
+        ..., description="Default table: 'web', 'mp' or one from ingest_tables; routes may redirect rows"
+    ),
+    source: Optional[str] = Query(None, description="Where archives come from: 's3' or 'local' (local_root)"),
     start_file: Optional[str] = Query(
         None, description="Start from this exact file name (overrides journal)"
     ),
@@ -26,22 +37,158 @@ async def start_transfer(
         None,
         description="Start from files added on or after this date (YYYY-MM-DD, overrides journal if start_file not set)",
     ),
+    batch_size: Optional[int] = Query(None, description="Rows per insert batch"),
+    commit_policy: Optional[str] = Query(
+        None, description="Commit per 'batch', 'batches' (every N), 'interval' or 'file'"
+    ),
+    commit_every_batches: Optional[int] = Query(
+        None, description="N for commit_policy=batches"
+    ),
+    commit_interval: Optional[float] = Query(
+        None, description="Seconds between commits for commit_policy=interval"
+    ),
+    pipeline_writes: Optional[bool] = Query(
+        None, description="Send next batch while previous one is being acknowledged"
+    ),
+    load_profile: Optional[str] = Query(
+        None, description="Postgres session profile of the job: 'default', 'safe', 'fast', 'backfill' or custom"
+    ),
+    sort_batches: Optional[bool] = Query(
+        None, description="Sort each batch by client_event_time before writing (keeps BRIN indexes effective)"
+    ),
+    write_method: Optional[str] = Query(
+        None, description="'values' (INSERT ... VALUES) or 'unnest' (prepared INSERT ... SELECT FROM unnest)"
+    ),
+    dead_letter: Optional[str] = Query(
+        None, description="Where to put rejected rows: 'table', 'file' or 'off'"
+    ),
+    error_budget: Optional[int] = Query(
+        None, description="Max rejected rows per job before it stops (< 0 — unlimited)"
+    ),
+    raw_payload: Optional[str] = Query(
+        None, description="Raw event JSON: 'data' (whole object), 'extra' (unmapped keys), 'side' (event_raw) or 'off'"
+    ),
+    memory_budget: Optional[int] = Query(
+        None, description="Memory budget of the job in bytes (0 — unlimited)"
+    ),
+    throttle: Optional[bool] = Query(
+        None, description="Slow down writes when Postgres shows lock waits, WAL or replica lag pressure"
+    ),
+    prefetch: Optional[bool] = Query(
+        None, description="Download next archive while current one is processed"
+    ),
+    stream_listing: Optional[bool] = Query(
+        None, description="Start on the first files while the prefix is still being listed (key order)"
+    ),
+    rollups: Optional[bool] = Query(
+        None, description="Maintain hourly rollups (event_rollup_hourly) while loading"
+    ),
+    parsed_cache: Optional[bool] = Query(
+        None, description="Keep parsed archives on disk (by key and ETag) and reuse them instead of downloading"
+    ),
+    follow: Optional[bool] = Query(
+        None, description="Keep running and ingest new archives as they land"
+    ),
+    poll_interval: Optional[float] = Query(
+        None, description="Seconds between polls for new archives in follow mode"
+    ),
+    debounce: Optional[float] = Query(
+        None, description="Seconds an archive must be quiet before it is ingested in follow mode"
+    ),
+    event_time_from: Optional[datetime] = Query(
+        None, description="Load only events with client_event_time >= this (ISO, UTC if no offset)"
+    ),
+    event_time_to: Optional[datetime] = Query(
+        None, description="Load only events with client_event_time < this (ISO, UTC if no offset)"
+    ),
 ):
     logger.info(
         f"API /start called: prefix={prefix}, table={table_name}, start_file={start_file}, start_date={start_date}"
     )
-    if table_name not in ["web", "mp"]:
-        logger.warning(f"Invalid table_name: {table_name}")
-        return {"error": "Table must be 'web' or 'mp'"}
+    options = JobOptions(
+        source=source,
+        batch_size=batch_size,
+        commit_policy=commit_policy,
+        commit_every_batches=commit_every_batches,
+        commit_interval=commit_interval,
+        pipeline_writes=pipeline_writes,
+        load_profile=load_profile,
+        sort_batches=sort_batches,
+        write_method=write_method,
+        dead_letter=dead_letter,
+        error_budget=error_budget,
+        raw_payload=raw_payload,
+        memory_budget=memory_budget,
+        throttle=throttle,
+        prefetch=prefetch,
+        stream_listing=stream_listing,
+        rollups=rollups,
+        parsed_cache=parsed_cache,
+        follow=follow,
+        poll_interval=poll_interval,
+        debounce=debounce,
+        event_time_from=event_time_from,
+        event_time_to=event_time_to,
+    )
+    error = options_error(options, [table_name])
+    if error:
+        return {"error": error}
     if start_file and start_date:
         logger.warning(
             "Both start_file and start_date provided; prioritizing start_file"
         )
-    p = start_processing(prefix, table_name, start_file, start_date)
+    p = start_processing(prefix, table_name, start_file, start_date, options)
+    logger.info(f"Processing started, PID: {p.pid}")
+    return {"message": "Processing started in background", "pid": p.pid}
+
+
+@router.post("/start_multi")
+async def start_multi_transfer(request: MultiStartRequest):
+    """Одно задание на несколько (prefix, table_name) с общим лимитом prefix_concurrency"""
+    logger.info(f"API /start_multi called: {len(request.prefixes)} prefixes, start_date={request.start_date}")
+    if not request.prefixes:
+        return {"error": "prefixes must not be empty"}
+    prefixes = [spec.prefix.rstrip("/") for spec in request.prefixes]
+    if len(set(prefixes)) != len(prefixes):
+        return {"error": "Each prefix may be listed only once"}
+    error = options_error(request.options, [spec.table_name for spec in request.prefixes])
+    if error:
+        return {"error": error}
+    p = start_prefixes(request.prefixes, request.start_date, request.options)
     logger.info(f"Processing started, PID: {p.pid}")
     return {"message": "Processing started in background", "pid": p.pid}
 
 
+@router.post("/scan")
+async def scan_transfer(
+    prefix: str = Query(..., description="S3 folder prefix to scan"),
+    source: Optional[str] = Query(None, description="Where archives come from: 's3' or 'local' (local_root)"),
+    max_files: Optional[int] = Query(None, gt=0, description="Scan only the first N files"),
+    event_time_from: Optional[datetime] = Query(
+        None, description="Count only events with client_event_time >= this (ISO, UTC if no offset)"
+    ),
+    event_time_to: Optional[datetime] = Query(
+        None, description="Count only events with client_event_time < this (ISO, UTC if no offset)"
+    ),
+):
+    """Скачать и разобрать префикс без записи в базу; отчёт — GET /scans/{pid}"""
+    logger.info(f"API /scan called: prefix={prefix}, max_files={max_files}")
+    options = JobOptions(source=source, event_time_from=event_time_from, event_time_to=event_time_to)
+    error = options_error(options)
+    if error:
+        return {"error": error}
+    p = start_scan(prefix, options, max_files)
+    return {"message": "Scan started in background, report at /scans/{pid}", "pid": p.pid}
+
+
+@router.get("/scans/{pid}")
+async def get_scan(pid: int):
+    report = load_scan_report(pid)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    return report
+
+
 @router.get("/status")
 async def get_status(
     prefix: Optional[str] = Query(
@@ -55,20 +202,21 @@ async def get_status(
         )
         prefix = ""
     journal = load_journal()
-    s3_client = S3Client()
-    objects = s3_client.list_objects(prefix)
+    # Состояние именно этого префикса (задание могло грузить несколько)
+    state = prefix_journal(journal, prefix) if prefix else journal
+    objects = get_source().list_objects(prefix)
     object_keys = [obj["Key"] for obj in objects]
     total_files = len(object_keys)
     completed_files = 0
-    if journal["last_completed_file"]:
+    if state["last_completed_file"]:
         try:
-            completed_idx = object_keys.index(journal["last_completed_file"])
+            completed_idx = object_keys.index(state["last_completed_file"])
             completed_files = completed_idx + 1
         except ValueError:
             pass
     current = (
-        f"{journal['current_file']} at line {journal['current_line']}"
-        if journal["current_file"]
+        f"{state['current_file']} at line {state['current_line']}"
+        if state["current_file"]
         else "Idle"
     )
     logger.debug(f"Status: {completed_files}/{total_files}, current: {current}")
@@ -76,17 +224,91 @@ async def get_status(
         "completed_files": completed_files,
         "total_files": total_files,
         "current_progress": current,
-        "status": "running" if journal["current_file"] else "idle",
+        "status": "running" if state["current_file"] else "idle",
+        "load_profile": journal.get("load_profile"),
     }
 
 
+@router.get("/export")
+async def export_events(
+    table_name: str = Query(..., description="Event table: 'web', 'mp' or one from ingest_tables"),
+    event_time_from: datetime = Query(..., description="Export events with client_event_time >= this (ISO, UTC if no offset)"),
+    event_time_to: datetime = Query(..., description="Export events with client_event_time < this (ISO, UTC if no offset)"),
+    format: str = Query("ndjson", description="'ndjson' or 'arrow' (Arrow IPC stream, needs pyarrow)"),
+    after_time: Optional[datetime] = Query(
+        None, description="Resume after the row with this client_event_time (with after_insert_id)"
+    ),
+    after_insert_id: Optional[str] = Query(None, description="Resume after the row with this insert_id"),
+):
+    logger.info(
+        f"API /export called: table={table_name}, from={event_time_from}, to={event_time_to}, format={format}"
+    )
+    models = load_event_models()
+    if table_name not in models:
+        return {"error": f"Table must be one of {', '.join(models)}"}
+    if format not in EXPORT_FORMATS:
+        return {"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}
+    if format == "arrow" and not arrow_available():
+        return {"error": "format=arrow needs pyarrow installed"}
+    if (after_time is None) != (after_insert_id is None):
+        return {"error": "after_time and after_insert_id must be given together"}
+    after = (after_time, after_insert_id) if after_time is not None else None
+    return StreamingResponse(
+        export_stream(models[table_name], event_time_from, event_time_to, format, after),
+        media_type=MEDIA_TYPES[format],
+    )
+
+
+@router.post("/reconcile")
+async def reconcile_files(
+    prefix: str = Query(..., description="S3 folder prefix to reconcile"),
+    replay: bool = Query(
+        False, description="Reload files that differ, each in one delete-and-reload transaction"
+    ),
+    concurrency: Optional[int] = Query(None, description="Parallel count queries"),
+):
+    logger.info(f"API /reconcile called: prefix={prefix}, replay={replay}")
+    report = await reconcile(prefix, concurrency)
+    response = {"differing_files": len(report), "files": report}
+    if replay and report:
+        p = start_replay(prefix, JobOptions(), concurrency)
+        response["pid"] = p.pid
+    return response
+
+
+@router.post("/profile")
+async def profile_job(
+    pid: int = Query(..., description="PID returned by /start"),
+    seconds: float = Query(30, gt=0, le=MAX_SECONDS, description="How long to profile, seconds"),
+    mode: str = Query("both", description="'cpu' (sampling profiler), 'memory' (tracemalloc) or 'both'"),
+    interval: float = Query(0.01, ge=MIN_INTERVAL, description="Sampling interval, seconds"),
+):
+    logger.info(f"API /profile called: pid={pid}, seconds={seconds}, mode={mode}")
+    if mode not in PROFILE_MODES:
+        return {"error": f"mode must be one of {', '.join(PROFILE_MODES)}"}
+    request_profile(pid, seconds, mode, interval)
+    return {"message": "Profiling requested, results will appear in /profiles", "pid": pid}
+
+
+@router.get("/profiles", response_model=List[str])
+async def get_profiles():
+    return list_profiles()
+
+
+@router.get("/profiles/{name}")
+async def get_profile(name: str):
+    path = profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain", filename=name)
+
+
 @router.get("/files", response_model=List[str])
 async def list_s3_files(
     prefix: str = Query(..., description="S3 folder prefix to list files from"),
 ):
     logger.info(f"API /files called with prefix: {prefix}")
-    s3_client = S3Client()
-    objects = s3_client.list_objects(prefix)
+    objects = get_source().list_objects(prefix)
     file_names = [obj["Key"] for obj in objects]
     logger.info(f"Found {len(file_names)} files in prefix {prefix}")
     return file_names
@@ -0,0 +1,317 @@
+"""
+Headless-запуск переноса без FastAPI: `python -m app run --prefix ... --table web`.
+Тяжёлые модули (SQLAlchemy, boto3) импортируются только внутри команд,
+поэтому разбор аргументов и --help не создают ни клиентов, ни движков.
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime
+from typing import List, Optional
+
+
+def _add_job_options(parser: argparse.ArgumentParser):
+    parser.add_argument("--source", help="Where archives come from: 's3' or 'local' (local_root)")
+    parser.add_argument("--batch-size", type=int, help="Rows per insert batch")
+    parser.add_argument(
+        "--commit-policy", help="Commit per 'batch', 'batches' (every N), 'interval' or 'file'"
+    )
+    parser.add_argument("--commit-every-batches", type=int, help="N for --commit-policy=batches")
+    parser.add_argument(
+        "--commit-interval", type=float, help="Seconds between commits for --commit-policy=interval"
+    )
+    parser.add_argument(
+        "--pipeline-writes",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="Send next batch while previous one is being acknowledged",
+    )
+    parser.add_argument(
+        "--load-profile", help="Postgres session profile of the job: 'default', 'safe', 'fast', 'backfill' or custom"
+    )
+    parser.add_argument(
+        "--sort-batches",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="Sort each batch by client_event_time before writing (keeps BRIN indexes effective)",
+    )
+    parser.add_argument(
+        "--write-method", help="'values' (INSERT ... VALUES) or 'unnest' (prepared INSERT ... SELECT FROM unnest)"
+    )
+    parser.add_argument("--dead-letter", help="Where to put rejected rows: 'table', 'file' or 'off'")
+    parser.add_argument(
+        "--error-budget", type=int, help="Max rejected rows per job before it stops (< 0 — unlimited)"
+    )
+    parser.add_argument(
+        "--raw-payload", help="Raw event JSON: 'data' (whole object), 'extra' (unmapped keys), 'side' or 'off'"
+    )
+    parser.add_argument("--memory-budget", type=int, help="Memory budget of the job in bytes (0 — unlimited)")
+    parser.add_argument(
+        "--throttle",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="Slow down writes when Postgres shows lock waits, WAL or replica lag pressure",
+    )
+    parser.add_argument(
+        "--prefetch",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="Download next archive while current one is processed",
+    )
+    parser.add_argument(
+        "--stream-listing",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="Start on the first files while the prefix is still being listed (key order)",
+    )
+    parser.add_argument(
+        "--prefix-concurrency", type=int, help="Files of different prefixes loaded at once (run-multi)"
+    )
+    parser.add_argument(
+        "--rollups",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="Maintain hourly rollups (event_rollup_hourly) while loading",
+    )
+    parser.add_argument(
+        "--parsed-cache",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="Keep parsed archives on disk (by key and ETag) and reuse them instead of downloading",
+    )
+    parser.add_argument(
+        "--follow",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="Keep running and ingest new archives as they land",
+    )
+    parser.add_argument("--poll-interval", type=float, help="Seconds between polls for new archives")
+    parser.add_argument(
+        "--debounce", type=float, help="Seconds an archive must be quiet before it is ingested"
+    )
+    parser.add_argument(
+        "--event-time-from",
+        type=datetime.fromisoformat,
+        help="Load only events with client_event_time >= this (ISO, UTC if no offset)",
+    )
+    parser.add_argument(
+        "--event-time-to",
+        type=datetime.fromisoformat,
+        help="Load only events with client_event_time < this (ISO, UTC if no offset)",
+    )
+
+
+def _job_options(args: argparse.Namespace):
+    from app.schemas import JobOptions
+
+    return JobOptions(
+        source=args.source,
+        batch_size=args.batch_size,
+        commit_policy=args.commit_policy,
+        commit_every_batches=args.commit_every_batches,
+        commit_interval=args.commit_interval,
+        pipeline_writes=args.pipeline_writes,
+        load_profile=args.load_profile,
+        sort_batches=args.sort_batches,
+        write_method=args.write_method,
+        dead_letter=args.dead_letter,
+        error_budget=args.error_budget,
+        raw_payload=args.raw_payload,
+        memory_budget=args.memory_budget,
+        throttle=args.throttle,
+        prefetch=args.prefetch,
+        stream_listing=args.stream_listing,
+        prefix_concurrency=args.prefix_concurrency,
+        rollups=args.rollups,
+        parsed_cache=args.parsed_cache,
+        follow=args.follow,
+        poll_interval=args.poll_interval,
+        debounce=args.debounce,
+        event_time_from=args.event_time_from,
+        event_time_to=args.event_time_to,
+    )
+
+
+def _run(args: argparse.Namespace) -> int:
+    from app.processor import background_processor_async, options_error
+    from app.profiling import start_profile_watcher
+
+    options = _job_options(args)
+    error = options_error(options, [args.table])
+    if error:
+        print(error, file=sys.stderr)
+        return 2
+    start_profile_watcher()
+    # 1 — задание остановлено бюджетом ошибок или часть файлов не загружена
+    finished = asyncio.run(
+        background_processor_async(args.prefix, args.table, args.start_file, args.start_date, options)
+    )
+    return 0 if finished else 1
+
+
+def _prefix_specs(values: List[List[str]]):
+    from app.schemas import PrefixSpec
+
+    specs = []
+    for value in values:
+        if len(value) not in (2, 3):
+            raise ValueError(f"--prefix takes PREFIX TABLE [WEIGHT], got: {' '.join(value)}")
+        specs.append(PrefixSpec(prefix=value[0], table_name=value[1], weight=float(value[2]) if len(value) == 3 else 1.0))
+    if len({spec.prefix.rstrip("/") for spec in specs}) != len(specs):
+        raise ValueError("Each prefix may be listed only once")
+    return specs
+
+
+def _run_multi(args: argparse.Namespace) -> int:
+    try:
+        specs = _prefix_specs(args.prefix)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    from app.processor import options_error, process_prefixes_async
+    from app.profiling import start_profile_watcher
+
+    options = _job_options(args)
+    error = options_error(options, [spec.table_name for spec in specs])
+    if error:
+        print(error, file=sys.stderr)
+        return 2
+    start_profile_watcher()
+    finished = asyncio.run(process_prefixes_async(specs, args.start_date, options))
+    return 0 if finished else 1
+
+
+def _reconcile(args: argparse.Namespace) -> int:
+    import json
+
+    from app.ledger import reconcile
+    from app.processor import replay_async
+
+    if args.replay:
+        report = asyncio.run(replay_async(args.prefix, _job_options(args), args.concurrency))
+    else:
+        from app.sources import use_source
+
+        use_source(args.source)
+        report = asyncio.run(reconcile(args.prefix, args.concurrency))
+    for entry in report:
+        print(json.dumps(entry, ensure_ascii=False))
+    return 1 if report and not args.replay else 0
+
+
+def _scan(args: argparse.Namespace) -> int:
+    import json
+
+    from app.scan import scan_prefix
+
+    report = scan_prefix(args.prefix, _job_options(args), args.concurrency, args.max_files)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+def _files(args: argparse.Namespace) -> int:
+    from app.sources import get_source, use_source
+
+    use_source(args.source)
+    for obj in get_source().list_objects(args.prefix):
+        print(obj["Key"])
+    return 0
+
+
+def _init_db(args: argparse.Namespace) -> int:
+    from app.database import init_db
+
+    asyncio.run(init_db())
+    return 0
+
+
+def _promoted_migration(args: argparse.Namespace) -> int:
+    from app.promoted import write_migration
+
+    path = write_migration(args.message)
+    if path is None:
+        print("No new promoted columns", file=sys.stderr)
+        return 1
+    print(path)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="s3topostgres", description="Transfer Amplitude exports from S3 to Postgres")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run a transfer in the foreground (same options as POST /start)")
+    run.add_argument("--prefix", required=True, help="S3 folder prefix")
+    run.add_argument("--table", required=True, help="Default table: 'web', 'mp' or one from ingest_tables")
+    run.add_argument("--start-file", help="Start from this exact file name (overrides journal)")
+    run.add_argument(
+        "--start-date", help="Start from files added on or after this date (YYYY-MM-DD, overrides journal)"
+    )
+    _add_job_options(run)
+    run.set_defaults(handler=_run)
+
+    run_multi = commands.add_parser(
+        "run-multi", help="Run one transfer over several prefixes with a weighted fair-share scheduler"
+    )
+    run_multi.add_argument(
+        "--prefix",
+        nargs="+",
+        action="append",
+        required=True,
+        metavar="PREFIX TABLE [WEIGHT]",
+        help="Prefix, its table and optional weight (default 1); repeat for each prefix",
+    )
+    run_multi.add_argument(
+        "--start-date", help="Start from files added on or after this date (YYYY-MM-DD, overrides journal)"
+    )
+    _add_job_options(run_multi)
+    run_multi.set_defaults(handler=_run_multi)
+
+    reconcile = commands.add_parser(
+        "reconcile", help="Compare file ledger with table row counts and print files that differ"
+    )
+    reconcile.add_argument("--prefix", required=True, help="S3 folder prefix")
+    reconcile.add_argument("--concurrency", type=int, help="Parallel count queries")
+    reconcile.add_argument(
+        "--replay",
+        action="store_true",
+        help="Reload differing files, each in one delete-and-reload transaction",
+    )
+    _add_job_options(reconcile)
+    reconcile.set_defaults(handler=_reconcile)
+
+    scan = commands.add_parser(
+        "scan", help="Download and parse a prefix without writing to the DB, print a sizing report"
+    )
+    scan.add_argument("--prefix", required=True, help="S3 folder prefix")
+    scan.add_argument("--concurrency", type=int, help="Parsing processes (default ingest_scan_concurrency)")
+    scan.add_argument("--max-files", type=int, help="Scan only the first N files")
+    _add_job_options(scan)
+    scan.set_defaults(handler=_scan)
+
+    files = commands.add_parser("files", help="List files under a prefix")
+    files.add_argument("--prefix", required=True, help="S3 folder prefix")
+    files.add_argument("--source", help="Where archives come from: 's3' or 'local' (local_root)")
+    files.set_defaults(handler=_files)
+
+    init_db = commands.add_parser(
+        "init-db", help="Create missing tables and dictionary views (as the API does on startup)"
+    )
+    init_db.set_defaults(handler=_init_db)
+
+    promoted_migration = commands.add_parser(
+        "promoted-migration",
+        help="Write an alembic revision that adds, backfills and indexes new ingest_promoted columns",
+    )
+    promoted_migration.add_argument("-m", "--message", required=True, help="Revision message")
+    promoted_migration.set_defaults(handler=_promoted_migration)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,6 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import BaseModel
-from typing import Optional
-import logging
-import sys  # Для sys.stdout в StreamHandler
+from typing import Optional, Dict, List
 
 
 class DBSettings(BaseModel):
@@ -19,6 +17,112 @@ class S3Settings(BaseModel):
     region: str
     endpoint_url: str
     bucket_name: str  # Изменено: bucket → bucket_name (маппинг с s3_bucket_name в .env)
+    # Ranged GET: объекты больше порога качаются параллельными частями во временный файл
+    multipart_threshold: int = 64 * 1024 * 1024
+    part_size: int = 16 * 1024 * 1024
+    max_concurrency: int = 8
+    part_retries: int = 3
+    download_dir: Optional[str] = None  # None — системный tmp
+    # Листинг: параллельных запросов и символы, по которым делится пространство ключей
+    list_concurrency: int = 8
+    list_shard_chars: str = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    # Очередь SQS с уведомлениями ObjectCreated для follow-режима; None — опрос списка
+    notification_queue_url: Optional[str] = None
+    notification_endpoint_url: Optional[str] = None
+
+
+class ExportSettings(BaseModel):
+    chunk_rows: int = 5000  # строк на чанк ответа (и на выборку из серверного курсора)
+    slice_hours: int = 1  # диапазон client_event_time одного запроса выгрузки
+
+
+class LocalSettings(BaseModel):
+    # Каталог с зеркалом выгрузок для ingest_source=local; ключ — путь относительно него
+    root: Optional[str] = None
+
+
+class RouteRule(BaseModel):
+    # Поле события (platform, event_type, ...) или "prefix" — префикс ключа файла в S3
+    field: str
+    values: List[str]
+    table: str
+
+
+class PromotedProperty(BaseModel):
+    # Путь в JSON: <event_properties|user_properties|group_properties|groups|plan|data>.<ключ>[.<ключ>...]
+    path: str
+    column: str
+    type: str = "text"  # text | bigint | double | boolean | timestamp | jsonb
+    index: Optional[str] = "btree"  # btree | gin (только для jsonb) | None
+    tables: Optional[List[str]] = None  # None — все таблицы событий
+
+
+class IngestSettings(BaseModel):
+    source: str = "s3"  # откуда брать архивы: s3 | local (settings.local.root)
+    batch_size: int = 100
+    # Политика коммитов: batch | batches | interval | file
+    commit_policy: str = "batch"
+    commit_every_batches: int = 10  # для commit_policy=batches
+    commit_interval: float = 5.0  # секунды, для commit_policy=interval
+    pipeline_writes: bool = True  # отправлять батч, пока парсится следующий
+    # Профиль сессии Postgres: default | safe | fast | backfill | свой из load_profiles
+    load_profile: str = "default"
+    # Свои профили и переопределения встроенных: имя → {параметр сервера: значение}
+    load_profiles: Dict[str, Dict[str, str]] = {}
+    sort_batches: bool = True  # сортировать батч по client_event_time (кластеризация под BRIN)
+    # Способ вставки: values (INSERT ... VALUES) | unnest (подготовленный INSERT ... SELECT FROM unnest)
+    write_method: str = "values"
+    # Куда складывать отклонённые строки: table | file | off
+    dead_letter: str = "table"
+    dead_letter_dir: str = "dead_letter"  # для dead_letter=file
+    error_budget: int = 1000  # отклонённых строк на задание; < 0 — без лимита
+    # Сырой JSON события: data (весь объект в data_json, как раньше) | extra (только
+    # неразобранные ключи в extra_json) | side (сжатый в event_raw) | off
+    raw_payload: str = "data"
+    read_block_size: int = 1024 * 1024  # блок распакованного NDJSON, байт
+    json_decoder: str = "auto"  # auto | orjson | simdjson | json
+    # Торможение записи по нагрузке на Postgres (блокировки, WAL, чекпоинты, реплики)
+    throttle: bool = False
+    throttle_interval: float = 10.0  # секунды между замерами
+    throttle_max_delay: float = 5.0  # максимальная пауза перед батчем, секунды
+    throttle_max_lock_waits: int = 5  # сессий в ожидании блокировок
+    throttle_max_wal_rate: int = 64 * 1024 * 1024  # байт WAL в секунду
+    throttle_max_replica_lag: float = 30.0  # секунды
+    throttle_min_batch_scale: float = 0.1  # батч не меньше этой доли batch_size
+    # Бюджет памяти задания в байтах (скачанные архивы + батчи в очереди); 0 — без лимита
+    memory_budget: int = 0
+    prefetch: bool = True  # качать следующий архив, пока обрабатывается текущий
+    # Начинать обработку, пока листинг префикса ещё идёт (файлы в порядке ключей, а не LastModified)
+    stream_listing: bool = False
+    # Сколько файлов разных префиксов задание с несколькими префиксами грузит одновременно
+    prefix_concurrency: int = 4
+    rollups: bool = False  # поддерживать event_rollup_hourly во время загрузки
+    # Кэш разобранных архивов на диске (ключ объекта + ETag) для перезаливок и повторных загрузок
+    parsed_cache: bool = False
+    parsed_cache_dir: str = "parsed_cache"
+    parsed_cache_max_bytes: int = 10 * 1024 * 1024 * 1024  # размер кэша; старые записи вытесняются
+    # Follow-режим: ждать новые архивы после догона бэклога
+    follow: bool = False
+    poll_interval: float = 30.0  # секунды между опросами префикса / ожиданиями уведомлений
+    debounce: float = 10.0  # секунды тишины, после которых новый объект считается дописанным
+    # Сколько часов (по часу в имени файла) до последнего обработанного ключа follow ещё принимает опоздавшие архивы
+    follow_lookback_hours: int = 24
+    # Дата и час выгрузки в имени файла Amplitude: <project>_<YYYY-MM-DD>_<H>#<N>...
+    key_time_pattern: str = r"_(?P<date>\d{4}-\d{2}-\d{2})_(?P<hour>\d{1,2})(?!\d)"
+    window_slack_hours: int = 2  # запас при отсечении файлов по окну event_time_from/to
+    # Дополнительные таблицы событий: имя → колонки (пустой список — все колонки)
+    tables: Dict[str, List[str]] = {}
+    profiles_dir: str = "profiles"  # запросы и результаты профилирования заданий
+    scan_concurrency: int = 4  # процессов разбора при скане префикса без записи
+    scan_dir: str = "scans"  # отчёты фоновых сканов (POST /scan)
+    reconcile_concurrency: int = 4  # параллельных запросов при сверке file_ledger с таблицами
+    # Правила маршрутизации, первое совпавшее выигрывает; иначе — table_name задания
+    routes: List[RouteRule] = []
+    # Свойства из *_properties_json, которые при записи кладутся в типизированные колонки
+    promoted: List[PromotedProperty] = []
+    # Строковые колонки web/mp (из models.DICTIONARY_COLUMNS), которые пишутся как id словарей dim_<колонка>
+    dictionary_columns: List[str] = []
+    dictionary_cache_size: int = 100_000  # значений на колонку в LRU-кэше процесса
 
 
 class Settings(BaseSettings):
@@ -40,35 +144,29 @@ class Settings(BaseSettings):
 
     db: DBSettings
     s3: S3Settings
+    ingest: IngestSettings = IngestSettings()
+    local: LocalSettings = LocalSettings()
+    export: ExportSettings = ExportSettings()
 
 
-settings = Settings()
+_settings: Optional[Settings] = None
 
-# Импорт базового логгера после создания settings (разрывает цикл)
-from app.logger import logger
 
-# Конфигурация логгера
-logger.setLevel(getattr(logging, settings.log_level.upper()))
+def get_settings() -> Settings:
+    """Settings создаются при первом обращении, вместе с ними настраивается логгер"""
+    global _settings
+    if _settings is None:
+        _settings = Settings()
+        # Импорт логгера после создания settings (разрывает цикл)
+        from app.logger import configure_logging, logger
 
-# Console handler
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setLevel(logging.DEBUG if settings.debug else logging.INFO)
+        configure_logging(_settings)
+        logger.info(f"Settings loaded: debug={_settings.debug}, log_level={_settings.log_level}")
+    return _settings
 
-# File handler
-file_handler = logging.FileHandler(settings.log_file)
-file_handler.setLevel(logging.INFO)
 
-# Formatter
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-console_handler.setFormatter(formatter)
-file_handler.setFormatter(formatter)
-
-# Add handlers
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
-
-# Prevent duplicate logs
-logger.propagate = False
-
-# Log settings on load
-logger.info(f"Settings loaded: debug={settings.debug}, log_level={settings.log_level}")
+def __getattr__(name: str):
+    # `from app.config import settings` продолжает работать, но лениво
+    if name == "settings":
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,30 +1,95 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
-from app.config import settings
-from app.models import Base
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.engine import Engine
+from typing import Dict, Optional
+from app.config import get_settings
+from app.models import Base, load_event_models
 from app.logger import logger
-import asyncio
 
-# Sync engine for migrations
-sync_engine = create_engine(
-    f"postgresql://{settings.db.user}:{settings.db.password}@{settings.db.host}:{settings.db.port}/{settings.db.name}"
-)
+# Движки создаются при первом обращении: импорт модуля не открывает подключений
+_sync_engine: Optional[Engine] = None
+_async_engine: Optional[AsyncEngine] = None
+_session_factory: Optional[sessionmaker] = None
+# Параметры сервера для новых подключений async-движка (профиль загрузки задания)
+_server_settings: Dict[str, str] = {}
 
-# Async engine for app
-async_engine = create_async_engine(
-    f"postgresql+asyncpg://{settings.db.user}:{settings.db.password}@{settings.db.host}:{settings.db.port}/{settings.db.name}",
-    echo=False,
-    pool_pre_ping=True,
-)
-AsyncSessionLocal = sessionmaker(
-    async_engine, class_=AsyncSession, expire_on_commit=False
-)  # Экспортируем для использования
+
+def _db_url(driver: str) -> str:
+    db = get_settings().db
+    return f"{driver}://{db.user}:{db.password}@{db.host}:{db.port}/{db.name}"
+
+
+def get_sync_engine() -> Engine:
+    """Sync engine for migrations"""
+    global _sync_engine
+    if _sync_engine is None:
+        _sync_engine = create_engine(_db_url("postgresql"))
+    return _sync_engine
+
+
+def get_async_engine() -> AsyncEngine:
+    """Async engine for app"""
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_async_engine(
+            _db_url("postgresql+asyncpg"),
+            echo=False,
+            pool_pre_ping=True,
+            connect_args={"server_settings": dict(_server_settings)},
+        )
+    return _async_engine
+
+
+def use_server_settings(server_settings: Dict[str, str]):
+    """
+    Параметры сессии Postgres для подключений процесса. Если они изменились,
+    движок пересоздаётся при следующем обращении. Прежний не закрываем: в
+    дочернем процессе задания его соединения унаследованы от родителя.
+    """
+    global _server_settings, _async_engine, _session_factory
+    if server_settings != _server_settings:
+        _server_settings = dict(server_settings)
+        _async_engine = None
+        _session_factory = None
+
+
+def get_sessionmaker() -> sessionmaker:
+    global _session_factory
+    if _session_factory is None:
+        _session_factory = sessionmaker(
+            get_async_engine(), class_=AsyncSession, expire_on_commit=False
+        )
+    return _session_factory
+
+
+def AsyncSessionLocal() -> AsyncSession:
+    """Новая сессия; имя сохранено для совместимости со старым sessionmaker"""
+    return get_sessionmaker()()
+
+
+def _check_migrated(connection):
+    """
+    Таблица под именем, которое модель держит представлением (web при модели web_rows), —
+    база не доведена до миграции c4f8a2d6e913; create_all создал бы рядом пустую web_rows
+    """
+    tables = set(inspect(connection).get_table_names())
+    models = load_event_models()
+    stale = sorted(name for name, model in models.items() if model.__table__.name != name and name in tables)
+    if stale:
+        raise RuntimeError(f"Tables {', '.join(stale)} are not migrated: run `alembic upgrade head` first")
 
 
 async def init_db():
     """Apply migrations and create tables if not exist"""
     logger.info("Initializing database")
-    async with async_engine.begin() as conn:
+    load_event_models()
+    async with get_async_engine().begin() as conn:
+        await conn.run_sync(_check_migrated)
         await conn.run_sync(Base.metadata.create_all)
+        # Импорт здесь: dictionary сам импортирует database
+        from app import dictionary
+
+        # Новой базе — представления web/mp над только что созданными web_rows/mp_rows
+        await conn.run_sync(dictionary.create_views)
     logger.info("Database initialized successfully")
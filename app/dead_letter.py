@@ -0,0 +1,99 @@
+import json
+import os
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import get_settings
+from app.database import AsyncSessionLocal
+from app.models import DeadLetter
+from app.logger import logger
+
+DEAD_LETTER_MODES = ("table", "file", "off")
+
+
+class ErrorBudgetExceeded(Exception):
+    """Отклонённых строк больше, чем разрешено заданию"""
+
+
+class DeadLetterSink:
+    """
+    Копит отклонённые строки задания и сбрасывает их пачкой вместе с коммитом
+    батча: в таблицу dead_letter (в той же транзакции) или в NDJSON-файл.
+    Считает отказы по всему заданию и останавливает его по error_budget.
+    """
+
+    def __init__(self, mode: str, error_budget: int, spool_dir: Optional[str] = None):
+        if mode not in DEAD_LETTER_MODES:
+            raise ValueError(f"Unknown dead letter mode: {mode}")
+        self.mode = mode
+        self.error_budget = error_budget
+        self.spool_dir = spool_dir or get_settings().ingest.dead_letter_dir
+        self.rejected = 0
+        self._pending: List[Dict[str, Any]] = []
+
+    def reject(self, file_key: str, line_num: int, table_name: str, error: str, raw_text: str):
+        self.rejected += 1
+        if self.mode != "off":
+            self._pending.append(
+                {
+                    "file_key": file_key,
+                    "line_num": line_num,
+                    "table_name": table_name,
+                    "error": error,
+                    "raw_text": raw_text,
+                }
+            )
+        if 0 <= self.error_budget < self.rejected:
+            raise ErrorBudgetExceeded(
+                f"Rejected {self.rejected} rows, error budget is {self.error_budget}"
+            )
+
+    def _take(self, file_key: str, upto_line: int) -> List[Dict[str, Any]]:
+        taken, rest = [], []
+        for r in self._pending:
+            if r["file_key"] == file_key and r["line_num"] <= upto_line:
+                taken.append(r)
+            else:
+                rest.append(r)
+        self._pending = rest
+        return taken
+
+    async def flush_to_session(self, session: AsyncSession, file_key: str, upto_line: int):
+        """Добавить отказы до upto_line в текущую транзакцию (режим table)"""
+        if self.mode != "table":
+            return
+        rows = self._take(file_key, upto_line)
+        if rows:
+            await session.execute(insert(DeadLetter).values(rows))
+            logger.info(f"Dead-lettered {len(rows)} rows of {file_key} to table")
+
+    async def flush_all(self):
+        """
+        Сбросить все накопленные отказы, не дожидаясь коммита батча: задание
+        остановлено бюджетом ошибок, и строки, на которых он кончился, не теряются
+        """
+        if self.mode == "table" and self._pending:
+            rows, self._pending = self._pending, []
+            async with AsyncSessionLocal() as session:
+                await session.execute(insert(DeadLetter).values(rows))
+                await session.commit()
+            logger.info(f"Dead-lettered {len(rows)} pending rows to table")
+        for file_key in {r["file_key"] for r in self._pending}:
+            self.flush_to_file(file_key, max(r["line_num"] for r in self._pending if r["file_key"] == file_key))
+
+    def flush_to_file(self, file_key: str, upto_line: int):
+        """Дописать отказы до upto_line в NDJSON (режим file), после коммита"""
+        if self.mode != "file":
+            return
+        rows = self._take(file_key, upto_line)
+        if not rows:
+            return
+        os.makedirs(self.spool_dir, exist_ok=True)
+        spool = os.path.join(self.spool_dir, f"{datetime.now():%Y-%m-%d}.ndjson")
+        with open(spool, "a", encoding="utf-8") as f:
+            for r in rows:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+        logger.info(f"Dead-lettered {len(rows)} rows of {file_key} to {spool}")
@@ -0,0 +1,185 @@
+"""
+Словарное кодирование строковых колонок с малой кардинальностью
+(ingest_dictionary_columns: country, os_name, event_type, ...). Значение
+хранится один раз в dim_<колонка>, строка события несёт <колонка>_id, а
+строковая колонка остаётся NULL — строки уже, запись и сканы быстрее.
+Соответствие значение → id держится в LRU-кэше процесса; новые значения
+батча добавляются в словарь одним запросом. Строки лежат в web_rows/mp_rows,
+а представления web/mp возвращают исходные колонки с раскодированными
+значениями (и старыми строками, записанными до включения словаря), так что
+запросы не меняются. Схему создаёт миграция c4f8a2d6e913.
+"""
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql import Select
+
+from app.config import get_settings
+from app.database import get_async_engine
+from app.models import DICTIONARY_COLUMNS, dimension_id_column, dimension_models, load_event_models
+from app.routing import TableTarget
+from app.logger import logger
+
+
+class LruMap:
+    """Словарь ограниченного размера: при переполнении вытесняется давно не нужное"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max(1, max_size)
+        self._data: "OrderedDict[str, int]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[int]:
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: int):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+
+class DictionaryEncoder:
+    """Заменяет значения словарных колонок батча на id; False — словарей нет"""
+
+    def __init__(self, columns: List[str], cache_size: int):
+        self.columns = columns
+        self.models = dimension_models()
+        self._caches = {column: LruMap(cache_size) for column in columns}
+        self.added = 0  # новых значений, добавленных этим процессом
+
+    def __bool__(self) -> bool:
+        return bool(self.columns)
+
+    async def encode(self, target: TableTarget, rows: List[dict]) -> List[dict]:
+        """
+        Копии строк с <колонка>_id вместо значения; исходные строки не меняются.
+        Таблицы без колонки _id (дополнительные из ingest_tables) пишутся как есть.
+        """
+        columns = [c for c in self.columns if dimension_id_column(c) in target.columns]
+        if not columns or not rows:
+            return rows
+        ids = {
+            column: await self._resolve(column, {row[column] for row in rows} - {None})
+            for column in columns
+        }
+        encoded = []
+        for row in rows:
+            row = dict(row)
+            for column in columns:
+                value = row[column]
+                if value is not None:
+                    row[dimension_id_column(column)] = ids[column][value]
+                    row[column] = None
+            encoded.append(row)
+        return encoded
+
+    async def _resolve(self, column: str, values: Iterable[str]) -> Dict[str, int]:
+        cache = self._caches[column]
+        found: Dict[str, int] = {}
+        missing = []
+        for value in values:
+            id_ = cache.get(value)
+            if id_ is None:
+                missing.append(value)
+            else:
+                found[value] = id_
+        if not missing:
+            return found
+        table = self.models[column].__table__.name
+        missing.sort()  # один порядок блокировок уникального индекса у параллельных заданий
+        # Своя короткая транзакция: id в кэше должны пережить откат батча
+        async with get_async_engine().begin() as conn:
+            result = await conn.execute(
+                text(
+                    f"INSERT INTO {table} (value) SELECT unnest(CAST(:values AS text[])) "
+                    "ON CONFLICT (value) DO NOTHING"
+                ),
+                {"values": missing},
+            )
+            self.added += result.rowcount or 0
+            # Отдельный запрос видит и значения, которые только что закоммитили другие задания
+            rows = await conn.execute(
+                text(f"SELECT value, id FROM {table} WHERE value = ANY(CAST(:values AS text[]))"),
+                {"values": missing},
+            )
+            for value, id_ in rows:
+                cache.put(value, id_)
+                found[value] = id_
+        return found
+
+
+_encoder: Optional[DictionaryEncoder] = None
+
+
+def get_dictionary() -> DictionaryEncoder:
+    global _encoder
+    if _encoder is None:
+        ingest = get_settings().ingest
+        _encoder = DictionaryEncoder(ingest.dictionary_columns, ingest.dictionary_cache_size)
+    return _encoder
+
+
+def decoded_select(model) -> Select:
+    """
+    SELECT исходных колонок таблицы событий: словарные колонки раскодированы
+    (coalesce со строковой колонкой — для строк до включения словаря), колонок _id нет
+    """
+    table = model.__table__
+    dims = {column: m for column, m in dimension_models().items() if dimension_id_column(column) in table.c}
+    id_columns = {dimension_id_column(column) for column in dims}
+    source = table
+    columns = []
+    for c in table.columns:
+        if c.name in id_columns:
+            continue
+        if c.name in dims:
+            dim = dims[c.name].__table__.alias(f"d_{c.name}")
+            source = source.outerjoin(dim, dim.c.id == table.c[dimension_id_column(c.name)])
+            columns.append(func.coalesce(dim.c.value, c).label(c.name))
+        else:
+            columns.append(c)
+    return select(*columns).select_from(source)
+
+
+def create_views(connection, replace: bool = False):
+    """
+    Раскодирующие представления под именами таблиц (web над web_rows, ...), sync, для run_sync.
+    Колонки берутся из базы, а не из модели. Существующее представление
+    заменяется только с replace (CREATE OR REPLACE: колонки можно лишь добавить в конец).
+    """
+    quote = postgresql.dialect().identifier_preparer.quote
+    inspector = inspect(connection)
+    for name, model in load_event_models().items():
+        rows_table = model.__table__.name
+        if rows_table == name or not inspector.has_table(rows_table):
+            continue
+        if not replace and connection.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar():
+            continue
+        existing = [c["name"] for c in inspector.get_columns(rows_table)]
+        id_columns = {dimension_id_column(column) for column in DICTIONARY_COLUMNS}
+        columns, joins = [], []
+        for column in existing:
+            if column in id_columns:
+                continue
+            if column in DICTIONARY_COLUMNS and dimension_id_column(column) in existing:
+                alias = quote(f"d_{column}")
+                columns.append(f"coalesce({alias}.value, t.{quote(column)}) AS {quote(column)}")
+                joins.append(
+                    f"LEFT JOIN {quote(f'dim_{column}')} {alias} "
+                    f"ON {alias}.id = t.{quote(dimension_id_column(column))}"
+                )
+            else:
+                columns.append(f"t.{quote(column)}")
+        connection.exec_driver_sql(
+            f"CREATE OR REPLACE VIEW {quote(name)} AS SELECT {', '.join(columns)} "
+            f"FROM {quote(rows_table)} t {' '.join(joins)}"
+        )
+        logger.info(f"View {name} over {rows_table} created")
@@ -0,0 +1,165 @@
+"""
+Потоковая выгрузка событий таблицы за диапазон client_event_time (GET /export).
+Диапазон идёт срезами по export_slice_hours: каждый срез — отдельный запрос
+с серверным курсором (yield_per), упорядоченный по (client_event_time, insert_id),
+строки отдаются чанками по export_chunk_rows. В памяти API только текущий чанк,
+OFFSET не используется: продолжить прерванную выгрузку можно с ключа последней
+полученной строки (after_time, after_insert_id). Срез отбирается BRIN-индексом
+по client_event_time, сортировку среза делает сервер.
+Словарные колонки (ingest_dictionary_columns) отдаются раскодированными.
+Форматы: ndjson и arrow (Arrow IPC stream, если установлен pyarrow).
+"""
+import io
+import json
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from sqlalchemy import JSON, BigInteger, Boolean, DateTime, Float, Integer, LargeBinary, tuple_
+
+from app.config import get_settings
+from app.database import get_async_engine
+from app.dictionary import decoded_select
+from app.window import to_naive_utc
+
+EXPORT_FORMATS = ("ndjson", "arrow")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "arrow": "application/vnd.apache.arrow.stream"}
+
+
+def arrow_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+async def iter_chunks(
+    model,
+    start: datetime,
+    end: datetime,
+    after: Optional[Tuple[datetime, str]] = None,
+) -> AsyncIterator[List[Dict]]:
+    """Чанки строк [start, end) по возрастанию (client_event_time, insert_id), строго после after"""
+    export = get_settings().export
+    table = model.__table__
+    event_time, insert_id = table.c.client_event_time, table.c.insert_id
+    start, end = to_naive_utc(start), to_naive_utc(end)
+    if after is not None:
+        after = (to_naive_utc(after[0]), after[1])
+        start = max(start, after[0])
+    step = timedelta(hours=max(1, export.slice_hours))
+    while start < end:
+        slice_end = min(end, start + step)
+        stmt = (
+            decoded_select(model)
+            .where(event_time >= start, event_time < slice_end)
+            .order_by(event_time, insert_id)
+            .execution_options(yield_per=export.chunk_rows)
+        )
+        if after is not None and after[0] >= start:
+            stmt = stmt.where(tuple_(event_time, insert_id) > tuple_(*after))
+        # Серверный курсор живёт в транзакции одного среза
+        async with get_async_engine().connect() as conn:
+            result = await conn.stream(stmt)
+            async for part in result.mappings().partitions():
+                yield [dict(row) for row in part]
+        start = slice_end
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.hex()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _ndjson_encoder():
+    try:
+        import orjson
+
+        def encode(rows: List[Dict]) -> bytes:
+            return b"".join(orjson.dumps(row, default=_json_default) + b"\n" for row in rows)
+
+    except ImportError:
+
+        def encode(rows: List[Dict]) -> bytes:
+            return "".join(
+                json.dumps(row, ensure_ascii=False, default=_json_default) + "\n" for row in rows
+            ).encode("utf-8")
+
+    return encode
+
+
+def _arrow_type(column):
+    import pyarrow as pa
+
+    type_ = column.type
+    if isinstance(type_, JSON):
+        return pa.string()  # JSON-колонки — текстом JSON
+    if isinstance(type_, DateTime):
+        return pa.timestamp("us")
+    if isinstance(type_, BigInteger):
+        return pa.int64()
+    if isinstance(type_, Integer):
+        return pa.int32()
+    if isinstance(type_, Float):
+        return pa.float64()
+    if isinstance(type_, Boolean):
+        return pa.bool_()
+    if isinstance(type_, LargeBinary):
+        return pa.binary()
+    return pa.string()
+
+
+class ArrowEncoder:
+    """Чанки строк → куски Arrow IPC stream; схема — из колонок выборки"""
+
+    def __init__(self, columns):
+        import pyarrow as pa
+
+        self._pa = pa
+        columns = list(columns)
+        self.schema = pa.schema([(c.name, _arrow_type(c)) for c in columns])
+        self._json_columns = [c.name for c in columns if isinstance(c.type, JSON)]
+        self._sink = io.BytesIO()
+        self._writer = pa.ipc.new_stream(self._sink, self.schema)
+
+    def _take(self) -> bytes:
+        data = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+        return data
+
+    def encode(self, rows: List[Dict]) -> bytes:
+        for row in rows:
+            for name in self._json_columns:
+                if row[name] is not None:
+                    row[name] = json.dumps(row[name], ensure_ascii=False)
+        self._writer.write_batch(self._pa.RecordBatch.from_pylist(rows, schema=self.schema))
+        return self._take()
+
+    def finish(self) -> bytes:
+        self._writer.close()
+        return self._take()
+
+
+async def export_stream(
+    model,
+    start: datetime,
+    end: datetime,
+    fmt: str = "ndjson",
+    after: Optional[Tuple[datetime, str]] = None,
+) -> AsyncIterator[bytes]:
+    """Тело ответа /export: один кусок байт на чанк строк"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if fmt == "arrow":
+        encoder = ArrowEncoder(decoded_select(model).selected_columns)
+        async for rows in iter_chunks(model, start, end, after):
+            yield encoder.encode(rows)
+        yield encoder.finish()
+        return
+    encode = _ndjson_encoder()
+    async for rows in iter_chunks(model, start, end, after):
+        yield encode(rows)
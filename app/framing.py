@@ -0,0 +1,104 @@
+"""
+Разбор NDJSON блоками: распакованный поток читается кусками по block_size,
+строки режутся по \\n срезами memoryview без копирования и без декодирования
+в str; строка, перешедшая границу блока, склеивается с началом следующего.
+Нумерация строк совпадает с построчным чтением (`for line in stream`),
+поэтому журнал (current_line) от прежних версий остаётся верным.
+JSON декодируется прямо из байтов: orjson или simdjson, если установлены.
+"""
+import json
+from typing import BinaryIO, Callable, Iterator, Optional, Tuple
+
+from app.logger import logger
+
+JSON_DECODERS = ("auto", "orjson", "simdjson", "json")
+_WHITESPACE = b" \t\r\n\x0b\x0c"
+
+
+def iter_lines(
+    stream: BinaryIO, block_size: int, on_block: Optional[Callable[[bytes], None]] = None
+) -> Iterator[Tuple[int, memoryview]]:
+    """
+    (номер строки, строка без пробелов по краям) для каждой строки потока,
+    включая пустые. on_block получает каждый прочитанный блок (контрольная сумма).
+    """
+    line_num = 0
+    carry = b""
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        if on_block is not None:
+            on_block(block)
+        buf = carry + block if carry else block
+        view = memoryview(buf)
+        start = 0
+        find = buf.find
+        while True:
+            end = find(b"\n", start)
+            if end < 0:
+                break
+            line_num += 1
+            yield line_num, _trim(view, buf, start, end)
+            start = end + 1
+        carry = buf[start:]
+    if carry:
+        line_num += 1
+        yield line_num, _trim(memoryview(carry), carry, 0, len(carry))
+
+
+def _trim(view: memoryview, buf: bytes, start: int, end: int) -> memoryview:
+    # Обычно строка NDJSON без пробелов по краям, тогда цикл не выполняется ни разу
+    while start < end and buf[start] in _WHITESPACE:
+        start += 1
+    while end > start and buf[end - 1] in _WHITESPACE:
+        end -= 1
+    return view[start:end]
+
+
+def line_text(line: memoryview) -> str:
+    """Строка как текст (для dead_letter и логов), битые байты UTF-8 отбрасываются"""
+    return bytes(line).decode("utf-8", errors="ignore")
+
+
+def _json_loads(line: memoryview):
+    return json.loads(bytes(line))
+
+
+def get_decoder(name: str = "auto") -> Callable[[memoryview], object]:
+    """
+    Функция bytes → объект. auto — orjson, иначе simdjson, иначе стандартный json.
+    Ошибки разбора — ValueError (JSONDecodeError его подкласс).
+    """
+    if name not in JSON_DECODERS:
+        raise ValueError(f"Unknown JSON decoder: {name}")
+    if name in ("auto", "orjson"):
+        try:
+            import orjson
+
+            return orjson.loads
+        except ImportError:
+            if name == "orjson":
+                raise
+    if name in ("auto", "simdjson"):
+        try:
+            import simdjson
+
+            return lambda line: simdjson.loads(bytes(line))
+        except ImportError:
+            if name == "simdjson":
+                raise
+    if name == "auto":
+        logger.debug("orjson/simdjson not installed, using json")
+    return _json_loads
+
+
+def decode_line(decode: Callable[[memoryview], object], line: memoryview):
+    """
+    Разобрать строку быстрым декодером. Быстрые декодеры не принимают битый
+    UTF-8; такую строку, как и раньше, разбираем после отбрасывания битых байт.
+    """
+    try:
+        return decode(line)
+    except ValueError:
+        return json.loads(line_text(line))
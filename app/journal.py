@@ -5,6 +5,39 @@ from app.logger import logger
 
 JOURNAL_FILE = "journal.json"
 
+# Верхний уровень журнала — последнее событие любого префикса (как раньше);
+# в prefixes — то же по каждому префиксу, для заданий с несколькими префиксами.
+
+
+def _fresh() -> Dict:
+    return {"last_completed_file": None, "current_file": None, "current_line": 0}
+
+
+def prefix_of(file_key: str) -> str:
+    """Префикс (каталог) файла в том виде, в котором он ключ раздела prefixes"""
+    return file_key.rsplit("/", 1)[0] + "/" if "/" in file_key else ""
+
+
+def prefix_journal(journal: Dict, prefix: str) -> Dict:
+    """
+    Состояние одного префикса. Журнал без раздела для него (записан до
+    появления prefixes) читается по верхнему уровню, если тот про этот префикс.
+    """
+    if prefix and not prefix.endswith("/"):
+        prefix += "/"
+    section = journal.get("prefixes", {}).get(prefix)
+    if section is not None:
+        return section
+    latest = journal.get("last_completed_file") or journal.get("current_file")
+    if latest and prefix_of(latest) == prefix:
+        return journal
+    return _fresh()
+
+
+def _update(journal: Dict, file_key: str, **state):
+    journal.update(state)
+    journal.setdefault("prefixes", {}).setdefault(prefix_of(file_key), _fresh()).update(state)
+
 
 def load_journal() -> Dict:
     if os.path.exists(JOURNAL_FILE):
@@ -13,8 +46,7 @@ def load_journal() -> Dict:
             logger.debug(f"Loaded journal: {data}")
             return data
     logger.info("No journal file found, starting fresh")
-    default = {"last_completed_file": None, "current_file": None, "current_line": 0}
-    return default
+    return _fresh()
 
 
 def save_journal(journal: Dict):
@@ -25,16 +57,20 @@ def save_journal(journal: Dict):
 
 def update_completed_file(file_key: str):
     journal = load_journal()
-    journal["last_completed_file"] = file_key
-    journal["current_file"] = None
-    journal["current_line"] = 0
+    _update(journal, file_key, last_completed_file=file_key, current_file=None, current_line=0)
     save_journal(journal)
     logger.info(f"Updated journal: completed file {file_key}")
 
 
+def update_load_profile(name: str, server_settings: Dict[str, str]):
+    """Профиль сессии Postgres текущего задания (показывается в /status)"""
+    journal = load_journal()
+    journal["load_profile"] = {"name": name, "settings": server_settings}
+    save_journal(journal)
+
+
 def update_current_progress(file_key: str, line: int):
     journal = load_journal()
-    journal["current_file"] = file_key
-    journal["current_line"] = line
+    _update(journal, file_key, current_file=file_key, current_line=line)
     save_journal(journal)
     logger.debug(f"Updated journal: progress in {file_key} at line {line}")
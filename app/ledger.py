@@ -0,0 +1,217 @@
+"""
+Журнал загрузки по файлам (file_ledger): что и сколько пришло из каждого архива.
+Счётчики строк по таблицам растут в той же транзакции, что и батчи, поэтому
+всегда совпадают с тем, что закоммичено. Сверка сравнивает их с числом строк
+с тем же source_file_id в таблицах и находит архивы, которые надо перезалить.
+"""
+import asyncio
+from collections import defaultdict
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import delete, func, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import get_settings
+from app.database import AsyncSessionLocal
+from app.models import DeadLetter, EventRaw, FileLedger, FileLedgerRows
+from app.rollups import subtract_file_rows
+from app.routing import get_registry
+from app.sources import get_source
+from app.logger import logger
+
+ID_CHUNK = 10000  # source_file_id на один запрос при сверке
+
+
+async def open_file(file_key: str, table_name: str, etag: Optional[str], reset: bool) -> int:
+    """
+    Завести (или переоткрыть) запись файла и вернуть его source_file_id.
+    reset — файл грузится с начала: счётчики прошлой загрузки обнуляются.
+    """
+    values = {"file_key": file_key, "table_name": table_name, "etag": etag, "status": "loading"}
+    set_ = {"table_name": table_name, "etag": etag, "status": "loading", "completed_at": None}
+    if reset:
+        set_.update(lines=None, checksum=None, rows_inserted=0, rows_rejected=0, started_at=func.now())
+    stmt = (
+        pg_insert(FileLedger)
+        .values(**values)
+        .on_conflict_do_update(index_elements=["file_key"], set_=set_)
+        .returning(FileLedger.id)
+    )
+    async with AsyncSessionLocal() as session:
+        file_id = (await session.execute(stmt)).scalar_one()
+        if reset:
+            await session.execute(delete(FileLedgerRows).where(FileLedgerRows.file_id == file_id))
+        await session.commit()
+    return file_id
+
+
+async def complete_file(file_id: int, lines: int, checksum: str, rejected: int):
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            update(FileLedger)
+            .where(FileLedger.id == file_id)
+            .values(
+                status="completed",
+                lines=lines,
+                checksum=checksum,
+                rows_rejected=FileLedger.rows_rejected + rejected,
+                completed_at=func.now(),
+            )
+        )
+        await session.commit()
+
+
+async def completed_keys(prefix: str, start_after: Optional[str] = None) -> Set[str]:
+    """Загруженные до конца ключи префикса, идущие лексикографически после start_after"""
+    query = select(FileLedger.file_key).where(
+        FileLedger.status == "completed", FileLedger.file_key.startswith(prefix, autoescape=True)
+    )
+    if start_after:
+        query = query.where(FileLedger.file_key > start_after)
+    async with AsyncSessionLocal() as session:
+        return set((await session.execute(query)).scalars())
+
+
+class LedgerCounts:
+    """Вставленные строки файла по таблицам до ближайшего коммита"""
+
+    def __init__(self, file_id: int):
+        self.file_id = file_id
+        self._rows: Dict[str, int] = defaultdict(int)
+
+    def add(self, table_name: str, rows: int):
+        self._rows[table_name] += rows
+
+    async def flush(self, session: AsyncSession):
+        """Прибавить счётчики к file_ledger в текущей транзакции"""
+        if not self._rows:
+            return
+        stmt = pg_insert(FileLedgerRows).values(
+            [{"file_id": self.file_id, "table_name": t, "rows": n} for t, n in self._rows.items()]
+        )
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["file_id", "table_name"],
+                set_={"rows": FileLedgerRows.rows + stmt.excluded.rows},
+            )
+        )
+        await session.execute(
+            update(FileLedger)
+            .where(FileLedger.id == self.file_id)
+            .values(rows_inserted=FileLedger.rows_inserted + sum(self._rows.values()))
+        )
+        self._rows.clear()
+
+
+async def file_id_tables(session: AsyncSession) -> Set[str]:
+    """
+    Таблицы, в которых действительно есть колонка source_file_id: у таблиц из
+    ingest_tables, созданных до file_ledger, её может не быть, хотя в модели она есть
+    """
+    result = await session.execute(
+        text(
+            "SELECT table_name FROM information_schema.columns "
+            "WHERE column_name = 'source_file_id' AND table_schema = current_schema()"
+        )
+    )
+    return set(result.scalars())
+
+
+async def delete_file_rows(session: AsyncSession, file_id: int, file_key: str, rollups: bool = False):
+    """
+    Удалить всё, что пришло из файла (для перезаливки в той же транзакции).
+    rollups — перезаливка снова добавит строки в роллапы, поэтому удаляемые из них вычитаются.
+    """
+    tables = await file_id_tables(session)
+    for target in get_registry().targets.values():
+        table = target.model.__table__
+        if table.name not in tables:
+            continue
+        if rollups:
+            await subtract_file_rows(session, target.name, target.model, file_id)
+        ids = select(table.c.insert_id).where(table.c.source_file_id == file_id)
+        await session.execute(delete(EventRaw).where(EventRaw.insert_id.in_(ids)))
+        result = await session.execute(delete(table).where(table.c.source_file_id == file_id))
+        if result.rowcount:
+            logger.info(f"Deleted {result.rowcount} rows of {file_key} from {target.name}")
+    await session.execute(delete(DeadLetter).where(DeadLetter.file_key == file_key))
+
+
+async def _count_rows(table, file_ids: List[int], semaphore: asyncio.Semaphore) -> Dict[int, int]:
+    counts: Dict[int, int] = {}
+    async with semaphore:
+        async with AsyncSessionLocal() as session:
+            for i in range(0, len(file_ids), ID_CHUNK):
+                chunk = file_ids[i : i + ID_CHUNK]
+                result = await session.execute(
+                    select(table.c.source_file_id, func.count())
+                    .where(table.c.source_file_id.in_(chunk))
+                    .group_by(table.c.source_file_id)
+                )
+                counts.update(result.all())
+    return counts
+
+
+async def reconcile(prefix: str, concurrency: Optional[int] = None) -> List[Dict]:
+    """
+    Сверить file_ledger по файлам префикса с таблицами и S3. Возвращает файлы,
+    которые надо перезалить: загрузка не завершена, ETag в S3 изменился или
+    число строк в какой-то таблице не совпадает со счётчиком.
+    """
+    concurrency = concurrency or get_settings().ingest.reconcile_concurrency
+    etags = {obj["Key"]: obj.get("ETag") for obj in await asyncio.to_thread(get_source().list_objects, prefix)}
+    async with AsyncSessionLocal() as session:
+        entries = (
+            await session.execute(select(FileLedger).where(FileLedger.file_key.startswith(prefix)))
+        ).scalars().all()
+        expected: Dict[int, Dict[str, int]] = defaultdict(dict)
+        result = await session.execute(
+            select(FileLedgerRows).where(FileLedgerRows.file_id.in_([e.id for e in entries]))
+        )
+        for row in result.scalars():
+            expected[row.file_id][row.table_name] = row.rows
+        tables = await file_id_tables(session)
+
+    file_ids = [e.id for e in entries]
+    targets = [t for t in get_registry().targets.values() if t.model.__table__.name in tables]
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    per_table = await asyncio.gather(
+        *(_count_rows(t.model.__table__, file_ids, semaphore) for t in targets)
+    )
+    actual: Dict[int, Dict[str, int]] = defaultdict(dict)
+    for target, counts in zip(targets, per_table):
+        for file_id, n in counts.items():
+            actual[file_id][target.name] = n
+
+    report = []
+    for entry in entries:
+        want = {t: n for t, n in expected[entry.id].items() if n}
+        have = actual[entry.id]
+        reasons = []
+        if entry.status != "completed":
+            reasons.append(f"status {entry.status}")
+        if entry.file_key not in etags:
+            reasons.append("missing in S3")
+        elif entry.etag and etags[entry.file_key] != entry.etag:
+            reasons.append("etag changed")
+        if want != have:
+            reasons.append("row counts differ")
+        if reasons:
+            report.append(
+                {
+                    "file_key": entry.file_key,
+                    "source_file_id": entry.id,
+                    "table_name": entry.table_name,
+                    "reasons": reasons,
+                    "expected": want,
+                    "actual": have,
+                }
+            )
+    ledgered = {e.file_key for e in entries}
+    unledgered = sum(1 for key in etags if key not in ledgered)
+    logger.info(
+        f"Reconciled {len(entries)} files under {prefix}: {len(report)} differ, "
+        f"{unledgered} not loaded yet"
+    )
+    return report
@@ -0,0 +1,62 @@
+"""
+Профили сессии Postgres для загрузки (load_profile задания). Профиль — набор
+параметров сервера, которые задание выставляет своим подключениям при их
+открытии (server_settings asyncpg), не трогая остальных клиентов базы:
+default — настройки сервера как есть (как раньше);
+safe     — синхронный коммит, ограниченный statement_timeout;
+fast     — synchronous_commit=off: коммит батча не ждёт fsync WAL; при падении
+           сервера теряются последние ~3×wal_writer_delay коммитов, file_ledger
+           и сверка находят такие файлы;
+backfill — как fast, плюс больше памяти на сортировки и обслуживание.
+ingest_load_profiles добавляет свои профили или меняет параметры встроенных.
+"""
+from typing import Dict, List
+
+from app.config import get_settings
+from app.database import use_server_settings
+from app.logger import logger
+
+LOAD_PROFILES: Dict[str, Dict[str, str]] = {
+    "default": {},
+    "safe": {
+        "synchronous_commit": "on",
+        "statement_timeout": "10min",
+        "work_mem": "16MB",
+    },
+    "fast": {
+        "synchronous_commit": "off",
+        "statement_timeout": "0",
+        "work_mem": "64MB",
+        "maintenance_work_mem": "256MB",
+        "jit": "off",
+    },
+    "backfill": {
+        "synchronous_commit": "off",
+        "statement_timeout": "0",
+        "work_mem": "256MB",
+        "maintenance_work_mem": "1GB",
+        "jit": "off",
+    },
+}
+
+
+def load_profile_names() -> List[str]:
+    return sorted(set(LOAD_PROFILES) | set(get_settings().ingest.load_profiles))
+
+
+def profile_settings(name: str) -> Dict[str, str]:
+    """Параметры сервера профиля: встроенные, поверх них — из ingest_load_profiles"""
+    custom = get_settings().ingest.load_profiles
+    if name not in LOAD_PROFILES and name not in custom:
+        raise ValueError(f"Unknown load profile: {name}")
+    return {**LOAD_PROFILES.get(name, {}), **custom.get(name, {})}
+
+
+def use_load_profile(name: str) -> Dict[str, str]:
+    """Применить профиль к подключениям процесса задания; возвращает его параметры"""
+    server_settings = profile_settings(name)
+    use_server_settings(server_settings)
+    if server_settings:
+        applied = ", ".join(f"{k}={v}" for k, v in server_settings.items())
+        logger.info(f"Load profile {name}: {applied}")
+    return server_settings
@@ -1,21 +1,34 @@
 import logging
 import sys
-from app.config import settings
 
 logger = logging.getLogger("analytics_transfer")
-logger.setLevel(getattr(logging, settings.log_level.upper()))
+logger.propagate = False
 
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setLevel(logging.DEBUG if settings.debug else logging.INFO)
+_configured = False
 
-file_handler = logging.FileHandler(settings.log_file)
-file_handler.setLevel(logging.INFO)
 
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-console_handler.setFormatter(formatter)
-file_handler.setFormatter(formatter)
+def configure_logging(settings):
+    """Повесить console/file хендлеры по settings; повторный вызов ничего не делает"""
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    logger.setLevel(getattr(logging, settings.log_level.upper()))
 
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(logging.DEBUG if settings.debug else logging.INFO)
 
-logger.propagate = False
+    file_handler = logging.FileHandler(settings.log_file)
+    file_handler.setLevel(logging.INFO)
+
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    console_handler.setFormatter(formatter)
+    file_handler.setFormatter(formatter)
+
+    logger.addHandler(console_handler)
+    logger.addHandler(file_handler)
+
+
+def flush_logs():
+    for handler in logger.handlers:
+        handler.flush()
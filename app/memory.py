@@ -0,0 +1,84 @@
+import asyncio
+import io
+from collections import defaultdict
+from typing import BinaryIO, Dict
+
+from app.logger import logger
+
+# Строка в виде dict с объектами значений занимает в памяти в несколько раз больше,
+# чем её сырой JSON; батчи учитываем по длине текста с этим множителем
+ROW_BYTES_FACTOR = 4
+MIN_BATCH_SIZE = 10
+
+
+def buffer_bytes(buffer: BinaryIO) -> int:
+    """Сколько памяти держит буфер скачанного архива (временный файл — 0)"""
+    if isinstance(buffer, io.BytesIO):
+        return buffer.getbuffer().nbytes
+    return 0
+
+
+class MemoryGovernor:
+    """
+    Учёт байт, которые держат стадии конвейера (download — скачанные архивы,
+    parse — разобранные строки набираемого батча, write — батчи в очереди
+    писателя), и backpressure по бюджету задания:
+    при нехватке ждут префетч и парсер, а размер батча уменьшается.
+    budget=0 — без лимита, только учёт.
+    """
+
+    def __init__(self, budget: int = 0, high_watermark: float = 0.8):
+        self.budget = budget
+        self.high_watermark = high_watermark
+        self.held: Dict[str, int] = defaultdict(int)
+        self.peak = 0
+        self._released = asyncio.Event()
+
+    @property
+    def used(self) -> int:
+        return sum(self.held.values())
+
+    @property
+    def pressure(self) -> float:
+        return self.used / self.budget if self.budget else 0.0
+
+    async def acquire(self, stage: str, nbytes: int):
+        """
+        Занять nbytes за стадией, дождавшись места в бюджете. Стадия, которая
+        сейчас ничего не держит, проходит сразу: иначе конвейер может заклинить.
+        """
+        if self.budget:
+            waited = False
+            while self.held[stage] and self.used + nbytes > self.budget:
+                if not waited:
+                    logger.debug(f"Memory budget reached ({self.used}/{self.budget}), {stage} waits")
+                    waited = True
+                self._released.clear()
+                await self._released.wait()
+        self.hold(stage, nbytes)
+
+    def hold(self, stage: str, nbytes: int):
+        """Учесть уже занятую память без ожидания"""
+        self.held[stage] += nbytes
+        self.peak = max(self.peak, self.used)
+
+    def release(self, stage: str, nbytes: int):
+        self.held[stage] -= nbytes
+        self._released.set()
+
+    async def wait_for_headroom(self):
+        """Ждать, пока давление не опустится ниже high_watermark (для префетча)"""
+        while self.budget and self.pressure >= self.high_watermark:
+            self._released.clear()
+            await self._released.wait()
+
+    def batch_size(self, base: int) -> int:
+        """Размер батча с учётом давления: выше high_watermark линейно уменьшается"""
+        if not self.budget or self.pressure < self.high_watermark:
+            return base
+        spare = max(0.0, 1.0 - self.pressure) / (1.0 - self.high_watermark)
+        return max(min(base, MIN_BATCH_SIZE), int(base * spare))
+
+    def summary(self) -> str:
+        stages = ", ".join(f"{k}={v}" for k, v in self.held.items() if v)
+        return f"used={self.used} peak={self.peak} budget={self.budget or 'unlimited'} {stages}".strip()
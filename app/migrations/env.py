@@ -4,7 +4,7 @@ from alembic import context
 import os
 
 # Импорт твоих моделей и настроек (разрывает цикл, т.к. config загружается после)
-from app.models import Base
+from app.models import Base, load_event_models
 from app.config import settings
 
 # this is the Alembic Config object, which provides
@@ -17,6 +17,7 @@ if config.config_file_name is not None:
 
 # add your model's MetaData object here
 # for 'autogenerate' support
+load_event_models()  # таблицы из ingest_tables и колонки ingest_promoted тоже попадают в metadata
 target_metadata = Base.metadata
 
 # Динамически устанавливаем sqlalchemy.url из settings (из .env)
@@ -0,0 +1,205 @@
+"""${message}
+
+Revision ID: ${up_revision}
+Revises: ${down_revision}
+Create Date: ${create_date}
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = ${repr(up_revision)}
+down_revision: Union[str, Sequence[str], None] = ${repr(down_revision)}
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Сгенерировано `python -m app promoted-migration` по ingest_promoted; список зафиксирован здесь.
+# (таблица строк, представление над ней или None, колонка, тип, JSON-колонка, путь, индекс)
+PROMOTED = [
+% for column in columns:
+    ${repr(column)},
+% endfor
+]
+# Словарные колонки представлений web/mp (миграция c4f8a2d6e913)
+DICTIONARY_COLUMNS = ${repr(dictionary_columns)}
+BATCH_SIZE = 10_000  # строк на UPDATE заполнения: каждая пачка — своя короткая транзакция
+
+SQL_TYPES = {
+    'text': 'varchar',
+    'bigint': 'bigint',
+    'double': 'double precision',
+    'boolean': 'boolean',
+    'timestamp': 'timestamp without time zone',
+    'jsonb': 'jsonb',
+}
+
+# Приведение значения jsonb к типу колонки, как у PromotedExtractor; непреобразуемое — NULL
+CASTS = {
+    'text': "SELECT v #>> '{}'",
+    'bigint': (
+        "SELECT CASE jsonb_typeof(v) "
+        "WHEN 'boolean' THEN (v = 'true'::jsonb)::int::bigint "
+        "WHEN 'number' THEN CASE WHEN v::numeric = trunc(v::numeric) "
+        "AND abs(v::numeric) <= 9223372036854775807 THEN v::numeric::bigint END "
+        "WHEN 'string' THEN CASE WHEN v #>> '{}' ~ '^\\s*[-+]?[0-9]{1,18}\\s*$' "
+        "THEN trim(v #>> '{}')::bigint END END"
+    ),
+    'double': (
+        "SELECT CASE jsonb_typeof(v) "
+        "WHEN 'boolean' THEN (v = 'true'::jsonb)::int::double precision "
+        "WHEN 'number' THEN v::numeric::double precision "
+        "WHEN 'string' THEN CASE WHEN trim(v #>> '{}') ~* '^[-+]?([0-9]+\\.?[0-9]*|\\.[0-9]+)(e[-+]?[0-9]+)?$' "
+        "THEN trim(v #>> '{}')::double precision END END"
+    ),
+    'boolean': (
+        "SELECT CASE jsonb_typeof(v) "
+        "WHEN 'boolean' THEN v = 'true'::jsonb "
+        "WHEN 'number' THEN v::numeric <> 0 "
+        "WHEN 'string' THEN CASE WHEN lower(trim(v #>> '{}')) IN ('true', 't', '1', 'yes') THEN true "
+        "WHEN lower(trim(v #>> '{}')) IN ('false', 'f', '0', 'no') THEN false END END"
+    ),
+    'jsonb': "SELECT CASE WHEN jsonb_typeof(v) <> 'null' THEN v END",
+}
+# Epoch в миллисекундах или секундах, ISO-строка с зоной или без; ошибка разбора — NULL
+TIMESTAMP_CAST = """
+CREATE OR REPLACE FUNCTION pg_temp.promoted_timestamp(v jsonb) RETURNS timestamp LANGUAGE plpgsql IMMUTABLE AS $$
+DECLARE
+    s text := v #>> '{}';
+BEGIN
+    IF jsonb_typeof(v) = 'number' THEN
+        RETURN to_timestamp(CASE WHEN v::numeric > 1e11 THEN v::numeric / 1000 ELSE v::numeric END) AT TIME ZONE 'UTC';
+    ELSIF jsonb_typeof(v) = 'string' THEN
+        IF s ~ '(Z|[+-][0-9]{2}(:?[0-9]{2})?)$' THEN
+            RETURN s::timestamptz AT TIME ZONE 'UTC';
+        END IF;
+        RETURN s::timestamp;
+    END IF;
+    RETURN NULL;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END
+$$
+"""
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def exists(table: str) -> bool:
+    return op.get_bind().execute(sa.text("SELECT to_regclass(:name)"), {'name': table}).scalar() is not None
+
+
+def create_view(view: str, table: str) -> None:
+    """Представление view над table: колонки в порядке таблицы, словарные раскодированы"""
+    existing = op.get_bind().execute(
+        sa.text(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = :table ORDER BY ordinal_position"
+        ),
+        {'table': table},
+    ).scalars().all()
+    id_columns = {f'{c}_id' for c in DICTIONARY_COLUMNS}
+    columns, joins = [], []
+    for column in existing:
+        if column in id_columns:
+            continue
+        if column in DICTIONARY_COLUMNS and f'{column}_id' in existing:
+            columns.append(f'coalesce(d_{column}.value, t.{column}) AS {column}')
+            joins.append(f'LEFT JOIN dim_{column} d_{column} ON d_{column}.id = t.{column}_id')
+        else:
+            columns.append(f't.{quote(column)}')
+    op.execute(f"CREATE OR REPLACE VIEW {view} AS SELECT {', '.join(columns)} FROM {table} t {' '.join(joins)}")
+
+
+def path_sql(json_column: str, path) -> str:
+    """Значение jsonb по пути из JSON-колонки строки t (для sa.text)"""
+    elements = ','.join('"' + p.replace('\\', '\\\\').replace('"', '\\"') + '"' for p in path)
+    # Двоеточие в ключе sa.text принял бы за параметр
+    elements = elements.replace("'", "''").replace(':', '\\:')
+    return f"t.{json_column}::jsonb #> '{{{elements}}}'"
+
+
+def backfill(table: str, columns) -> None:
+    """
+    Заполняет новые колонки у старых строк пачками по insert_id, каждая пачка в своей
+    транзакции: блокировки строк короткие, прерванную миграцию можно запустить снова
+    """
+    connection = op.get_bind()
+    assignments = ', '.join(
+        f'{quote(column)} = coalesce(t.{quote(column)}, pg_temp.promoted_{type_}({path_sql(json_column, path)}))'
+        for _, _, column, type_, json_column, path, _ in columns
+    )
+    # Строки без значений по путям не переписываются
+    pending = ' OR '.join(
+        f'(t.{quote(column)} IS NULL AND {path_sql(json_column, path)} IS NOT NULL)'
+        for _, _, column, _, json_column, path, _ in columns
+    )
+    last = ''
+    while True:
+        last = connection.execute(
+            sa.text(
+                f"WITH batch AS (SELECT insert_id FROM {table} WHERE insert_id > :last "
+                f"ORDER BY insert_id LIMIT :limit), "
+                f"updated AS (UPDATE {table} t SET {assignments} FROM batch b "
+                f"WHERE t.insert_id = b.insert_id AND ({pending})) "
+                f"SELECT max(insert_id) FROM batch"
+            ),
+            {'last': last, 'limit': BATCH_SIZE},
+        ).scalar()
+        if last is None:
+            break
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    present = [c for c in PROMOTED if exists(c[0])]  # таблицы, которых ещё нет, создаст create_all
+    for table, view, column, type_, _, _, _ in present:
+        op.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {quote(column)} {SQL_TYPES[type_]}')
+    for table, view in sorted({(c[0], c[1]) for c in present if c[1]}):
+        create_view(view, table)  # новые колонки добавляются в конец представления
+
+    # Заполнение и индексы — вне транзакции миграции: CONCURRENTLY не блокирует запись
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        for type_, sql in CASTS.items():
+            connection.exec_driver_sql(
+                f'CREATE OR REPLACE FUNCTION pg_temp.promoted_{type_}(v jsonb) RETURNS {SQL_TYPES[type_]} '
+                f'LANGUAGE sql IMMUTABLE AS $$ {sql} $$'
+            )
+        connection.exec_driver_sql(TIMESTAMP_CAST)
+        for table in sorted({c[0] for c in present}):
+            backfill(table, [c for c in present if c[0] == table])
+        for table, view, column, _, _, _, index in present:
+            if not index:
+                continue
+            name = f'ix_{view or table}_{column}'
+            # Индекс, недостроенный прошлым запуском, остаётся INVALID — пересоздаём его
+            invalid = connection.execute(
+                sa.text(
+                    "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                    "WHERE c.relname = :name AND NOT i.indisvalid"
+                ),
+                {'name': name},
+            ).scalar()
+            if invalid:
+                connection.exec_driver_sql(f'DROP INDEX CONCURRENTLY {quote(name)}')
+            connection.exec_driver_sql(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {quote(name)} ON {table} USING {index} ({quote(column)})'
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    present = [c for c in PROMOTED if exists(c[0])]
+    for view in sorted({c[1] for c in present if c[1]}):
+        op.execute(f'DROP VIEW IF EXISTS {view}')
+    for table, view, column, _, _, _, _ in present:
+        op.execute(f'DROP INDEX IF EXISTS {quote(f"ix_{view or table}_{column}")}')
+        op.execute(f'ALTER TABLE {table} DROP COLUMN IF EXISTS {quote(column)}')
+    for table, view in sorted({(c[0], c[1]) for c in present if c[1]}):
+        create_view(view, table)
@@ -0,0 +1,91 @@
+"""add dictionary tables, id columns and decoding views
+
+Revision ID: c4f8a2d6e913
+Revises: e2a7c4d91f35
+Create Date: 2026-10-19 19:40:12.801347
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4f8a2d6e913'
+down_revision: Union[str, Sequence[str], None] = 'e2a7c4d91f35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Список зафиксирован здесь: миграция не зависит от настроек и кода приложения
+COLUMNS = (
+    'country',
+    'city',
+    'region',
+    'os_name',
+    'os_version',
+    'device_brand',
+    'device_model',
+    'platform',
+    'language',
+    'library',
+    'event_type',
+)
+TABLES = ('web', 'mp')
+
+
+def create_view(name: str) -> None:
+    """Представление <name> над <name>_rows: исходные колонки в порядке таблицы, словарные раскодированы"""
+    existing = op.get_bind().execute(
+        sa.text(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = :table ORDER BY ordinal_position"
+        ),
+        {'table': f'{name}_rows'},
+    ).scalars().all()
+    id_columns = {f'{c}_id' for c in COLUMNS}
+    columns, joins = [], []
+    for column in existing:
+        if column in id_columns:
+            continue
+        if column in COLUMNS and f'{column}_id' in existing:
+            columns.append(f'coalesce(d_{column}.value, t.{column}) AS {column}')
+            joins.append(f'LEFT JOIN dim_{column} d_{column} ON d_{column}.id = t.{column}_id')
+        else:
+            columns.append(f't.{column}')
+    op.execute(f"CREATE VIEW {name} AS SELECT {', '.join(columns)} FROM {name}_rows t {' '.join(joins)}")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for column in COLUMNS:
+        op.create_table(
+            f'dim_{column}',
+            sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+            sa.Column('value', sa.String(), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('value'),
+        )
+    # Строки переезжают в <таблица>_rows (переименование — только каталог), а под
+    # прежним именем остаётся представление: существующие запросы не меняются
+    for name in TABLES:
+        op.rename_table(name, f'{name}_rows')
+        for column in COLUMNS:
+            op.add_column(f'{name}_rows', sa.Column(f'{column}_id', sa.Integer(), nullable=True))
+        create_view(name)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for name in TABLES:
+        op.execute(f'DROP VIEW {name}')
+        # Значения, записанные только в словарь, возвращаются в строковые колонки
+        for column in COLUMNS:
+            op.execute(
+                f'UPDATE {name}_rows t SET {column} = d.value FROM dim_{column} d '
+                f'WHERE t.{column}_id = d.id AND t.{column} IS NULL'
+            )
+            op.drop_column(f'{name}_rows', f'{column}_id')
+        op.rename_table(f'{name}_rows', name)
+    for column in COLUMNS:
+        op.drop_table(f'dim_{column}')
@@ -0,0 +1,39 @@
+"""add primary key on insert_id to web and mp
+
+Revision ID: e2a7c4d91f35
+Revises: 8d3a5b0e6c21
+Create Date: 2026-10-19 18:12:40.526104
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a7c4d91f35'
+down_revision: Union[str, Sequence[str], None] = '8d3a5b0e6c21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # В моделях insert_id — первичный ключ, а da342dc39914 удалила прежний id, не добавив его:
+    # без ключа не работают ON CONFLICT (insert_id) роллапов, event_raw и unnest-вставки.
+    # Повторы insert_id (загрузки без ключа дублировали строки) удаляются: остаётся первая
+    # физическая копия (min(ctid)), строки с одним insert_id — одно и то же событие.
+    for table in ('web', 'mp'):
+        op.execute(
+            f"DELETE FROM {table} WHERE ctid IN ("
+            f"SELECT ctid FROM (SELECT ctid, row_number() OVER (PARTITION BY insert_id ORDER BY ctid) AS n "
+            f"FROM {table}) d WHERE d.n > 1)"
+        )
+        op.create_primary_key(f'{table}_pkey', table, ['insert_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('mp_pkey', 'mp', type_='primary')
+    op.drop_constraint('web_pkey', 'web', type_='primary')
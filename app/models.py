@@ -1,124 +1,277 @@
-from sqlalchemy import Column, String, Integer, Float, DateTime, JSON, BigInteger
+from sqlalchemy import (
+    Column,
+    String,
+    Integer,
+    Float,
+    DateTime,
+    JSON,
+    BigInteger,
+    LargeBinary,
+    Text,
+    SmallInteger,
+    Boolean,
+    Index,
+    ForeignKey,
+    func,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 from sqlalchemy.ext.declarative import declarative_base
+from typing import Optional, Sequence, Dict, Any
+
+from app.config import get_settings
 
 Base = declarative_base()
 
 
-class WebEvent(Base):
-    __tablename__ = "web"
-    insert_id = Column(String, primary_key=True)
-    insert_key = Column(String)
-    schema = Column(String)
-    adid = Column(String)
-    amplitude_attribution_ids = Column(JSON)
-    amplitude_event_type = Column(String)
-    amplitude_id = Column(BigInteger)
-    app = Column(Integer)
-    city = Column(String)
-    client_event_time = Column(DateTime, nullable=False)
-    client_upload_time = Column(DateTime)
-    country = Column(String)
-    data_type = Column(String)
-    device_brand = Column(String)
-    device_carrier = Column(String)
-    device_family = Column(String)
-    device_id = Column(String)
-    device_manufacturer = Column(String)
-    device_model = Column(String)
-    device_type = Column(String)
-    dma = Column(String)
-    event_id = Column(Integer)
-    event_time = Column(DateTime)
-    event_type = Column(String)
-    global_user_properties = Column(String)
-    idfa = Column(String)
-    ip_address = Column(String)
-    is_attribution_event = Column(String)
-    language = Column(String)
-    library = Column(String)
-    location_lat = Column(Float)
-    location_lng = Column(Float)
-    os_name = Column(String)
-    os_version = Column(String)
-    partner_id = Column(String)
-    paying = Column(String)
-    platform = Column(String)
-    processed_time = Column(DateTime)
-    region = Column(String)
-    sample_rate = Column(Float)
-    server_received_time = Column(DateTime)
-    server_upload_time = Column(DateTime)
-    session_id = Column(BigInteger)
-    source_id = Column(String)
-    start_version = Column(String)
-    user_creation_time = Column(DateTime)
-    user_id = Column(String)
-    uuid = Column(String)
-    version_name = Column(String)
-    data_json = Column(JSON)
-    event_properties_json = Column(JSON)
-    group_properties_json = Column(JSON)
-    groups_json = Column(JSON)
-    plan_json = Column(JSON)
-    user_properties_json = Column(JSON)
-    extra_json = Column(JSON)
-
-
-class MpEvent(Base):
-    __tablename__ = "mp"
+# Единая спецификация колонок событий: (имя, тип, kwargs для Column)
+EVENT_COLUMNS = [
+    ("insert_id", String, {"primary_key": True}),
+    ("insert_key", String, {}),
+    ("schema", String, {}),
+    ("adid", String, {}),
+    ("amplitude_attribution_ids", JSON, {}),
+    ("amplitude_event_type", String, {}),
+    ("amplitude_id", BigInteger, {}),
+    ("app", Integer, {}),
+    ("city", String, {}),
+    ("client_event_time", DateTime, {"nullable": False}),
+    ("client_upload_time", DateTime, {}),
+    ("country", String, {}),
+    ("data_type", String, {}),
+    ("device_brand", String, {}),
+    ("device_carrier", String, {}),
+    ("device_family", String, {}),
+    ("device_id", String, {}),
+    ("device_manufacturer", String, {}),
+    ("device_model", String, {}),
+    ("device_type", String, {}),
+    ("dma", String, {}),
+    ("event_id", Integer, {}),
+    ("event_time", DateTime, {}),
+    ("event_type", String, {}),
+    ("global_user_properties", String, {}),
+    ("idfa", String, {}),
+    ("ip_address", String, {}),
+    ("is_attribution_event", String, {}),
+    ("language", String, {}),
+    ("library", String, {}),
+    ("location_lat", Float, {}),
+    ("location_lng", Float, {}),
+    ("os_name", String, {}),
+    ("os_version", String, {}),
+    ("partner_id", String, {}),
+    ("paying", String, {}),
+    ("platform", String, {}),
+    ("processed_time", DateTime, {}),
+    ("region", String, {}),
+    ("sample_rate", Float, {}),
+    ("server_received_time", DateTime, {}),
+    ("server_upload_time", DateTime, {}),
+    ("session_id", BigInteger, {}),
+    ("source_id", String, {}),
+    ("start_version", String, {}),
+    ("user_creation_time", DateTime, {}),
+    ("user_id", String, {}),
+    ("uuid", String, {}),
+    ("version_name", String, {}),
+    ("data_json", JSON, {}),
+    ("event_properties_json", JSON, {}),
+    ("group_properties_json", JSON, {}),
+    ("groups_json", JSON, {}),
+    ("plan_json", JSON, {}),
+    ("user_properties_json", JSON, {}),
+    ("extra_json", JSON, {}),
+    ("source_file_id", Integer, {}),  # file_ledger.id архива, из которого пришла строка (с индексом)
+]
+# Без этих колонок строку не вставить или не сверить, они есть в любой таблице событий
+REQUIRED_COLUMNS = ("insert_id", "client_event_time", "source_file_id")
+
+# Строковые колонки web/mp, которые можно хранить словарём dim_<колонка> (миграция c4f8a2d6e913)
+DICTIONARY_COLUMNS = (
+    "country",
+    "city",
+    "region",
+    "os_name",
+    "os_version",
+    "device_brand",
+    "device_model",
+    "platform",
+    "language",
+    "library",
+    "event_type",
+)
+# Строки таблицы со словарями лежат в <таблица>_rows, под именем таблицы — раскодирующее представление
+ROWS_SUFFIX = "_rows"
+
+
+def dimension_id_column(column: str) -> str:
+    return f"{column}_id"
+
+
+def make_event_model(
+    class_name: str, table_name: str, columns: Optional[Sequence[str]] = None, dictionary: bool = False
+):
+    """
+    Declarative-модель таблицы событий; columns — подмножество EVENT_COLUMNS (пусто — все).
+    BRIN по client_event_time: крошечный, почти бесплатный при загрузке и
+    эффективный, пока строки лежат в куче примерно по времени (sort_batches).
+    dictionary — строки в <table_name>_rows с колонками <колонка>_id для DICTIONARY_COLUMNS;
+    индексы называются по table_name, как до переименования таблицы.
+    """
+    attrs = {
+        "__tablename__": table_name + ROWS_SUFFIX if dictionary else table_name,
+        "__table_args__": (
+            Index(f"ix_{table_name}_client_event_time_brin", "client_event_time", postgresql_using="brin"),
+            Index(f"ix_{table_name}_source_file_id", "source_file_id"),
+        ),
+    }
+    for name, type_, kwargs in EVENT_COLUMNS:
+        if columns and name not in columns and name not in REQUIRED_COLUMNS:
+            continue
+        attrs[name] = Column(type_, **kwargs)
+    if dictionary:
+        for column in DICTIONARY_COLUMNS:
+            if column in attrs:
+                attrs[dimension_id_column(column)] = Column(Integer)
+    return type(class_name, (Base,), attrs)
+
+
+WebEvent = make_event_model("WebEvent", "web", dictionary=True)
+MpEvent = make_event_model("MpEvent", "mp", dictionary=True)
+
+# Типы колонок для settings.ingest.promoted
+PROMOTED_TYPES = {
+    "text": String,
+    "bigint": BigInteger,
+    "double": Float,
+    "boolean": Boolean,
+    "timestamp": DateTime,
+    "jsonb": JSONB,
+}
+
+_event_models: Optional[Dict[str, Any]] = None
+
+
+def make_dimension_model(column: str):
+    """Таблица-словарь dim_<column>: значение строковой колонки событий → компактный id"""
+    return type(
+        "Dim" + "".join(p.title() for p in column.split("_")),
+        (Base,),
+        {
+            "__tablename__": f"dim_{column}",
+            "id": Column(Integer, primary_key=True, autoincrement=True),
+            "value": Column(String, nullable=False, unique=True),
+        },
+    )
+
+
+DIMENSION_MODELS: Dict[str, Any] = {column: make_dimension_model(column) for column in DICTIONARY_COLUMNS}
+
+
+def dimension_models() -> Dict[str, Any]:
+    """Словари всех DICTIONARY_COLUMNS: колонка → модель dim_<колонка>"""
+    return DIMENSION_MODELS
+
+
+def load_event_models() -> Dict[str, Any]:
+    """
+    Все таблицы событий: web, mp и дополнительные из settings.ingest.tables
+    (имя → список колонок), плюс колонки и индексы settings.ingest.promoted.
+    Собирается один раз; вызывается до create_all и автогенерации миграций.
+    """
+    global _event_models
+    if _event_models is None:
+        ingest = get_settings().ingest
+        models = {"web": WebEvent, "mp": MpEvent}
+        for name, cols in ingest.tables.items():
+            models[name] = make_event_model(
+                "".join(p.title() for p in name.split("_")) + "Event", name, cols
+            )
+        for prop in ingest.promoted:
+            if prop.type not in PROMOTED_TYPES:
+                raise ValueError(f"Unknown type {prop.type} for promoted column {prop.column}")
+            if prop.index == "gin" and prop.type != "jsonb":
+                raise ValueError(f"GIN index needs jsonb type: {prop.column}")
+            for name in prop.tables or list(models):
+                model = models[name]
+                # declarative добавляет колонку и в таблицу, и в маппинг
+                setattr(model, prop.column, Column(PROMOTED_TYPES[prop.type]()))
+                if prop.index:
+                    Index(
+                        f"ix_{name}_{prop.column}",
+                        model.__table__.c[prop.column],
+                        postgresql_using=prop.index,
+                    )
+        for column in ingest.dictionary_columns:
+            if column not in DICTIONARY_COLUMNS:
+                raise ValueError(f"Dictionary column must be one of {', '.join(DICTIONARY_COLUMNS)}: {column}")
+        _event_models = models
+    return _event_models
+
+
+class DeadLetter(Base):
+    """Строки, отклонённые при разборе (битый JSON, ошибка схемы, нет insert_id)"""
+
+    __tablename__ = "dead_letter"
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    file_key = Column(String, nullable=False, index=True)
+    line_num = Column(Integer, nullable=False)
+    table_name = Column(String)
+    error = Column(Text)
+    raw_text = Column(Text)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+
+class FileLedger(Base):
+    """
+    Учёт загрузки каждого архива: ETag, число строк, контрольная сумма NDJSON
+    и число отказов. id — компактный source_file_id в строках событий.
+    """
+
+    __tablename__ = "file_ledger"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    file_key = Column(String, nullable=False, unique=True)
+    table_name = Column(String, nullable=False)  # таблица задания по умолчанию, для перезаливки
+    etag = Column(String)
+    status = Column(String, nullable=False)  # loading | completed
+    lines = Column(Integer)
+    checksum = Column(String)
+    rows_inserted = Column(BigInteger, nullable=False, server_default="0")
+    rows_rejected = Column(Integer, nullable=False, server_default="0")
+    started_at = Column(DateTime, server_default=func.now(), nullable=False)
+    completed_at = Column(DateTime)
+
+
+class FileLedgerRows(Base):
+    """Сколько строк архива вставлено в каждую таблицу (обновляется в транзакции батча)"""
+
+    __tablename__ = "file_ledger_rows"
+    file_id = Column(Integer, ForeignKey("file_ledger.id", ondelete="CASCADE"), primary_key=True)
+    table_name = Column(String, primary_key=True)
+    rows = Column(BigInteger, nullable=False)
+
+
+class EventRaw(Base):
+    """Сырой JSON событий в режиме raw_payload=side, сжатый zlib"""
+
+    __tablename__ = "event_raw"
     insert_id = Column(String, primary_key=True)
-    insert_key = Column(String)
-    schema = Column(String)
-    adid = Column(String)
-    amplitude_attribution_ids = Column(JSON)
-    amplitude_event_type = Column(String)
-    amplitude_id = Column(BigInteger)
-    app = Column(Integer)
-    city = Column(String)
-    client_event_time = Column(DateTime, nullable=False)
-    client_upload_time = Column(DateTime)
-    country = Column(String)
-    data_type = Column(String)
-    device_brand = Column(String)
-    device_carrier = Column(String)
-    device_family = Column(String)
-    device_id = Column(String)
-    device_manufacturer = Column(String)
-    device_model = Column(String)
-    device_type = Column(String)
-    dma = Column(String)
-    event_id = Column(Integer)
-    event_time = Column(DateTime)
-    event_type = Column(String)
-    global_user_properties = Column(String)
-    idfa = Column(String)
-    ip_address = Column(String)
-    is_attribution_event = Column(String)
-    language = Column(String)
-    library = Column(String)
-    location_lat = Column(Float)
-    location_lng = Column(Float)
-    os_name = Column(String)
-    os_version = Column(String)
-    partner_id = Column(String)
-    paying = Column(String)
-    platform = Column(String)
-    processed_time = Column(DateTime)
-    region = Column(String)
-    sample_rate = Column(Float)
-    server_received_time = Column(DateTime)
-    server_upload_time = Column(DateTime)
-    session_id = Column(BigInteger)
-    source_id = Column(String)
-    start_version = Column(String)
-    user_creation_time = Column(DateTime)
-    user_id = Column(String)
-    uuid = Column(String)
-    version_name = Column(String)
-    data_json = Column(JSON)
-    event_properties_json = Column(JSON)
-    group_properties_json = Column(JSON)
-    groups_json = Column(JSON)
-    plan_json = Column(JSON)
-    user_properties_json = Column(JSON)
-    extra_json = Column(JSON)
+    source_table = Column(String, nullable=False)
+    payload = Column(LargeBinary, nullable=False)
+
+
+class EventRollupHourly(Base):
+    """
+    Часовые роллапы, поддерживаемые при загрузке. users_hll — регистры HyperLogLog:
+    hll_estimate(users_hll) и hll_union_agg(users_hll) создаются миграцией.
+    Отсутствующие event_type/platform/country хранятся как ''.
+    """
+
+    __tablename__ = "event_rollup_hourly"
+    source_table = Column(String, primary_key=True)
+    hour = Column(DateTime, primary_key=True)
+    event_type = Column(String, primary_key=True)
+    platform = Column(String, primary_key=True)
+    country = Column(String, primary_key=True)
+    event_count = Column(BigInteger, nullable=False)
+    users_hll = Column(ARRAY(SmallInteger), nullable=False)
@@ -0,0 +1,197 @@
+"""
+Кэш разобранных архивов на диске (parsed_cache задания). Ключ — ключ объекта
+и ETag: перезаписанный архив в кэш не попадает. При первой загрузке строки,
+прошедшие EventSchema, и отказы разбора пишутся кадрами по FRAME_LINES строк
+(pickle + zlib) во временный файл, который становится записью кэша только
+после того, как архив разобран целиком. Повторная загрузка того же архива
+(start_file, перезаливка, другая таблица) не качает, не распаковывает и не
+разбирает его — строки сразу идут на запись. Кэш ограничен по размеру,
+вытесняются давно не читанные записи (mtime обновляется при каждом чтении).
+Сырой объект события хранится, только если он нужен заданию (raw_payload
+data/side); promoted-свойства берутся из record и model_extra.
+Метаданные (число строк и контрольная сумма NDJSON для file_ledger, версия
+разбора, есть ли сырые объекты) — последним кадром, его смещение — в последних
+8 байтах файла. Запись другой версии разбора (PARSE_VERSION) не читается и
+перезаписывается при следующем разборе.
+Каталог кэша должен быть доступен только самому сервису: записи — pickle.
+"""
+import hashlib
+import os
+import pickle
+import struct
+import zlib
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from app.config import get_settings
+from app.logger import logger
+
+# Версия разбора: поднимается при изменении формата записи, framing, _parse_ndjson или EventSchema
+PARSE_VERSION = 2
+FRAME_LINES = 5000
+COMPRESS_LEVEL = 1  # кэш пишется на горячем пути загрузки, сжатие — самое быстрое
+SUFFIX = ".parsed"
+_HEADER = struct.Struct("<I")
+_TRAILER = struct.Struct("<Q")  # смещение кадра метаданных в конце файла
+
+# Разобранная строка: (номер, record, model_extra, сырой объект, байт, строка) или
+# отказ разбора: (номер, None, ошибка, текст строки, байт, строка). Исходная строка
+# в кэш не пишется: из кэша строки приходят с None на её месте, а без raw — и на
+# месте сырого объекта
+ParsedLine = Tuple[int, Optional[dict], object, object, int, Optional[bytes]]
+
+
+def _write_frame(f: BinaryIO, payload):
+    data = zlib.compress(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL), COMPRESS_LEVEL)
+    f.write(_HEADER.pack(len(data)))
+    f.write(data)
+
+
+def _read_frame(f: BinaryIO):
+    (size,) = _HEADER.unpack(f.read(_HEADER.size))
+    return pickle.loads(zlib.decompress(f.read(size)))
+
+
+class CachedArchive:
+    """Запись кэша: строки архива по порядку; lines и checksum — как при разборе исходного NDJSON"""
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        try:
+            self._file.seek(-_TRAILER.size, os.SEEK_END)
+            (self._meta_offset,) = _TRAILER.unpack(self._file.read(_TRAILER.size))
+            self._file.seek(self._meta_offset)
+            meta = _read_frame(self._file)
+        except Exception:
+            self._file.close()
+            raise
+        self.lines: int = meta["lines"]
+        self.checksum: str = meta["checksum"]
+        self.version: Optional[int] = meta.get("version")
+        self.raw: bool = meta.get("raw", False)
+
+    def __iter__(self) -> Iterator[ParsedLine]:
+        self._file.seek(0)
+        while self._file.tell() < self._meta_offset:
+            for item in _read_frame(self._file):
+                yield (*item, None)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self) -> "CachedArchive":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CacheWriter:
+    """Копит разобранные строки архива и сбрасывает их кадрами во временный файл"""
+
+    def __init__(self, cache: "ParsedCache", path: str, raw: bool = False):
+        self.cache = cache
+        self.path = path
+        self.raw = raw
+        self._tmp = f"{path}.{os.getpid()}.tmp"
+        self._file = open(self._tmp, "wb")
+        self._frame: List[ParsedLine] = []
+
+    def add(self, item: ParsedLine):
+        line_num, record, extra, raw, nbytes, _line = item
+        if record is None:
+            # Отказ разбора: raw — текст строки для dead_letter, он нужен всегда
+            self._frame.append((line_num, None, extra, raw, nbytes))
+        else:
+            # Копия: вызывающий дописывает в record служебные поля (source_file_id и т.п.)
+            self._frame.append((line_num, dict(record), extra, raw if self.raw else None, nbytes))
+        if len(self._frame) >= FRAME_LINES:
+            self._flush()
+
+    def _flush(self):
+        if self._frame:
+            _write_frame(self._file, self._frame)
+            self._frame = []
+
+    def finish(self, lines: int, checksum: str):
+        """Архив разобран целиком: запись становится видна в кэше"""
+        self._flush()
+        meta_offset = self._file.tell()
+        meta = {"lines": lines, "checksum": checksum, "version": self.cache.version, "raw": self.raw}
+        _write_frame(self._file, meta)
+        self._file.write(_TRAILER.pack(meta_offset))
+        self._file.close()
+        os.replace(self._tmp, self.path)
+        self.cache.evict()
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+
+
+class ParsedCache:
+    def __init__(self, directory: str, max_bytes: int, version: int = PARSE_VERSION):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version = version
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_options(cls, options) -> Optional["ParsedCache"]:
+        """None — кэш заданию выключен"""
+        ingest = get_settings().ingest
+        if not options.get("parsed_cache") or ingest.parsed_cache_max_bytes <= 0:
+            return None
+        return cls(ingest.parsed_cache_dir, ingest.parsed_cache_max_bytes)
+
+    def path(self, file_key: str, etag: str) -> str:
+        digest = hashlib.sha256(f"{file_key}\0{etag}".encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + SUFFIX)
+
+    def open(self, file_key: str, etag: Optional[str], raw: bool = False) -> Optional[CachedArchive]:
+        """raw — заданию нужны сырые объекты: запись без них не подходит"""
+        if not etag:
+            return None
+        path = self.path(file_key, etag)
+        try:
+            archive = CachedArchive(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Broken parsed cache entry for {file_key}, ignoring: {e}")
+            return None
+        if archive.version != self.version:
+            archive.close()
+            logger.info(f"Parsed cache entry for {file_key} was parsed by another version, ignoring")
+            return None
+        if raw and not archive.raw:
+            archive.close()
+            logger.info(f"Parsed cache entry for {file_key} has no raw objects, ignoring")
+            return None
+        os.utime(path)  # отметка для LRU
+        return archive
+
+    def writer(self, file_key: str, etag: Optional[str], raw: bool = False) -> Optional[CacheWriter]:
+        """raw — хранить сырые объекты событий (raw_payload data/side)"""
+        if not etag:
+            return None
+        return CacheWriter(self, self.path(file_key, etag), raw)
+
+    def evict(self):
+        """Удалить давно не читанные записи, пока кэш не уложится в max_bytes"""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(SUFFIX) and entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            logger.debug(f"Evicted parsed cache entry {path}")
@@ -1,127 +1,346 @@
 import zipfile
-import io
 import json
-import gc
+import hashlib
 import asyncio
+import threading
 from multiprocessing import Process
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterator, BinaryIO, Iterator
+from collections import defaultdict
+from contextlib import AsyncExitStack
 from datetime import datetime
 
-from sqlalchemy import insert
-from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import get_settings
+from app.sources import SOURCES, get_source, use_source
+from app.journal import load_journal, prefix_journal, prefix_of, update_completed_file, update_load_profile
+from app.routing import get_registry, TableTarget
+from app.schemas import EventSchema, JobOptions, PrefixSpec
+from app.writer import BatchWriter, CommitPolicy, COMMIT_POLICIES, WRITE_METHODS
+from app.dead_letter import DeadLetterSink, ErrorBudgetExceeded, DEAD_LETTER_MODES
+from app.memory import MemoryGovernor, buffer_bytes, ROW_BYTES_FACTOR
+from app.throttle import DbThrottle
+from app.scheduler import FairShareScheduler
+from app.load_profiles import load_profile_names, use_load_profile
+from app.window import TimeWindow, day_start_after, key_order
+from app.promoted import get_extractor
+from app.dictionary import get_dictionary
+from app.parsed_cache import CacheWriter, ParsedCache
+from app.raw_payload import raw_target, compress_payload, RAW_PAYLOAD_MODES
+from app.tail import make_feed
+from app.framing import iter_lines, get_decoder, decode_line, line_text
+from app import ledger
+from app.profiling import start_profile_watcher
+from app.logger import logger, flush_logs
+
+
+# ---------------- СКАЧИВАНИЕ ---------------- #
+async def fetch_object(file_key: str, governor: MemoryGovernor, prefetch: bool = False) -> BinaryIO:
+    """Открыть архив источника и учесть его буфер в стадии download; префетч ждёт запаса по памяти"""
+    if prefetch:
+        await governor.wait_for_headroom()
+    buffer = await asyncio.to_thread(get_source().open_object, file_key)
+    governor.hold("download", buffer_bytes(buffer))
+    return buffer
+
+
+# ---------------- РАЗБОР ---------------- #
+class _ParseResult:
+    """Итог разбора NDJSON (как у CachedArchive): число строк и контрольная сумма"""
+
+    def __init__(self):
+        self.lines = 0
+        self.checksum: Optional[str] = None
+
+
+# Имя поля EventSchema → ключ исходного объекта события
+_FIELD_ALIASES = {name: field.alias or name for name, field in EventSchema.model_fields.items()}
+
+
+def _raw_view(record: dict, extra: Optional[dict]) -> dict:
+    """Исходный объект события, собранный из record и model_extra (строки кэша без сырых объектов)"""
+    view = dict(extra or {})
+    for name, value in record.items():
+        view[_FIELD_ALIASES.get(name, name)] = value
+    return view
+
+
+def _parse_ndjson(
+    ndjson: BinaryIO,
+    file_key: str,
+    resume_line: int,
+    result: _ParseResult,
+    cache_writer: Optional[CacheWriter] = None,
+) -> Iterator[tuple]:
+    """
+    Разобранные строки NDJSON после resume_line: (номер, record, model_extra,
+    сырой объект, байт, строка) или отказ (номер, None, ошибка, текст, байт, строка).
+    cache_writer получает каждую разобранную строку для кэша.
+    """
+    ingest = get_settings().ingest
+    decode = get_decoder(ingest.json_decoder)
+    checksum = hashlib.blake2b(digest_size=16)
+    for line_num, line in iter_lines(ndjson, ingest.read_block_size, checksum.update):
+        result.lines = line_num
+        if line_num <= resume_line:
+            continue
+        if not line or line[0] == 0x5B:  # пустая строка или "["
+            continue
 
-from app.database import AsyncSessionLocal
-from app.s3_client import S3Client
-from app.journal import load_journal, update_completed_file, update_current_progress
-from app.models import WebEvent, MpEvent
-from app.schemas import EventSchema
-from app.logger import logger, file_handler
-
-s3 = S3Client()
-MAX_PARAMS = 20000  # лимит параметров на execute в asyncpg
-
-
-# ---------------- ВСТАВКА БАТЧЕЙ ---------------- #
-async def insert_batch(session: AsyncSession, table_model, data_list: List[dict]):
-    """Безопасная вставка батчей с разделением на под-батчи."""
-    if not data_list:
-        return
-
-    num_columns = len(data_list[0]) or 1
-    chunk_size = max(1, MAX_PARAMS // num_columns)
-
-    for i in range(0, len(data_list), chunk_size):
-        sub_chunk = data_list[i : i + chunk_size]
-        stmt = insert(table_model).values(sub_chunk)
-        await session.execute(stmt)
-
-    await session.commit()
-    logger.debug(f"Inserted {len(data_list)} rows into {table_model.__tablename__}")
-    file_handler.flush()
+        try:
+            raw_obj = decode_line(decode, line)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Invalid JSON in {file_key}:{line_num}: {e}")
+            item = (line_num, None, f"Invalid JSON: {e}", line_text(line), len(line), line)
+        else:
+            try:
+                ev = EventSchema(**raw_obj)
+                record = ev.model_dump(by_alias=False, exclude_unset=True)
+                item = (line_num, record, ev.model_extra, raw_obj, len(line), line)
+            except Exception as e:
+                logger.warning(f"Pydantic parse failed at {file_key}:{line_num}: {e}")
+                item = (line_num, None, str(e), line_text(line), len(line), line)
+        if cache_writer is not None:
+            cache_writer.add(item)
+        yield item
+    result.checksum = checksum.hexdigest()
 
 
 # ---------------- ОБРАБОТКА ОДНОГО ФАЙЛА ---------------- #
-async def process_file(file_key: str, table_name: str, batch_size: int = 100):
+def options_error(options: JobOptions, tables: Optional[List[str]] = None) -> Optional[str]:
+    """Ошибка в таблицах или опциях задания или None (общая проверка API и CLI)"""
+    registry = get_registry()
+    for table in tables or []:
+        if table not in registry:
+            logger.warning(f"Invalid table_name: {table}")
+            return f"Table must be one of {', '.join(registry.targets)}"
+    checks = (
+        ("commit_policy", COMMIT_POLICIES),
+        ("source", SOURCES),
+        ("write_method", WRITE_METHODS),
+        ("load_profile", load_profile_names()),
+        ("dead_letter", DEAD_LETTER_MODES),
+        ("raw_payload", RAW_PAYLOAD_MODES),
+    )
+    for name, allowed in checks:
+        value = getattr(options, name)
+        if value and value not in allowed:
+            logger.warning(f"Invalid {name}: {value}")
+            return f"{name} must be one of {', '.join(allowed)}"
+    return None
+
+
+async def process_file(
+    file_key: str,
+    table_name: str,
+    options: Optional[JobOptions] = None,
+    dead_letter: Optional[DeadLetterSink] = None,
+    governor: Optional[MemoryGovernor] = None,
+    download: Optional["asyncio.Future[BinaryIO]"] = None,
+    etag: Optional[str] = None,
+    replay: bool = False,
+    throttle: Optional[DbThrottle] = None,
+) -> bool:
+    """
+    False — файл не загружен, ошибка записана в лог; при превышении бюджета
+    ошибок исключение ErrorBudgetExceeded идёт дальше.
+    download — уже запущенное скачивание этого файла (префетч), иначе качаем сами.
+    etag — из листинга, для file_ledger и кэша разбора. replay — перезаливка: прежние
+    строки файла удаляются и файл грузится заново в одной транзакции, журнал не трогается.
+    Если архив есть в кэше разбора (parsed_cache), он не качается и не разбирается.
+    """
     logger.info(f"Processing file: {file_key} for table: {table_name}")
+    options = options or JobOptions()
+    batch_size = options.get("batch_size")
+    policy = CommitPolicy("file") if replay else CommitPolicy.from_options(options)
+    dead_letter = dead_letter or DeadLetterSink(
+        options.get("dead_letter"), options.get("error_budget")
+    )
+    governor = governor or MemoryGovernor(options.get("memory_budget"))
+    throttle = throttle or DbThrottle.from_options(options)
+    window = TimeWindow.from_options(options)
+    cache = ParsedCache.from_options(options)
+    cache_writer: Optional[CacheWriter] = None
+    outside_window = 0
+    held = 0
+    batch_bytes = 0  # разобранные строки, ждущие записи: стадия parse
     try:
-        zip_bytes = s3.get_object(file_key)
-        with io.BytesIO(zip_bytes) as zip_buffer:
-            with zipfile.ZipFile(zip_buffer) as zf:
+        resume_line = 0
+        journal = prefix_journal(load_journal(), prefix_of(file_key))
+        if not replay and journal.get("current_file") == file_key:
+            resume_line = journal.get("current_line", 0)
+            logger.info(f"Resuming from line {resume_line}")
+
+        if etag is None:
+            etag = await asyncio.to_thread(get_source().head_etag, file_key)
+        # Сырой объект события нужен только для data_json целиком и event_raw
+        needs_raw = options.get("raw_payload") in ("data", "side")
+        cached = cache.open(file_key, etag, needs_raw) if cache else None
+
+        async with AsyncExitStack() as stack:
+            if cached is not None:
+                logger.info(f"Parsed cache hit for {file_key}, skipping download and parsing")
+                parsed = stack.enter_context(cached)
+                lines = iter(cached)
+                if download is not None:
+                    await _discard_download(asyncio.ensure_future(download), governor)
+            else:
+                zip_buffer = await (download or fetch_object(file_key, governor))
+                held = buffer_bytes(zip_buffer)
+                stack.enter_context(zip_buffer)
+                zf = stack.enter_context(zipfile.ZipFile(zip_buffer))
                 ndjson_files = [f for f in zf.namelist() if f.endswith(".ndjson")]
                 if not ndjson_files:
                     logger.warning(f"No .ndjson file found in {file_key}")
-                    return
+                    return False
 
                 ndjson_file = ndjson_files[0]
                 logger.info(f"Found NDJSON: {ndjson_file}")
-
-                with zf.open(ndjson_file) as ndjson:
-                    line_num = 0
-                    batch: List[Dict[str, Any]] = []
-                    journal = load_journal()
-
-                    if journal.get("current_file") == file_key:
-                        line_num = journal.get("current_line", 0)
-                        logger.info(f"Resuming from line {line_num}")
-
-                    async with AsyncSessionLocal() as session:
-                        table_model = WebEvent if table_name == "web" else MpEvent
-
-                        for raw_line in ndjson:
-                            text = raw_line.decode("utf-8", errors="ignore").strip()
-                            line_num += 1
-
-                            if line_num <= journal.get("current_line", 0):
-                                continue
-                            if not text or text.startswith("["):
-                                continue
-
-                            try:
-                                raw_obj = json.loads(text)
-                            except json.JSONDecodeError as e:
-                                logger.warning(f"Invalid JSON in {file_key}:{line_num}: {e}")
-                                update_current_progress(file_key, line_num)
-                                continue
-
-                            try:
-                                ev = EventSchema(**raw_obj)
-                                record = ev.model_dump(by_alias=False, exclude_unset=True)
-                            except Exception as e:
-                                logger.error(f"Pydantic parse failed at {file_key}:{line_num}: {e}")
-                                update_current_progress(file_key, line_num)
-                                raise
-
-                            insert_id_val = record.get("insert_id")
-                            if not insert_id_val:
-                                logger.error(f"Missing insert_id at {file_key}:{line_num}")
-                                update_current_progress(file_key, line_num)
-                                raise ValueError(f"insert_id missing in {file_key}:{line_num}")
-
-                            # fallback для data_json, если нет
-                            if "data_json" not in record:
-                                record["data_json"] = raw_obj.get("data", raw_obj)
-
-                            batch.append(record)
-
-                            if len(batch) >= batch_size:
-                                await insert_batch(session, table_model, batch)
-                                batch.clear()
-                                update_current_progress(file_key, line_num)
-                                if line_num % 5000 == 0:
-                                    logger.info(f"Processed {line_num} lines in {file_key}")
-
-                        if batch:
-                            await insert_batch(session, table_model, batch)
-                            batch.clear()
-
-        update_completed_file(file_key)
-        logger.info(f"Completed file: {file_key} ({line_num} lines)")
-        file_handler.flush()
-        gc.collect()
-
+                ndjson = stack.enter_context(zf.open(ndjson_file))
+                if cache is not None and not resume_line:
+                    # В кэш попадает только архив, разобранный с первой строки
+                    cache_writer = cache.writer(file_key, etag, needs_raw)
+                parsed = _ParseResult()
+                lines = _parse_ndjson(ndjson, file_key, resume_line, parsed, cache_writer)
+
+            batch: Dict[TableTarget, List[Dict[str, Any]]] = defaultdict(list)
+            batch_rows = 0
+            file_id = await ledger.open_file(file_key, table_name, etag, reset=not resume_line)
+            rejected_before = dead_letter.rejected
+
+            route = get_registry().router(table_name, file_key)
+            promote = get_extractor()
+            raw_payload = options.get("raw_payload")
+            side = raw_target() if raw_payload == "side" else None
+            async with BatchWriter(
+                file_key,
+                policy,
+                options.get("pipeline_writes"),
+                dead_letter,
+                governor,
+                options.get("rollups"),
+                ledger=ledger.LedgerCounts(file_id),
+                prepare=(
+                    (
+                        lambda session: ledger.delete_file_rows(
+                            session, file_id, file_key, rollups=options.get("rollups")
+                        )
+                    )
+                    if replay
+                    else None
+                ),
+                journal=not replay,
+                throttle=throttle,
+                write_method=options.get("write_method"),
+                sort_batches=options.get("sort_batches"),
+                dictionary=get_dictionary(),
+            ) as writer:
+
+                for line_num, record, extra, raw_obj, nbytes, line in lines:
+                    if line_num <= resume_line:  # строки из кэша до места возобновления
+                        continue
+                    if record is None:
+                        # Отказ разбора: extra — ошибка, raw_obj — текст строки
+                        dead_letter.reject(file_key, line_num, table_name, extra, raw_obj)
+                        continue
+
+                    if window and not window.contains(record["client_event_time"]):
+                        outside_window += 1
+                        continue
+
+                    insert_id_val = record.get("insert_id")
+                    if not insert_id_val:
+                        logger.warning(f"Missing insert_id at {file_key}:{line_num}")
+                        text = line_text(line) if line is not None else json.dumps(raw_obj, ensure_ascii=False)
+                        dead_letter.reject(file_key, line_num, table_name, "Missing insert_id", text)
+                        continue
+
+                    record["source_file_id"] = file_id
+                    if raw_payload == "data":
+                        # fallback для data_json, если нет
+                        if "data_json" not in record:
+                            record["data_json"] = raw_obj.get("data", raw_obj)
+                    elif raw_payload == "extra":
+                        record["extra_json"] = extra or None
+                    if promote:
+                        promote.apply(raw_obj if raw_obj is not None else _raw_view(record, extra), record)
+
+                    target = route(record)
+                    batch[target].append(target.encode(record))
+                    if side is not None:
+                        if line is None:  # из кэша: исходной строки нет, сохраняем тот же объект
+                            line = json.dumps(raw_obj, ensure_ascii=False).encode("utf-8")
+                        batch[side].append(
+                            {
+                                "insert_id": insert_id_val,
+                                "source_table": target.name,
+                                "payload": compress_payload(line),
+                            }
+                        )
+                    batch_rows += 1
+                    batch_bytes += nbytes * ROW_BYTES_FACTOR
+                    governor.hold("parse", nbytes * ROW_BYTES_FACTOR)
+
+                    if batch_rows >= throttle.batch_size(governor.batch_size(batch_size)):
+                        # Батч переходит из parse во write; под давлением памяти парсер
+                        # ждёт здесь, пока писатель не освободит бюджет
+                        governor.release("parse", batch_bytes)
+                        queued, batch_bytes = batch_bytes, 0
+                        await governor.acquire("write", queued)
+                        await writer.write(batch, line_num, queued)
+                        batch = defaultdict(list)
+                        batch_rows = 0
+                        if line_num % 5000 == 0:
+                            logger.info(f"Processed {line_num} lines in {file_key}")
+
+                # Пишем хвост даже пустым: коммит сбросит отказы и сдвинет журнал
+                governor.release("parse", batch_bytes)
+                queued, batch_bytes = batch_bytes, 0
+                await governor.acquire("write", queued)
+                await writer.write(batch, parsed.lines, queued)
+
+        if cache_writer is not None:
+            cache_writer.finish(parsed.lines, parsed.checksum)
+            cache_writer = None
+        await ledger.complete_file(
+            file_id, parsed.lines, parsed.checksum, dead_letter.rejected - rejected_before
+        )
+        if not replay:
+            update_completed_file(file_key)
+        logger.info(
+            f"Completed file: {file_key} ({parsed.lines} lines, {outside_window} outside time window, "
+            f"{dead_letter.rejected} rejected in job)"
+        )
+        if promote.failed:
+            logger.warning(f"{promote.failed} promoted values could not be converted so far, stored as NULL")
+        logger.debug(f"Memory after {file_key}: {governor.summary()}")
+        if throttle.enabled:
+            logger.info(f"DB throttle after {file_key}: {throttle.summary()}")
+        flush_logs()
+        return True
+
+    except ErrorBudgetExceeded:
+        await dead_letter.flush_all()
+        flush_logs()
+        raise
     except Exception as e:
         logger.error(f"Error processing {file_key}: {e}", exc_info=True)
-        file_handler.flush()
+        flush_logs()
+        return False
+    finally:
+        if cache_writer is not None:
+            cache_writer.abort()
+        governor.release("download", held)
+        governor.release("parse", batch_bytes)
+
+
+async def _discard_download(task: asyncio.Task, governor: MemoryGovernor):
+    """Отменить ненужный префетч и вернуть его память"""
+    task.cancel()
+    try:
+        buffer = await task
+    except BaseException:
+        return
+    governor.release("download", buffer_bytes(buffer))
+    buffer.close()
 
 
 # ---------------- АСИНХРОННЫЙ ПРОЦЕСС ---------------- #
@@ -130,14 +349,71 @@ async def background_processor_async(
     table_name: str,
     start_file: Optional[str] = None,
     start_date: Optional[str] = None,
-):
+    options: Optional[JobOptions] = None,
+) -> bool:
+    """False — задание остановлено бюджетом ошибок или часть файлов не загружена"""
     logger.info(f"Starting async processor for prefix={prefix}, table={table_name}")
-    objects = s3.list_objects(prefix)
+    options = options or JobOptions()
+    use_source(options.source)
+    _apply_load_profile(options)
+    dead_letter = DeadLetterSink(options.get("dead_letter"), options.get("error_budget"))
+    window = TimeWindow.from_options(options)
+    governor = MemoryGovernor(options.get("memory_budget"))
+    throttle = DbThrottle.from_options(options)
+    journal = prefix_journal(load_journal(), prefix)
+    failed: List[str] = []
+
+    if options.get("stream_listing") and not start_date:
+        # По дням листинга, внутри дня по часу, а не по LastModified: обработка идёт, пока листинг не закончен
+        listed = _ObjectStream(prefix, start_file, journal, window)
+        finished = await _process_objects(
+            listed, None, table_name, options, dead_letter, governor, throttle, failed
+        )
+        last_listed = listed.last_key
+    else:
+        objects = get_source().list_objects(prefix)
+        start_idx = _start_index(objects, prefix, start_file, start_date, journal)
+        if start_idx is None:
+            return True
+        last_listed = max((obj["Key"] for obj in objects), key=key_order, default=None)
+        objects = objects[start_idx:]
+        if window:
+            # Файлы, чей час в имени не пересекается с окном, не качаем вовсе
+            kept = [obj for obj in objects if window.may_contain(obj["Key"])]
+            logger.info(
+                f"Time window {window.start}..{window.end}: {len(kept)} of "
+                f"{len(objects)} files may contain events"
+            )
+            objects = kept
+        finished = await _process_objects(
+            _iterate(objects), len(objects), table_name, options, dead_letter, governor, throttle, failed
+        )
+    if not finished:
+        return False
+    if failed:
+        logger.error(f"{len(failed)} files failed: {', '.join(failed)}")
+    else:
+        logger.info("All files processed successfully.")
+
+    if options.get("follow"):
+        finished = await follow_prefix(
+            prefix, table_name, last_listed, options, dead_letter, governor, window, throttle=throttle
+        )
+    return finished and not failed
+
+
+def _apply_load_profile(options: JobOptions):
+    name = options.get("load_profile")
+    update_load_profile(name, use_load_profile(name))
+
+
+def _start_index(
+    objects: List[Dict], prefix: str, start_file: Optional[str], start_date: Optional[str], journal: Dict
+) -> Optional[int]:
+    """С какого файла (в порядке LastModified) начинать; None — начинать не с чего"""
     object_keys = [obj["Key"] for obj in objects]
-    journal = load_journal()
     last_completed = journal.get("last_completed_file")
     current_file = journal.get("current_file")
-    current_line = journal.get("current_line", 0)
 
     start_idx = 0
 
@@ -148,7 +424,7 @@ async def background_processor_async(
             )
         except ValueError:
             logger.error(f"File {start_file} not found")
-            return
+            return None
     elif start_date:
         parsed_date = datetime.fromisoformat(start_date)
         start_idx = next(
@@ -157,7 +433,7 @@ async def background_processor_async(
         )
         if start_idx == len(objects):
             logger.error(f"No files after {start_date}")
-            return
+            return None
     elif last_completed:
         try:
             start_idx = object_keys.index(last_completed) + 1
@@ -168,24 +444,332 @@ async def background_processor_async(
             start_idx = object_keys.index(current_file)
         except ValueError:
             logger.warning(f"Current file {current_file} not found")
+    return start_idx
+
+
+async def _iterate(objects: List[Dict]) -> AsyncIterator[Dict]:
+    for obj in objects:
+        yield obj
+
+
+class _ObjectStream:
+    """
+    Файлы префикса по мере листинга (S3Client.iter_objects в отдельном потоке),
+    начиная с start_file или с места по журналу. Ключи одного дня идут в листинге
+    подряд; они копятся и отдаются по key_order (час из имени, затем ключ), дни —
+    в порядке листинга. last_key — последний по key_order увиденный ключ, для follow.
+    """
+
+    def __init__(self, prefix: str, start_file: Optional[str], journal: Dict, window: TimeWindow):
+        self.prefix = prefix
+        self.window = window
+        self.last_key: Optional[str] = None
+        # (ключ, включительно): первый файл, который надо обработать
+        if start_file:
+            self.start = (prefix + start_file if not start_file.startswith(prefix) else start_file, True)
+        elif journal.get("last_completed_file"):
+            self.start = (journal["last_completed_file"], False)
+        elif journal.get("current_file"):
+            self.start = (journal["current_file"], True)
+        else:
+            self.start = None
+
+    def _select(self, day: List[Dict]) -> List[Dict]:
+        """Файлы одного дня по key_order, без идущих до места старта и вне окна"""
+        selected = []
+        for obj in sorted(day, key=lambda o: key_order(o["Key"])):
+            key = obj["Key"]
+            if self.last_key is None or key_order(key) > key_order(self.last_key):
+                self.last_key = key
+            if self.start is not None:
+                bound, inclusive = self.start
+                if key_order(key) < key_order(bound) or (key == bound and not inclusive):
+                    continue
+            if self.window and not self.window.may_contain(key):
+                continue
+            selected.append(obj)
+        return selected
+
+    async def __aiter__(self) -> AsyncIterator[Dict]:
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for obj in get_source().iter_objects(self.prefix):
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, obj)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        producer = loop.run_in_executor(None, produce)
+        day_key: Optional[str] = None
+        day: List[Dict] = []
+        try:
+            while True:
+                item = await queue.get()
+                if isinstance(item, Exception):
+                    raise item
+                if item is done or day_start_after(item["Key"]) != day_key:
+                    for obj in self._select(day):
+                        yield obj
+                    if item is done:
+                        break
+                    day_key, day = day_start_after(item["Key"]), []
+                day.append(item)
+        finally:
+            stop.set()
+            await producer
+
+
+async def _process_objects(
+    objects: AsyncIterator[Dict],
+    total: Optional[int],
+    table_name: str,
+    options: JobOptions,
+    dead_letter: DeadLetterSink,
+    governor: MemoryGovernor,
+    throttle: DbThrottle,
+    failed: List[str],
+) -> bool:
+    """
+    Обработать файлы по порядку с префетчем следующего; False — задание остановлено.
+    Ключи незагруженных файлов добавляются в failed.
+    """
+    prefetch = options.get("prefetch")
+    listed = objects.__aiter__()
+    current = await anext(listed, None)
+    next_download: Optional[asyncio.Task] = None
+    idx = 0
+    try:
+        while current is not None:
+            idx += 1
+            file_key = current["Key"]
+            logger.info(f"Processing file {idx}/{total or '?'}: {file_key}")
+            following = await anext(listed, None)
+            download, next_download = next_download, None
+            if prefetch and following is not None:
+                # Следующий архив качается, пока обрабатывается текущий (если хватает памяти)
+                next_download = asyncio.create_task(
+                    fetch_object(following["Key"], governor, prefetch=True)
+                )
+            try:
+                if not await process_file(
+                    file_key,
+                    table_name,
+                    options,
+                    dead_letter,
+                    governor,
+                    download,
+                    current.get("ETag"),
+                    throttle=throttle,
+                ):
+                    failed.append(file_key)
+            except ErrorBudgetExceeded as e:
+                logger.error(f"Stopping job at {file_key}: {e}")
+                flush_logs()
+                return False
+            flush_logs()
+            current = following
+    finally:
+        if next_download is not None:
+            await _discard_download(next_download, governor)
+        await listed.aclose()  # останавливает потоковый листинг, если задание прервано
+    return True
+
+
+async def follow_prefix(
+    prefix: str,
+    table_name: str,
+    start_after: Optional[str],
+    options: JobOptions,
+    dead_letter: DeadLetterSink,
+    governor: MemoryGovernor,
+    window: TimeWindow,
+    source=None,
+    throttle: Optional[DbThrottle] = None,
+) -> bool:
+    """
+    Режим follow: обрабатывать новые архивы по мере появления (source — источник уведомлений).
+    Возвращается, только когда задание остановлено бюджетом ошибок (False).
+    """
+    feed = make_feed(prefix, start_after, options, source)
+    # Архивы окна опоздавших, загруженные до follow, повторно не берутся
+    feed.seen.update(await ledger.completed_keys(prefix, feed.seen.start_after()))
+    async for file_key in feed:
+        if window and not window.may_contain(file_key):
+            continue
+        logger.info(f"New file: {file_key}")
+        try:
+            await process_file(file_key, table_name, options, dead_letter, governor, throttle=throttle)
+        except ErrorBudgetExceeded as e:
+            logger.error(f"Stopping job at {file_key}: {e}")
+            flush_logs()
+            return False
+        flush_logs()
+    return True
+
+
+# ---------------- НЕСКОЛЬКО ПРЕФИКСОВ ---------------- #
+async def process_prefixes_async(
+    specs: List[PrefixSpec], start_date: Optional[str] = None, options: Optional[JobOptions] = None
+) -> bool:
+    """
+    Одно задание на несколько (префикс, таблица): файлы префиксов чередуются
+    FairShareScheduler'ом по весам, одновременно грузится до prefix_concurrency
+    файлов (по одному на префикс). Веса делят слоты, только когда префиксов
+    больше, чем слотов. Память, бюджет ошибок и торможение общие.
+    False — задание остановлено бюджетом ошибок или часть файлов не загружена.
+    """
+    options = options or JobOptions()
+    logger.info(f"Starting multi-prefix processor for {len(specs)} prefixes")
+    use_source(options.source)
+    _apply_load_profile(options)
+    dead_letter = DeadLetterSink(options.get("dead_letter"), options.get("error_budget"))
+    window = TimeWindow.from_options(options)
+    governor = MemoryGovernor(options.get("memory_budget"))
+    throttle = DbThrottle.from_options(options)
+    if options.get("follow") or options.get("stream_listing"):
+        logger.warning("follow and stream_listing are not supported for multi-prefix jobs, ignored")
+    journal = load_journal()
+
+    listings = await asyncio.gather(
+        *(asyncio.to_thread(get_source().list_objects, spec.prefix) for spec in specs)
+    )
+    queues: Dict[str, List[Dict]] = {}
+    for spec, objects in zip(specs, listings):
+        start_idx = _start_index(objects, spec.prefix, None, start_date, prefix_journal(journal, spec.prefix))
+        if start_idx is None:
+            continue
+        queues[spec.prefix] = [
+            obj for obj in objects[start_idx:] if not window or window.may_contain(obj["Key"])
+        ]
+        logger.info(f"Prefix {spec.prefix}: {len(queues[spec.prefix])} files to process")
+    tables = {spec.prefix: spec.table_name for spec in specs}
+    scheduler = FairShareScheduler(queues, {spec.prefix: spec.weight for spec in specs})
+    stopped = False
+    failed: List[str] = []
+
+    async def worker():
+        nonlocal stopped
+        while True:
+            taken = await scheduler.take()
+            if taken is None:
+                return
+            prefix, obj = taken
+            file_key = obj["Key"]
+            logger.info(f"Processing file {scheduler.issued[prefix]}/{len(queues[prefix])} of {prefix}: {file_key}")
+            try:
+                loaded = await process_file(
+                    file_key,
+                    tables[prefix],
+                    options,
+                    dead_letter,
+                    governor,
+                    # Скачивание ждёт запаса по памяти, пока остальные слоты держат свои архивы
+                    fetch_object(file_key, governor, prefetch=True),
+                    obj.get("ETag"),
+                    throttle=throttle,
+                )
+                if not loaded:
+                    failed.append(file_key)
+            except ErrorBudgetExceeded as e:
+                logger.error(f"Stopping job at {file_key}: {e}")
+                stopped = True
+                await scheduler.close()
+            finally:
+                await scheduler.release(prefix)
+                flush_logs()
+
+    concurrency = max(1, min(options.get("prefix_concurrency"), len(queues) or 1))
+    if concurrency == len(queues) and len({spec.weight for spec in specs if spec.prefix in queues}) > 1:
+        # У каждого префикса свой слот: веса ни на что не влияют
+        logger.warning(
+            f"Prefix weights have no effect: {len(queues)} prefixes fit into prefix_concurrency "
+            f"{options.get('prefix_concurrency')}, each loads one file at a time"
+        )
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    if failed:
+        logger.error(f"{len(failed)} files failed: {', '.join(failed)}")
+    elif not stopped:
+        logger.info("All files of all prefixes processed successfully.")
+    return not stopped and not failed
+
+
+def background_prefixes(specs: List[PrefixSpec], start_date: Optional[str] = None, options: Optional[JobOptions] = None):
+    get_settings()
+    start_profile_watcher()
+    asyncio.run(process_prefixes_async(specs, start_date, options))
+
+
+def start_prefixes(specs: List[PrefixSpec], start_date: Optional[str] = None, options: Optional[JobOptions] = None):
+    logger.info(f"Starting background process for {len(specs)} prefixes")
+    p = Process(target=background_prefixes, args=(specs, start_date, options))
+    p.start()
+    logger.info(f"Spawned process PID={p.pid}")
+    return p
+
+
+# ---------------- СВЕРКА И ПЕРЕЗАЛИВКА ---------------- #
+async def replay_async(prefix: str, options: Optional[JobOptions] = None, concurrency: Optional[int] = None):
+    """Сверить file_ledger префикса с таблицами и перезалить только расходящиеся файлы"""
+    options = options or JobOptions()
+    use_source(options.source)
+    use_load_profile(options.get("load_profile"))  # журнал перезаливка не трогает
+    report = await ledger.reconcile(prefix, concurrency)
+    dead_letter = DeadLetterSink(options.get("dead_letter"), options.get("error_budget"))
+    governor = MemoryGovernor(options.get("memory_budget"))
+    throttle = DbThrottle.from_options(options)
+    for entry in report:
+        if "missing in S3" in entry["reasons"]:
+            logger.warning(f"Cannot replay {entry['file_key']}: object is gone")
+            continue
+        logger.info(f"Replaying {entry['file_key']}: {', '.join(entry['reasons'])}")
+        try:
+            await process_file(
+                entry["file_key"],
+                entry["table_name"],
+                options,
+                dead_letter,
+                governor,
+                replay=True,
+                throttle=throttle,
+            )
+        except ErrorBudgetExceeded as e:
+            logger.error(f"Stopping replay at {entry['file_key']}: {e}")
+            break
+        flush_logs()
+    return report
+
+
+def background_replay(prefix: str, options: Optional[JobOptions] = None, concurrency: Optional[int] = None):
+    get_settings()
+    start_profile_watcher()
+    asyncio.run(replay_async(prefix, options, concurrency))
 
-    for idx in range(start_idx, len(object_keys)):
-        file_key = object_keys[idx]
-        logger.info(f"Processing file {idx+1}/{len(object_keys)}: {file_key}")
-        await process_file(file_key, table_name)
-        file_handler.flush()
 
-    logger.info("All files processed successfully.")
+def start_replay(prefix: str, options: Optional[JobOptions] = None, concurrency: Optional[int] = None):
+    logger.info(f"Starting background replay for {prefix}")
+    p = Process(target=background_replay, args=(prefix, options, concurrency))
+    p.start()
+    logger.info(f"Spawned process PID={p.pid}")
+    return p
 
 
 # ---------------- ОБОЛОЧКИ ---------------- #
-def background_processor(prefix: str, table_name: str, start_file: Optional[str] = None, start_date: Optional[str] = None):
-    asyncio.run(background_processor_async(prefix, table_name, start_file, start_date))
+def background_processor(prefix: str, table_name: str, start_file: Optional[str] = None, start_date: Optional[str] = None, options: Optional[JobOptions] = None):
+    get_settings()  # в spawn-процессе настраивает логгер до первой записи
+    start_profile_watcher()
+    asyncio.run(background_processor_async(prefix, table_name, start_file, start_date, options))
 
 
-def start_processing(prefix: str, table_name: str, start_file: Optional[str] = None, start_date: Optional[str] = None):
+def start_processing(prefix: str, table_name: str, start_file: Optional[str] = None, start_date: Optional[str] = None, options: Optional[JobOptions] = None):
     logger.info(f"Starting background process for {prefix}/{table_name}")
-    p = Process(target=background_processor, args=(prefix, table_name, start_file, start_date))
+    p = Process(target=background_processor, args=(prefix, table_name, start_file, start_date, options))
     p.start()
     logger.info(f"Spawned process PID={p.pid}")
     return p
@@ -0,0 +1,153 @@
+"""
+Профилирование работающего задания по запросу. API кладёт в profiles_dir
+файл <pid>.request.json; дочерний процесс задания опрашивает его из фонового
+потока и на заданное число секунд включает сэмплирующий профилировщик
+(стеки всех потоков через sys._current_frames, формат collapsed stacks для
+flamegraph.pl/speedscope) и/или tracemalloc (топ мест выделения памяти).
+Результаты пишутся в тот же каталог и отдаются через GET /profiles/{name}.
+"""
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from typing import List, Optional
+
+from app.config import get_settings
+from app.logger import logger
+
+PROFILE_MODES = ("cpu", "memory", "both")
+MAX_SECONDS = 600
+MIN_INTERVAL = 0.001  # чаще выборка сама становится нагрузкой на процесс
+POLL_INTERVAL = 1.0
+TOP_ALLOCATIONS = 30
+TRACEBACK_FRAMES = 25
+
+_watcher: Optional[threading.Thread] = None
+
+
+def profiles_dir() -> str:
+    return get_settings().ingest.profiles_dir
+
+
+def request_path(pid: int) -> str:
+    return os.path.join(profiles_dir(), f"{pid}.request.json")
+
+
+def request_profile(pid: int, seconds: float, mode: str, interval: float) -> str:
+    """Попросить процесс pid снять профиль (вызывается из API)"""
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode: {mode}")
+    os.makedirs(profiles_dir(), exist_ok=True)
+    path = request_path(pid)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"seconds": min(seconds, MAX_SECONDS), "mode": mode, "interval": max(interval, MIN_INTERVAL)}, f)
+    os.replace(tmp, path)  # процесс не должен прочитать недописанный запрос
+    return path
+
+
+def list_profiles() -> List[str]:
+    directory = profiles_dir()
+    if not os.path.isdir(directory):
+        return []
+    return sorted(n for n in os.listdir(directory) if n.endswith((".folded", ".alloc.txt")))
+
+
+def profile_path(name: str) -> Optional[str]:
+    """Путь к результату по имени; имена с каталогами не принимаются"""
+    if os.path.basename(name) != name or name not in list_profiles():
+        return None
+    return os.path.join(profiles_dir(), name)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _sample_stacks(seconds: float, interval: float) -> Counter:
+    stacks: Counter = Counter()
+    me = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(ident, str(ident)))
+            stacks[";".join(reversed(labels))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def _write_allocations(path: str, snapshot: tracemalloc.Snapshot):
+    snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+    with open(path, "w", encoding="utf-8") as f:
+        current, peak = tracemalloc.get_traced_memory()
+        f.write(f"traced current={current} peak={peak}\n\nTop allocation sites:\n")
+        for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+            f.write(f"{stat}\n")
+        f.write("\nTop tracebacks:\n")
+        for stat in snapshot.statistics("traceback")[:10]:
+            f.write(f"\n{stat.count} blocks, {stat.size} bytes\n")
+            f.write("\n".join(stat.traceback.format()) + "\n")
+
+
+def run_profile(seconds: float, mode: str, interval: float = 0.01) -> List[str]:
+    """Снять профиль текущего процесса; возвращает пути результатов"""
+    base = os.path.join(profiles_dir(), f"profile_{os.getpid()}_{datetime.now():%Y%m%d-%H%M%S}")
+    memory = mode in ("memory", "both")
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(TRACEBACK_FRAMES)
+    written = []
+    try:
+        if mode in ("cpu", "both"):
+            stacks = _sample_stacks(seconds, interval)
+            with open(base + ".folded", "w", encoding="utf-8") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            written.append(base + ".folded")
+        else:
+            time.sleep(seconds)
+        if memory:
+            _write_allocations(base + ".alloc.txt", tracemalloc.take_snapshot())
+            written.append(base + ".alloc.txt")
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+    return written
+
+
+def _watch():
+    path = request_path(os.getpid())
+    while True:
+        time.sleep(POLL_INTERVAL)
+        if not os.path.exists(path):
+            continue
+        try:
+            with open(path) as f:
+                request = json.load(f)
+            os.remove(path)
+            logger.info(f"Profiling for {request['seconds']}s, mode={request['mode']}")
+            written = run_profile(request["seconds"], request["mode"], request.get("interval", 0.01))
+            logger.info(f"Profile written: {', '.join(written)}")
+        except Exception as e:
+            logger.error(f"Profiling failed: {e}", exc_info=True)
+
+
+def start_profile_watcher():
+    """Фоновый поток, который ждёт запросов на профилирование этого процесса"""
+    global _watcher
+    if _watcher is None:
+        os.makedirs(profiles_dir(), exist_ok=True)
+        _watcher = threading.Thread(target=_watch, name="profile-watcher", daemon=True)
+        _watcher.start()
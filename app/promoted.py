@@ -0,0 +1,180 @@
+"""
+Вынос «горячих» свойств из JSON-колонок в типизированные колонки
+(settings.ingest.promoted). Значение берётся по пути из исходного объекта
+события, приводится к типу колонки и кладётся в запись до маршрутизации;
+кодировщик таблицы подхватывает колонку сам, если она у таблицы есть.
+Непреобразуемое значение становится NULL — строка из-за него не отбрасывается.
+Колонки в существующих таблицах добавляет ревизия alembic, которую пишет
+write_migration (`python -m app promoted-migration`); она же заполняет старые строки.
+"""
+import os
+import re
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.config import get_settings, PromotedProperty
+from app.models import DICTIONARY_COLUMNS, load_event_models
+from app.window import to_naive_utc
+from app.logger import logger
+
+_MISSING = object()
+
+
+def _to_text(value: Any) -> str:
+    return value if isinstance(value, str) else str(value)
+
+
+def _to_bigint(value: Any) -> int:
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(f"Not an integer: {value}")
+        return int(value)
+    return int(value)
+
+
+def _to_double(value: Any) -> float:
+    return float(value)
+
+
+def _to_boolean(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return value != 0
+    lowered = str(value).strip().lower()
+    if lowered in ("true", "t", "1", "yes"):
+        return True
+    if lowered in ("false", "f", "0", "no"):
+        return False
+    raise ValueError(f"Not a boolean: {value}")
+
+
+def _to_timestamp(value: Any) -> datetime:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        # Amplitude хранит epoch в миллисекундах
+        seconds = value / 1000 if value > 1e11 else value
+        return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None)
+    return to_naive_utc(datetime.fromisoformat(str(value).replace("Z", "+00:00")))
+
+
+def _to_jsonb(value: Any) -> Any:
+    return value
+
+
+CONVERTERS: Dict[str, Callable[[Any], Any]] = {
+    "text": _to_text,
+    "bigint": _to_bigint,
+    "double": _to_double,
+    "boolean": _to_boolean,
+    "timestamp": _to_timestamp,
+    "jsonb": _to_jsonb,
+}
+
+
+class PromotedExtractor:
+    """Извлекает promoted-свойства из сырого объекта события в запись"""
+
+    def __init__(self, properties: List[PromotedProperty]):
+        self.rules: List[Tuple[str, List[str], Callable[[Any], Any]]] = []
+        for prop in properties:
+            if prop.type not in CONVERTERS:
+                raise ValueError(f"Unknown type {prop.type} for promoted column {prop.column}")
+            self.rules.append((prop.column, prop.path.split("."), CONVERTERS[prop.type]))
+        self.failed = 0
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    def apply(self, raw_obj: dict, record: dict):
+        for column, path, convert in self.rules:
+            value: Any = raw_obj
+            for part in path:
+                if not isinstance(value, dict):
+                    value = _MISSING
+                    break
+                value = value.get(part, _MISSING)
+            if value is _MISSING or value is None:
+                continue
+            try:
+                record[column] = convert(value)
+            except (TypeError, ValueError, OverflowError):
+                self.failed += 1
+
+
+_extractor: Optional[PromotedExtractor] = None
+
+
+def get_extractor() -> PromotedExtractor:
+    global _extractor
+    if _extractor is None:
+        _extractor = PromotedExtractor(get_settings().ingest.promoted)
+    return _extractor
+
+
+MIGRATION_TEMPLATE = Path(__file__).parent / "migrations" / "promoted_columns.py.mako"
+# Исходное поле события → JSON-колонка, где оно лежит; остальные поля — в extra_json
+JSON_COLUMNS = {
+    field: f"{field}_json"
+    for field in ("data", "event_properties", "group_properties", "groups", "plan", "user_properties")
+}
+
+
+def _promoted_rows() -> List[tuple]:
+    """Строки PROMOTED ревизии для settings.ingest.promoted, как их раскладывает load_event_models"""
+    models = load_event_models()
+    rows = []
+    for prop in get_settings().ingest.promoted:
+        field, *path = prop.path.split(".")
+        json_column = JSON_COLUMNS.get(field)
+        if json_column is None:
+            json_column, path = "extra_json", [field, *path]
+        for name in prop.tables or list(models):
+            table = models[name].__table__.name
+            rows.append(
+                (table, name if table != name else None, prop.column, prop.type, json_column, tuple(path), prop.index)
+            )
+    return rows
+
+
+def write_migration(message: str, config=None, directory: Optional[str] = None) -> Optional[str]:
+    """
+    Ревизия alembic для колонок ingest_promoted, которых нет в прежних таких ревизиях:
+    список колонок записывается в файл, так что миграция не зависит от настроек.
+    Ревизия добавляет колонки, заполняет их у старых строк пачками и строит индексы
+    CREATE INDEX CONCURRENTLY. None — новых колонок нет.
+    """
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+    from alembic.util import rev_id, template_to_file
+
+    if config is None:
+        config = Config()
+        config.set_main_option("script_location", str(Path(__file__).parent / "migrations"))
+    script = ScriptDirectory.from_config(config)
+    done = {
+        (row[0], row[2])
+        for revision in script.walk_revisions()
+        for row in getattr(revision.module, "PROMOTED", ())
+    }
+    rows = [row for row in _promoted_rows() if (row[0], row[2]) not in done]
+    if not rows:
+        return None
+    revision = rev_id()
+    slug = re.sub(r"\W+", "_", message.lower()).strip("_")[:40]
+    path = os.path.join(directory or script.versions, f"{revision}_{slug}.py")
+    template_to_file(
+        MIGRATION_TEMPLATE,
+        path,
+        "utf-8",
+        message=message,
+        up_revision=revision,
+        down_revision=script.get_current_head(),
+        create_date=datetime.now(),
+        columns=rows,
+        dictionary_columns=DICTIONARY_COLUMNS,
+    )
+    logger.info(f"Promoted migration {path} written: {', '.join(f'{r[0]}.{r[2]}' for r in rows)}")
+    return path
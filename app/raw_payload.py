@@ -0,0 +1,36 @@
+"""
+Что делать с сырым JSON события после разбора (raw_payload задания):
+data  — весь объект в data_json, если в событии нет поля data (как раньше);
+extra — в extra_json только ключи, которые не легли ни в одну колонку схемы;
+side  — исходная строка сжимается zlib и пишется в event_raw по insert_id;
+off   — сырой JSON не хранится.
+"""
+import json
+import zlib
+from typing import Optional
+
+from app.models import EventRaw
+from app.routing import TableTarget
+
+RAW_PAYLOAD_MODES = ("data", "extra", "side", "off")
+COMPRESS_LEVEL = 6
+
+_raw_target: Optional[TableTarget] = None
+
+
+def raw_target() -> TableTarget:
+    """Цель батча для event_raw; роллапы её не учитывают"""
+    global _raw_target
+    if _raw_target is None:
+        _raw_target = TableTarget(EventRaw.__tablename__, EventRaw, events=False)
+    return _raw_target
+
+
+def compress_payload(line: bytes) -> bytes:
+    """Исходная строка NDJSON (bytes или memoryview) в сжатом виде"""
+    return zlib.compress(line, COMPRESS_LEVEL)
+
+
+def decompress_payload(payload: bytes) -> dict:
+    """Исходный объект события из event_raw.payload"""
+    return json.loads(zlib.decompress(payload).decode("utf-8"))
@@ -0,0 +1,142 @@
+"""
+Часовые роллапы, которые поддерживаются во время загрузки: число событий и
+HyperLogLog-скетч уникальных пользователей по (таблица, час, event_type,
+platform, country). Агрегаты копятся в памяти и вливаются upsert'ом в той же
+транзакции, что и батчи. Учитываются только реально вставленные строки
+(INSERT ... ON CONFLICT DO NOTHING RETURNING), поэтому повтор файла их не удваивает.
+Перезаливка сначала вычитает из роллапов строки файла, которые удаляет (subtract_file_rows);
+скетчи не уменьшаются, но повторное добавление тех же пользователей их и не меняет.
+"""
+import hashlib
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import String, func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.dictionary import decoded_select
+from app.models import EventRollupHourly
+from app.logger import logger
+
+HLL_PRECISION = 10  # 2^10 регистров, стандартная ошибка ~3.2%
+HLL_REGISTERS = 1 << HLL_PRECISION
+_HLL_RANK_BITS = 64 - HLL_PRECISION
+FLUSH_CHUNK = 1000  # групп на один upsert (7 параметров на группу)
+
+GroupKey = Tuple[str, datetime, str, str, str]
+
+
+def hll_add(registers: bytearray, value: str):
+    """Добавить значение в HLL-скетч (регистры — ранги по 64-битному хэшу)"""
+    h = int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+    index = h >> _HLL_RANK_BITS
+    rest = h & ((1 << _HLL_RANK_BITS) - 1)
+    rank = _HLL_RANK_BITS - rest.bit_length() + 1
+    if rank > registers[index]:
+        registers[index] = rank
+
+
+def user_key(row: dict) -> Optional[str]:
+    for column in ("user_id", "device_id", "amplitude_id"):
+        value = row.get(column)
+        if value is not None:
+            return str(value)
+    return None
+
+
+class RollupAccumulator:
+    """Агрегаты по вставленным строкам до ближайшего коммита"""
+
+    def __init__(self):
+        self._counts: Dict[GroupKey, int] = {}
+        self._sketches: Dict[GroupKey, bytearray] = {}
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def add(self, table_name: str, rows: Iterable[dict]):
+        counts, sketches = self._counts, self._sketches
+        for row in rows:
+            key = (
+                table_name,
+                row["client_event_time"].replace(minute=0, second=0, microsecond=0),
+                row.get("event_type") or "",
+                row.get("platform") or "",
+                row.get("country") or "",
+            )
+            counts[key] = counts.get(key, 0) + 1
+            user = user_key(row)
+            if user is not None:
+                registers = sketches.get(key)
+                if registers is None:
+                    registers = sketches[key] = bytearray(HLL_REGISTERS)
+                hll_add(registers, user)
+
+    async def flush(self, session: AsyncSession):
+        """Влить накопленное в event_rollup_hourly в текущей транзакции"""
+        if not self._counts:
+            return
+        empty = [0] * HLL_REGISTERS
+        values: List[dict] = [
+            {
+                "source_table": key[0],
+                "hour": key[1],
+                "event_type": key[2],
+                "platform": key[3],
+                "country": key[4],
+                "event_count": count,
+                "users_hll": list(self._sketches[key]) if key in self._sketches else empty,
+            }
+            # Один порядок блокировок строк роллапа у параллельных заданий и перезаливки:
+            # по первичному ключу (строки — по кодовым точкам, как COLLATE "C")
+            for key, count in sorted(self._counts.items())
+        ]
+        table = EventRollupHourly.__table__
+        for i in range(0, len(values), FLUSH_CHUNK):
+            stmt = pg_insert(table).values(values[i : i + FLUSH_CHUNK])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[c.name for c in table.primary_key.columns],
+                set_={
+                    "event_count": table.c.event_count + stmt.excluded.event_count,
+                    "users_hll": func.hll_merge(table.c.users_hll, stmt.excluded.users_hll),
+                },
+            )
+            await session.execute(stmt)
+        logger.debug(f"Merged {len(values)} rollup groups")
+        self._counts.clear()
+        self._sketches.clear()
+
+
+async def subtract_file_rows(session: AsyncSession, table_name: str, model, file_id: int):
+    """Вычесть из event_rollup_hourly строки файла в таблице (перед их удалением, в той же транзакции)"""
+    rows = decoded_select(model).where(model.__table__.c.source_file_id == file_id).subquery()
+
+    def dimension(column: str):
+        # Как в RollupAccumulator.add: нет колонки или значения — ''
+        return func.coalesce(rows.c[column], "") if column in rows.c else literal("")
+
+    group = [
+        func.date_trunc("hour", rows.c.client_event_time).label("hour"),
+        dimension("event_type").label("event_type"),
+        dimension("platform").label("platform"),
+        dimension("country").label("country"),
+    ]
+    deleted = select(*group, func.count().label("rows")).group_by(*group).subquery()
+    table = EventRollupHourly.__table__
+    match = (
+        table.c.source_table == table_name,
+        table.c.hour == deleted.c.hour,
+        table.c.event_type == deleted.c.event_type,
+        table.c.platform == deleted.c.platform,
+        table.c.country == deleted.c.country,
+    )
+    # UPDATE ... FROM блокирует строки в порядке соединения; сначала берём блокировки
+    # в том же порядке, что и upsert в RollupAccumulator.flush
+    order = [c.collate("C") if isinstance(c.type, String) else c for c in table.primary_key.columns]
+    await session.execute(select(table.c.hour).where(*match).order_by(*order).with_for_update(of=table))
+    result = await session.execute(
+        update(table).where(*match).values(event_count=table.c.event_count - deleted.c.rows)
+    )
+    if result.rowcount:
+        logger.debug(f"Subtracted file {file_id} from {result.rowcount} rollup groups of {table_name}")
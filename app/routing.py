@@ -0,0 +1,96 @@
+from typing import Callable, Dict, List, Optional
+
+from app.config import get_settings, RouteRule
+from app.models import load_event_models
+
+
+def compile_encoder(columns: List[str]) -> Callable[[dict], dict]:
+    """
+    Собирает функцию record → dict ровно с колонками таблицы. Код генерируется
+    один раз на таблицу, так что на строку нет ни рефлексии, ни цикла по колонкам;
+    лишние ключи (extra-поля схемы) отбрасываются, отсутствующие становятся None.
+    """
+    body = ", ".join(f"{c!r}: get({c!r})" for c in columns)
+    source = f"def encode(record):\n    get = record.get\n    return {{{body}}}\n"
+    namespace: Dict[str, Callable] = {}
+    exec(source, namespace)
+    return namespace["encode"]
+
+
+class TableTarget:
+    """Таблица назначения: модель, её колонки и скомпилированный кодировщик строк"""
+
+    def __init__(self, name: str, model, events: bool = True):
+        self.name = name
+        self.model = model
+        self.events = events  # таблица событий (False — служебная, например event_raw)
+        self.columns = [c.name for c in model.__table__.columns]
+        self.encode = compile_encoder(self.columns)
+
+    def __repr__(self):
+        return f"TableTarget({self.name})"
+
+
+class TableRegistry:
+    """Реестр таблиц событий и правил маршрутизации (settings.ingest.tables/routes)"""
+
+    def __init__(self, models: Dict[str, object], rules: List[RouteRule]):
+        self.targets = {name: TableTarget(name, model) for name, model in models.items()}
+        for rule in rules:
+            if rule.table not in self.targets:
+                raise ValueError(f"Route targets unknown table: {rule.table}")
+        self.prefix_rules = [r for r in rules if r.field == "prefix"]
+        # field → {value → table}; порядок полей и значений — как в конфиге
+        self.field_rules: Dict[str, Dict[str, str]] = {}
+        for rule in rules:
+            if rule.field == "prefix":
+                continue
+            lookup = self.field_rules.setdefault(rule.field, {})
+            for value in rule.values:
+                lookup.setdefault(value, rule.table)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.targets
+
+    def get(self, name: str) -> TableTarget:
+        return self.targets[name]
+
+    def default_for(self, table_name: str, file_key: str) -> TableTarget:
+        """Таблица файла: по префиксным правилам, иначе table_name задания"""
+        for rule in self.prefix_rules:
+            if any(file_key.startswith(p) for p in rule.values):
+                return self.targets[rule.table]
+        return self.targets[table_name]
+
+    def router(self, table_name: str, file_key: str) -> Callable[[dict], TableTarget]:
+        """Функция record → TableTarget для одного файла"""
+        default = self.default_for(table_name, file_key)
+        if not self.field_rules:
+            return lambda record: default
+        # Таблицы по полям разрешаем в TableTarget заранее, на строку — только dict.get
+        lookups = [
+            (field, {value: self.targets[table] for value, table in mapping.items()})
+            for field, mapping in self.field_rules.items()
+        ]
+
+        def route(record: dict) -> TableTarget:
+            for field, mapping in lookups:
+                target = mapping.get(record.get(field))
+                if target is not None:
+                    return target
+            return default
+
+        return route
+
+
+_registry: Optional[TableRegistry] = None
+
+
+def get_registry() -> TableRegistry:
+    global _registry
+    if _registry is None:
+        _registry = TableRegistry(
+            load_event_models(),
+            get_settings().ingest.routes,
+        )
+    return _registry
@@ -1,11 +1,85 @@
-import boto3
-from botocore.config import Config
-from app.config import settings
+import heapq
+import io
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from app.config import get_settings
 from app.logger import logger
 
+CHUNK_SIZE = 1024 * 1024  # размер чанка при чтении тела ответа
+LIST_PAGE = 1000  # ключей на один list_objects_v2
+_MAX_CHAR = "\U0010ffff"
+
+KeyRange = Tuple[Optional[str], Optional[str]]  # (StartAfter, конец не включительно)
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Сетевые сбои, 5xx и троттлинг повторяем; остальные ошибки S3 — нет"""
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    if isinstance(error, ClientError):
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        return status >= 500 or status in (408, 429)
+    return isinstance(error, (BotoCoreError, OSError))
+
+
+def _before(bound: str) -> str:
+    """StartAfter, с которым листинг начнётся ровно с bound (bound тоже попадёт)"""
+    return bound[:-1] + chr(ord(bound[-1]) - 1) + _MAX_CHAR
+
+
+def _same_class(ch: str, alphabet: List[str]) -> List[str]:
+    if ch.isdigit():
+        return [c for c in alphabet if c.isdigit()]
+    if ch.isalpha():
+        return [c for c in alphabet if c.isalpha() and c.islower() == ch.islower()]
+    return []
+
+
+def split_range(prefix: str, first: str, last: str, end: Optional[str], alphabet: List[str]) -> List[KeyRange]:
+    """
+    Разбить остаток диапазона (last, end) на соседние поддиапазоны. Границы
+    ставятся в каждой позиции от той, где first и last расходятся, до конца
+    префикса: last[:p] + c для следующих символов того же класса (цифры,
+    буквы), поэтому ключи с датами и счётчиками расходятся по годам, месяцам,
+    дням и т.д. Поддиапазоны покрывают остаток целиком, в том числе ключи с
+    символами вне алфавита.
+    """
+    j = len(os.path.commonprefix([first, last]))
+    bounds = set()
+    for p in range(min(j, len(last) - 1), len(prefix) - 1, -1):
+        for c in _same_class(last[p], alphabet):
+            if c > last[p]:
+                bound = last[:p] + c
+                if end is None or bound < end:
+                    bounds.add(bound)
+    ranges: List[KeyRange] = []
+    lower = last
+    for bound in sorted(bounds):
+        ranges.append((lower, bound))
+        lower = _before(bound)
+    ranges.append((lower, end))
+    return ranges
+
+
+def is_direct_child(key: str, prefix: str) -> bool:
+    """Only direct files: no additional / after prefix, and not ending with / (exclude folder placeholders)"""
+    if not prefix.endswith("/"):
+        prefix += "/"
+    return key.startswith(prefix) and key.count("/") == prefix.count("/") and not key.endswith("/")
+
 
 class S3Client:
     def __init__(self):
+        # boto3 импортируется здесь: его импорт заметно тормозит старт процесса
+        import boto3
+        from botocore.config import Config
+
+        settings = get_settings()
         logger.info("Initializing S3 client")
         self.client = boto3.client(
             "s3",
@@ -25,33 +99,82 @@ class S3Client:
         self.bucket = settings.s3.bucket_name
         logger.info(f"S3 client initialized for bucket: {self.bucket}")
 
-    def list_objects(self, prefix: str):
-        """List objects with prefix, return sorted list of {'Key': str, 'LastModified': datetime} ascending (oldest first), only direct files under prefix"""
+    def list_objects(self, prefix: str, start_after: Optional[str] = None):
+        """List objects with prefix, return sorted list of {'Key': str, 'LastModified': datetime, 'ETag': str} ascending (oldest first), only direct files under prefix; start_after lists only keys after it"""
         logger.info(f"Listing S3 objects with prefix: {prefix}")
-        objects = []
-        paginator = self.client.get_paginator("list_objects_v2")
-        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
-            if "Contents" in page:
-                objects.extend(page["Contents"])
-        # Filter to only direct files: no additional / after prefix, and not ending with / (exclude folder placeholders)
-        if not prefix.endswith("/"):
-            prefix += "/"
-        filtered_objects = [
-            obj
-            for obj in objects
-            if obj["Key"].startswith(prefix)
-            and obj["Key"].count("/") == prefix.count("/")
-            and not obj["Key"].endswith("/")
-        ]
+        result = list(self.iter_objects(prefix, start_after))
         # Sort by LastModified ascending (oldest first)
-        filtered_objects.sort(key=lambda x: x["LastModified"], reverse=False)
-        result = [
-            {"Key": obj["Key"], "LastModified": obj["LastModified"]}
-            for obj in filtered_objects
-        ]
+        result.sort(key=lambda x: x["LastModified"])
         logger.info(f"Found {len(result)} direct files in prefix {prefix}")
         return result
 
+    def iter_objects(self, prefix: str, start_after: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Direct files under prefix in key order, yielded while listing is still running.
+        Delimiter="/" keeps S3 from walking subfolders. Each key range lists one page;
+        a full page splits the rest of the range (split_range) and the parts are listed
+        in parallel. A page is yielded once every range before it is done.
+        """
+        if not prefix.endswith("/"):
+            prefix += "/"
+        cfg = get_settings().s3
+        alphabet = sorted(set(cfg.list_shard_chars))
+        pending: Dict = {}
+        ready: List[Tuple[str, int, List[Dict]]] = []
+        seq = 0
+        with ThreadPoolExecutor(max_workers=max(1, cfg.list_concurrency)) as pool:
+
+            def submit(key_range: KeyRange):
+                pending[pool.submit(self._list_range, prefix, *key_range)] = key_range
+
+            submit((start_after, None))
+            try:
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        lower, end = pending.pop(future)
+                        objects, first, rest = future.result()
+                        heapq.heappush(ready, (lower or "", seq, objects))
+                        seq += 1
+                        if rest is not None:
+                            for key_range in split_range(prefix, first, rest, end, alphabet):
+                                submit(key_range)
+                    lowest = min((lower or "" for lower, _ in pending.values()), default=None)
+                    while ready and (lowest is None or ready[0][0] < lowest):
+                        yield from heapq.heappop(ready)[2]
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _list_range(
+        self, prefix: str, start_after: Optional[str], end: Optional[str]
+    ) -> Tuple[List[Dict], str, Optional[str]]:
+        """
+        One page of a key range: (files, first listed name, where the rest of the range
+        starts — None if the range is exhausted). Subfolders come as CommonPrefixes
+        and are skipped as a whole.
+        """
+        params = {"Bucket": self.bucket, "Prefix": prefix, "Delimiter": "/", "MaxKeys": LIST_PAGE}
+        if start_after:
+            params["StartAfter"] = start_after
+        page = self.client.list_objects_v2(**params)
+        contents = page.get("Contents", [])
+        # Папку "a/" пропускаем целиком: следующий ключ после неё начинается с "a0"
+        folders = [p["Prefix"][:-1] + chr(ord("/") + 1) for p in page.get("CommonPrefixes", [])]
+        names = sorted([obj["Key"] for obj in contents] + folders)
+        objects = [
+            {"Key": obj["Key"], "LastModified": obj["LastModified"], "ETag": obj.get("ETag")}
+            for obj in contents
+            if (end is None or obj["Key"] < end) and is_direct_child(obj["Key"], prefix)
+        ]
+        if not names or not page.get("IsTruncated") or (end is not None and names[-1] >= end):
+            return objects, "", None
+        return objects, names[0], names[-1]
+
+    def head_etag(self, key: str) -> Optional[str]:
+        """ETag of an object (for the file ledger when the key did not come from a listing)"""
+        return self.client.head_object(Bucket=self.bucket, Key=key).get("ETag")
+
     def get_object(self, key: str):
         """Download object as bytes"""
         logger.info(f"Downloading S3 object: {key}")
@@ -59,3 +182,112 @@ class S3Client:
         data = response["Body"].read()
         logger.info(f"Downloaded {key}, size: {len(data)} bytes")
         return data
+
+    def open_object(self, key: str) -> BinaryIO:
+        """
+        Open object for reading via ranged GETs. The first part also tells the object
+        size; the rest are fetched in parallel, each retried on its own, into a BytesIO
+        (up to multipart_threshold) or an anonymous temp file. Caller closes the result.
+        """
+        from botocore.exceptions import ClientError
+
+        cfg = get_settings().s3
+        part_size = max(CHUNK_SIZE, cfg.part_size)
+        logger.info(f"Downloading S3 object: {key}")
+
+        first = bytearray()
+
+        def first_sink(offset: int, chunk: bytes):
+            first[offset : offset + len(chunk)] = chunk
+
+        try:
+            response = self._fetch_range(key, 0, part_size - 1, None, first_sink)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "InvalidRange":  # пустой объект
+                return io.BytesIO()
+            raise
+        content_range = response.get("ContentRange")
+        total = int(content_range.rsplit("/", 1)[-1]) if content_range else len(first)
+        if total <= len(first):
+            logger.info(f"Downloaded {key}, size: {total} bytes")
+            return io.BytesIO(first)
+
+        etag = response.get("ETag")
+        if total > cfg.multipart_threshold:
+            target: BinaryIO = tempfile.TemporaryFile(dir=cfg.download_dir)
+        else:
+            target = io.BytesIO()
+        lock = threading.Lock()
+
+        def sink(offset: int, chunk: bytes):
+            with lock:
+                target.seek(offset)
+                target.write(chunk)
+
+        try:
+            sink(0, first)
+            del first
+            ranges = [
+                (start, min(start + part_size, total) - 1)
+                for start in range(part_size, total, part_size)
+            ]
+            with ThreadPoolExecutor(max_workers=max(1, cfg.max_concurrency)) as pool:
+                futures = [
+                    pool.submit(self._fetch_range, key, start, end, etag, sink)
+                    for start, end in ranges
+                ]
+                try:
+                    for future in as_completed(futures):
+                        future.result()
+                except Exception:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        except Exception:
+            target.close()
+            raise
+        target.seek(0)
+        logger.info(f"Downloaded {key} in {len(ranges) + 1} parts, size: {total} bytes")
+        return target
+
+    def _fetch_range(
+        self,
+        key: str,
+        start: int,
+        end: int,
+        etag: Optional[str],
+        sink: Callable[[int, bytes], None],
+    ) -> dict:
+        """GET bytes start..end (inclusive) with retries; sink(offset, chunk) receives data"""
+        kwargs = {"Bucket": self.bucket, "Key": key, "Range": f"bytes={start}-{end}"}
+        if etag:
+            kwargs["IfMatch"] = etag  # объект не должен поменяться между частями
+        retries = get_settings().s3.part_retries
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = self.client.get_object(**kwargs)
+                offset = start
+                for chunk in response["Body"].iter_chunks(CHUNK_SIZE):
+                    sink(offset, chunk)
+                    offset += len(chunk)
+                return response
+            except Exception as e:
+                if attempt > retries or not _is_retryable(e):
+                    raise
+                logger.warning(
+                    f"Range {start}-{end} of {key} failed (attempt {attempt}/{retries}): {e}, retrying"
+                )
+                time.sleep(min(0.5 * 2**attempt, 10))
+
+
+_s3: Optional[S3Client] = None
+
+
+def get_s3() -> S3Client:
+    """Общий клиент процесса, создаётся при первом обращении"""
+    global _s3
+    if _s3 is None:
+        _s3 = S3Client()
+    return _s3
@@ -0,0 +1,268 @@
+"""
+Пробный проход по префиксу без записи в базу (scan): скачивание, распаковка
+и разбор NDJSON через EventSchema, как при загрузке, в scan_concurrency
+процессах — разбор упирается в CPU, потоки из-за GIL его не распараллелят.
+Отчёт: файлы, строки, байты, события, отказы по причинам, время и пропускная
+способность каждой стадии, частота неразобранных ключей (дрейф схемы),
+диапазон client_event_time. Отчёт фонового скана пишется в scan_dir после
+каждого файла, так что его видно и до окончания.
+"""
+import json
+import os
+import time
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from multiprocessing import Process
+from typing import BinaryIO, Callable, Dict, List, Optional
+
+from pydantic import ValidationError
+
+from app.config import get_settings
+from app.framing import decode_line, get_decoder, iter_lines
+from app.logger import logger
+from app.schemas import EventSchema, JobOptions
+from app.sources import get_source, use_source
+from app.window import TimeWindow
+
+TOP_KEYS = 100  # сколько самых частых неразобранных ключей и ошибок попадает в отчёт
+MAX_FAILED_FILES = 50
+
+
+class _TimedReader:
+    """Поток распаковки, который считает время чтения (стадия inflate)"""
+
+    def __init__(self, stream: BinaryIO):
+        self._stream = stream
+        self.seconds = 0.0
+        self.bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        started = time.perf_counter()
+        data = self._stream.read(size)
+        self.seconds += time.perf_counter() - started
+        self.bytes += len(data)
+        return data
+
+
+class ScanStats:
+    """Счётчики скана; складываются из файлов в итог"""
+
+    def __init__(self):
+        self.files = 0
+        self.failed_files: List[str] = []
+        self.compressed_bytes = 0
+        self.ndjson_bytes = 0
+        self.lines = 0
+        self.events = 0
+        self.outside_window = 0
+        self.rejects: Counter = Counter()  # причина → строк
+        self.unmapped_keys: Counter = Counter()  # ключ верхнего уровня вне EventSchema → строк
+        self.seconds: Counter = Counter()  # стадия → секунд (сумма по процессам)
+        self.min_event_time: Optional[datetime] = None
+        self.max_event_time: Optional[datetime] = None
+
+    def merge(self, other: "ScanStats"):
+        self.files += other.files
+        self.failed_files.extend(other.failed_files[: MAX_FAILED_FILES - len(self.failed_files)])
+        self.compressed_bytes += other.compressed_bytes
+        self.ndjson_bytes += other.ndjson_bytes
+        self.lines += other.lines
+        self.events += other.events
+        self.outside_window += other.outside_window
+        self.rejects.update(other.rejects)
+        self.unmapped_keys.update(other.unmapped_keys)
+        self.seconds.update(other.seconds)
+        for value in (other.min_event_time, other.max_event_time):
+            if value is not None:
+                self._event_time(value)
+
+    def _event_time(self, value: datetime):
+        if self.min_event_time is None or value < self.min_event_time:
+            self.min_event_time = value
+        if self.max_event_time is None or value > self.max_event_time:
+            self.max_event_time = value
+
+    def report(self, wall_seconds: float, total_files: int) -> Dict:
+        def rate(amount: float, seconds: float) -> Optional[float]:
+            return round(amount / seconds, 1) if seconds else None
+
+        mb = 1024 * 1024
+        return {
+            "files": self.files,
+            "total_files": total_files,
+            "failed_files": self.failed_files,
+            "lines": self.lines,
+            "events": self.events,
+            "outside_window": self.outside_window,
+            "rejected": sum(self.rejects.values()),
+            "rejects": dict(self.rejects.most_common(TOP_KEYS)),
+            "compressed_bytes": self.compressed_bytes,
+            "ndjson_bytes": self.ndjson_bytes,
+            "min_event_time": self.min_event_time.isoformat() if self.min_event_time else None,
+            "max_event_time": self.max_event_time.isoformat() if self.max_event_time else None,
+            "unmapped_keys": dict(self.unmapped_keys.most_common(TOP_KEYS)),
+            # Пропускная способность стадии — на один процесс (секунды стадий суммируются по процессам)
+            "stages": {
+                "download": {
+                    "seconds": round(self.seconds["download"], 2),
+                    "mb_per_s": rate(self.compressed_bytes / mb, self.seconds["download"]),
+                },
+                "inflate": {
+                    "seconds": round(self.seconds["inflate"], 2),
+                    "mb_per_s": rate(self.ndjson_bytes / mb, self.seconds["inflate"]),
+                },
+                "parse": {
+                    "seconds": round(self.seconds["parse"], 2),
+                    "lines_per_s": rate(self.lines, self.seconds["parse"]),
+                    "mb_per_s": rate(self.ndjson_bytes / mb, self.seconds["parse"]),
+                },
+            },
+            "wall_seconds": round(wall_seconds, 2),
+            "events_per_s": rate(self.events, wall_seconds),
+        }
+
+
+def _reject_reason(error: ValidationError) -> str:
+    first = error.errors()[0]
+    return f"schema: {'.'.join(str(p) for p in first['loc'])} {first['type']}"
+
+
+def scan_file(file_key: str, options: JobOptions) -> ScanStats:
+    """Скан одного архива (выполняется в процессе пула)"""
+    use_source(options.source)
+    ingest = get_settings().ingest
+    decode = get_decoder(ingest.json_decoder)
+    window = TimeWindow.from_options(options)
+    stats = ScanStats()
+    seconds = stats.seconds
+    try:
+        started = time.perf_counter()
+        buffer = get_source().open_object(file_key)
+        seconds["download"] += time.perf_counter() - started
+        with buffer, zipfile.ZipFile(buffer) as zf:
+            stats.compressed_bytes = sum(info.compress_size for info in zf.infolist())
+            ndjson_files = [f for f in zf.namelist() if f.endswith(".ndjson")]
+            if not ndjson_files:
+                logger.warning(f"No .ndjson file found in {file_key}")
+                stats.files = 1
+                return stats
+            with zf.open(ndjson_files[0]) as ndjson:
+                reader = _TimedReader(ndjson)
+                started = time.perf_counter()
+                for line_num, line in iter_lines(reader, ingest.read_block_size):
+                    stats.lines = line_num
+                    if not line or line[0] == 0x5B:  # пустая строка или "["
+                        continue
+                    try:
+                        raw_obj = decode_line(decode, line)
+                    except json.JSONDecodeError:
+                        stats.rejects["invalid json"] += 1
+                        continue
+                    try:
+                        ev = EventSchema(**raw_obj)
+                    except ValidationError as e:
+                        stats.rejects[_reject_reason(e)] += 1
+                        continue
+                    except Exception as e:
+                        stats.rejects[f"schema: {type(e).__name__}"] += 1
+                        continue
+                    if not ev.insert_id:
+                        stats.rejects["missing insert_id"] += 1
+                        continue
+                    if ev.model_extra:
+                        stats.unmapped_keys.update(ev.model_extra.keys())
+                    if window and not window.contains(ev.client_event_time):
+                        stats.outside_window += 1
+                        continue
+                    stats.events += 1
+                    stats._event_time(ev.client_event_time)
+                # Время разбора — всё время цикла за вычетом чтения из распаковщика
+                seconds["parse"] += time.perf_counter() - started - reader.seconds
+                seconds["inflate"] += reader.seconds
+                stats.ndjson_bytes = reader.bytes
+        stats.files = 1
+    except Exception as e:
+        logger.error(f"Scan of {file_key} failed: {e}", exc_info=True)
+        stats.failed_files.append(f"{file_key}: {e}")
+    return stats
+
+
+def scan_prefix(
+    prefix: str,
+    options: Optional[JobOptions] = None,
+    concurrency: Optional[int] = None,
+    max_files: Optional[int] = None,
+    on_progress: Optional[Callable[[Dict], None]] = None,
+) -> Dict:
+    """Скан префикса; on_progress получает промежуточный отчёт после каждого файла"""
+    options = options or JobOptions()
+    use_source(options.source)
+    window = TimeWindow.from_options(options)
+    concurrency = concurrency or get_settings().ingest.scan_concurrency
+    objects = get_source().list_objects(prefix)
+    keys = [obj["Key"] for obj in objects if not window or window.may_contain(obj["Key"])]
+    if max_files:
+        keys = keys[:max_files]
+    logger.info(f"Scanning {len(keys)} files of {prefix} in {concurrency} processes")
+
+    total = ScanStats()
+    started = time.monotonic()
+    with ProcessPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = [pool.submit(scan_file, key, options) for key in keys]
+        for done, future in enumerate(as_completed(futures), start=1):
+            total.merge(future.result())
+            if on_progress is not None:
+                on_progress(dict(total.report(time.monotonic() - started, len(keys)), status="running"))
+            if done % 100 == 0:
+                logger.info(f"Scanned {done}/{len(keys)} files, {total.events} events")
+    report = dict(total.report(time.monotonic() - started, len(keys)), status="done")
+    logger.info(
+        f"Scan of {prefix}: {report['events']} events in {report['files']} files, "
+        f"{report['rejected']} rejected, {len(total.unmapped_keys)} unmapped keys"
+    )
+    return report
+
+
+# ---------------- ФОНОВЫЙ СКАН (API) ---------------- #
+def scan_report_path(pid: int) -> str:
+    return os.path.join(get_settings().ingest.scan_dir, f"scan_{pid}.json")
+
+
+def _save_report(path: str, report: Dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)  # API не должен прочитать недописанный отчёт
+
+
+def background_scan(prefix: str, options: Optional[JobOptions] = None, max_files: Optional[int] = None):
+    get_settings()
+    os.makedirs(get_settings().ingest.scan_dir, exist_ok=True)
+    path = scan_report_path(os.getpid())
+    _save_report(path, {"status": "listing", "prefix": prefix})
+    try:
+        report = scan_prefix(
+            prefix, options, max_files=max_files, on_progress=lambda r: _save_report(path, dict(r, prefix=prefix))
+        )
+    except Exception as e:
+        logger.error(f"Scan of {prefix} failed: {e}", exc_info=True)
+        report = {"status": "failed", "error": str(e)}
+    _save_report(path, dict(report, prefix=prefix))
+
+
+def start_scan(prefix: str, options: Optional[JobOptions] = None, max_files: Optional[int] = None):
+    logger.info(f"Starting background scan of {prefix}")
+    p = Process(target=background_scan, args=(prefix, options, max_files))
+    p.start()
+    logger.info(f"Spawned process PID={p.pid}")
+    return p
+
+
+def load_scan_report(pid: int) -> Optional[Dict]:
+    path = scan_report_path(pid)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,62 @@
+"""
+Взвешенная справедливая очередь файлов нескольких префиксов (stride scheduling).
+У каждого префикса есть «пройденный путь»: выдача файла сдвигает его на
+1 / weight. Следующий файл берётся у префикса с наименьшим путём среди тех, у
+которых есть файлы и нет файла в работе. Так префикс с большим бэклогом не
+забирает все слоты: за одно и то же время префиксы получают файлы
+пропорционально весам. Файлы одного префикса идут строго по одному и по
+порядку — на этом держится его журнал (last_completed_file). Поэтому веса
+работают, только когда префиксов с файлами больше, чем слотов: иначе каждый
+префикс и так держит свой слот, и больший вес не даёт ему второго.
+"""
+import asyncio
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+
+class FairShareScheduler:
+    def __init__(self, queues: Dict[str, List[Dict]], weights: Dict[str, float]):
+        self._queues: Dict[str, Deque[Dict]] = {name: deque(items) for name, items in queues.items()}
+        self._weights = {name: max(weights.get(name, 1.0), 1e-6) for name in queues}
+        self._passes = {name: 0.0 for name in queues}
+        self._busy: Set[str] = set()
+        self._changed = asyncio.Condition()
+        self.issued = {name: 0 for name in queues}
+
+    def _pick(self) -> Optional[str]:
+        ready = [name for name, queue in self._queues.items() if queue and name not in self._busy]
+        if not ready:
+            return None
+        return min(ready, key=lambda name: (self._passes[name], name))
+
+    @property
+    def pending(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def take(self) -> Optional[Tuple[str, Dict]]:
+        """(префикс, объект) следующего файла; None — файлов не осталось"""
+        async with self._changed:
+            while True:
+                name = self._pick()
+                if name is not None:
+                    self._busy.add(name)
+                    self._passes[name] += 1.0 / self._weights[name]
+                    self.issued[name] += 1
+                    return name, self._queues[name].popleft()
+                if not self._busy or not self.pending:
+                    return None
+                # Остались файлы только у префиксов, чей файл сейчас в работе
+                await self._changed.wait()
+
+    async def release(self, name: str):
+        """Файл префикса обработан, префикс снова может получить слот"""
+        async with self._changed:
+            self._busy.discard(name)
+            self._changed.notify_all()
+
+    async def close(self):
+        """Остановить выдачу: ждущие take() получат None"""
+        async with self._changed:
+            for queue in self._queues.values():
+                queue.clear()
+            self._changed.notify_all()
@@ -2,6 +2,8 @@ from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 
+from app.config import get_settings
+
 
 class EventSchema(BaseModel):
     insert_id: str = Field(alias="$insert_id")
@@ -71,3 +73,52 @@ class EventSchema(BaseModel):
         populate_by_name = True  # Для алиасов ($insert_id)
         json_encoders = {datetime: lambda v: v.isoformat()}
         extra = "allow"  # Разрешает extra поля для extra_json
+
+
+class JobOptions(BaseModel):
+    """Параметры задания переноса; None — брать значение из settings.ingest"""
+
+    source: Optional[str] = None
+    batch_size: Optional[int] = None
+    commit_policy: Optional[str] = None
+    commit_every_batches: Optional[int] = None
+    commit_interval: Optional[float] = None
+    pipeline_writes: Optional[bool] = None
+    load_profile: Optional[str] = None
+    sort_batches: Optional[bool] = None
+    write_method: Optional[str] = None
+    dead_letter: Optional[str] = None
+    error_budget: Optional[int] = None
+    raw_payload: Optional[str] = None
+    memory_budget: Optional[int] = None
+    throttle: Optional[bool] = None
+    prefetch: Optional[bool] = None
+    stream_listing: Optional[bool] = None
+    prefix_concurrency: Optional[int] = None
+    rollups: Optional[bool] = None
+    parsed_cache: Optional[bool] = None
+    follow: Optional[bool] = None
+    poll_interval: Optional[float] = None
+    debounce: Optional[float] = None
+    # Окно [from, to) по client_event_time; в settings аналогов нет
+    event_time_from: Optional[datetime] = None
+    event_time_to: Optional[datetime] = None
+
+    def get(self, name: str):
+        """Значение опции с фолбэком на settings.ingest"""
+        value = getattr(self, name)
+        return getattr(get_settings().ingest, name) if value is None else value
+
+
+class PrefixSpec(BaseModel):
+    """Префикс задания с несколькими префиксами: куда грузить и его доля (вес)"""
+
+    prefix: str
+    table_name: str
+    weight: float = Field(1.0, gt=0)
+
+
+class MultiStartRequest(BaseModel):
+    prefixes: List[PrefixSpec]
+    start_date: Optional[str] = None
+    options: JobOptions = JobOptions()
@@ -0,0 +1,145 @@
+"""
+Источники архивов: S3 (S3Client) или локальный каталог (зеркало на NVMe/NFS,
+фикстуры тестов). Источник выбирается на процесс задания (ingest_source или
+параметр source), остальной код работает через get_source() с тем же
+интерфейсом, что у S3Client: list_objects, iter_objects, open_object,
+get_object, head_etag. Ключ локального файла — путь относительно local_root
+через "/", как ключ в S3.
+"""
+import io
+import mmap
+import os
+from datetime import datetime, timezone
+from typing import BinaryIO, Dict, Iterator, List, Optional
+
+from app.config import get_settings
+from app.s3_client import get_s3, is_direct_child
+from app.logger import logger
+
+SOURCES = ("s3", "local")
+
+
+class MappedFile(io.RawIOBase):
+    """Файл, отображённый в память, как поток для zipfile (чтение копирует только запрошенный кусок)"""
+
+    def __init__(self, mapped: mmap.mmap):
+        self._mapped = mapped
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = max(0, min(len(buffer), len(self._mapped) - self._pos))
+        with memoryview(self._mapped) as view:
+            buffer[:n] = view[self._pos : self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._mapped)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._mapped.close()
+        super().close()
+
+
+class LocalSource:
+    """
+    Архивы в локальном каталоге. Файл открывается через mmap: zipfile читает
+    его прямо из страничного кэша, без копирования архива в bytes и без учёта
+    в бюджете памяти задания. ETag — mtime и размер файла (меняется при перезаписи).
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        logger.info(f"Local source initialized at {self.root}")
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, *key.split("/")))
+        if os.path.commonpath([path, self.root]) != self.root:
+            raise ValueError(f"Key outside of local root: {key}")
+        return path
+
+    @staticmethod
+    def _etag(stat: os.stat_result) -> str:
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    def iter_objects(self, prefix: str, start_after: Optional[str] = None) -> Iterator[Dict]:
+        """Файлы непосредственно в каталоге prefix, в порядке ключей"""
+        if not prefix.endswith("/"):
+            prefix += "/"
+        directory = self._path(prefix)
+        if not os.path.isdir(directory):
+            return
+        with os.scandir(directory) as entries:
+            files = sorted((e for e in entries if e.is_file()), key=lambda e: e.name)
+        for entry in files:
+            key = prefix + entry.name
+            if (start_after and key <= start_after) or not is_direct_child(key, prefix):
+                continue
+            stat = entry.stat()
+            yield {
+                "Key": key,
+                "LastModified": datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+                "ETag": self._etag(stat),
+            }
+
+    def list_objects(self, prefix: str, start_after: Optional[str] = None) -> List[Dict]:
+        """Как S3Client.list_objects: по возрастанию LastModified"""
+        result = sorted(self.iter_objects(prefix, start_after), key=lambda o: o["LastModified"])
+        logger.info(f"Found {len(result)} local files in prefix {prefix}")
+        return result
+
+    def open_object(self, key: str) -> BinaryIO:
+        with open(self._path(key), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return io.BytesIO()
+            # mmap держит файл открытым сам, дескриптор можно закрыть
+            return MappedFile(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def get_object(self, key: str) -> bytes:
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def head_etag(self, key: str) -> Optional[str]:
+        return self._etag(os.stat(self._path(key)))
+
+
+_source = None
+_source_name: Optional[str] = None
+
+
+def use_source(name: Optional[str] = None):
+    """Выбрать источник процесса (None — ingest_source из настроек)"""
+    global _source, _source_name
+    name = name or get_settings().ingest.source
+    if name not in SOURCES:
+        raise ValueError(f"Unknown source: {name}")
+    if name != _source_name:
+        _source, _source_name = None, name
+
+
+def get_source():
+    """Источник архивов процесса, создаётся при первом обращении"""
+    global _source
+    if _source_name is None:
+        use_source()
+    if _source is None:
+        if _source_name == "local":
+            root = get_settings().local.root
+            if not root:
+                raise ValueError("local_root is not set")
+            _source = LocalSource(root)
+        else:
+            _source = get_s3()
+    return _source
@@ -0,0 +1,274 @@
+"""
+Режим follow: после догона бэклога задание не завершается, а ждёт новые архивы.
+Новые ключи приходят из PollingFeed (list_objects_v2 с начала дня последнего
+увиденного ключа) или из NotificationFeed (уведомления S3 о создании объектов
+через SQS; в тестах его кормит QueueSource поверх queue.Queue). Ключи
+сравниваются по key_order — часу из имени файла, а не лексикографически.
+Архив, опоздавший за уже отданные, принимается, пока его час не старше
+follow_lookback_hours от последнего отданного ключа (SeenKeys).
+"""
+import asyncio
+import json
+import queue
+import time
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import unquote_plus
+
+from app.config import get_settings
+from app.s3_client import is_direct_child
+from app.sources import get_source
+from app.window import day_start_after, key_order
+from app.logger import logger
+
+
+class SeenKeys:
+    """
+    Ключи, отданные за окно lookback часов до последнего из них (по key_order).
+    Новый — ключ, которого нет среди отданных и чей час не старше окна; ключи
+    старше окна забываются. Для последнего ключа не по шаблону окна нет: новые
+    только ключи после него, как и раньше.
+    """
+
+    def __init__(self, last_key: Optional[str], lookback_hours: int):
+        self.last_key = last_key
+        self.lookback = timedelta(hours=lookback_hours)
+        self._keys = {last_key} if last_key else set()
+
+    def _horizon(self) -> Tuple[datetime, str]:
+        """Новые ключи идут по key_order строго после этой границы"""
+        hour, key = key_order(self.last_key)
+        if hour == datetime.min:
+            return hour, key
+        return hour - self.lookback, ""
+
+    def start_after(self) -> Optional[str]:
+        """StartAfter листинга, в который попадает всё окно"""
+        return day_start_after(self.last_key, self.lookback) if self.last_key else None
+
+    def is_new(self, key: str) -> bool:
+        if key in self._keys:
+            return False
+        if self.last_key is None:
+            return True
+        return key_order(key) > self._horizon()
+
+    def update(self, keys: Iterable[str]):
+        """Учесть ключи, загруженные раньше (из file_ledger), не сдвигая окно"""
+        self._keys.update(k for k in keys if self.is_new(k))
+
+    def add(self, key: str):
+        self._keys.add(key)
+        if self.last_key is None or key_order(key) > key_order(self.last_key):
+            self.last_key = key
+            horizon = self._horizon()
+            self._keys = {k for k in self._keys if key_order(k) > horizon}
+
+
+class PollingFeed:
+    """
+    Опрашивает префикс раз в poll_interval секунд и отдаёт новые по SeenKeys
+    ключи в порядке key_order. Листинг начинается с начала дня, в который
+    попадает окно опоздавших: лексикографически _10#0 идёт раньше _9#0, и
+    StartAfter от самого ключа пропустил бы более поздние часы. Объект отдаётся,
+    когда с его LastModified прошло debounce секунд, и строго по порядку: свежий
+    ключ задерживает все, что идут за ним.
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        start_after: Optional[str],
+        poll_interval: float,
+        debounce: float,
+        lookback_hours: int = 24,
+    ):
+        self.prefix = prefix
+        self.seen = SeenKeys(start_after, lookback_hours)
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        while True:
+            objects = await asyncio.to_thread(get_source().list_objects, self.prefix, self.seen.start_after())
+            now = datetime.now(timezone.utc)
+            for obj in sorted(objects, key=lambda o: key_order(o["Key"])):
+                if not self.seen.is_new(obj["Key"]):
+                    continue
+                if (now - obj["LastModified"]).total_seconds() < self.debounce:
+                    break
+                self.seen.add(obj["Key"])
+                yield obj["Key"]
+            await asyncio.sleep(self.poll_interval)
+
+
+# Сообщение источника уведомлений: тело (JSON-строка) и квитанция для удаления
+Message = Tuple[str, object]
+
+
+class QueueSource:
+    """
+    Источник уведомлений поверх queue.Queue с телами сообщений (JSON-строки).
+    Квитанция — номер сообщения; удалённые копятся в deleted.
+    """
+
+    def __init__(self, messages: "queue.Queue[str]"):
+        self.messages = messages
+        self.received = 0
+        self.deleted: List[int] = []
+
+    def _message(self, body: str) -> Message:
+        self.received += 1
+        return body, self.received
+
+    def receive(self, wait: float) -> List[Message]:
+        try:
+            messages = [self._message(self.messages.get(timeout=wait))]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                messages.append(self._message(self.messages.get_nowait()))
+            except queue.Empty:
+                return messages
+
+    def delete(self, receipts: List[int]):
+        self.deleted.extend(receipts)
+
+
+class SqsSource:
+    """
+    Уведомления S3 (ObjectCreated) из очереди SQS. Сообщение удаляется, когда
+    обработаны все его ключи; упавший до этого процесс получит его снова после
+    visibility timeout очереди.
+    """
+
+    def __init__(self, queue_url: str, endpoint_url: Optional[str] = None):
+        import boto3
+
+        s3 = get_settings().s3
+        self.queue_url = queue_url
+        self.client = boto3.client(
+            "sqs",
+            aws_access_key_id=s3.access_key_id,
+            aws_secret_access_key=s3.secret_access_key,
+            region_name=s3.region,
+            endpoint_url=endpoint_url,
+        )
+
+    def receive(self, wait: float) -> List[Message]:
+        response = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=max(0, min(20, int(wait))),
+        )
+        return [(m["Body"], m["ReceiptHandle"]) for m in response.get("Messages", [])]
+
+    def delete(self, receipts: List[str]):
+        for start in range(0, len(receipts), 10):  # не больше 10 сообщений на запрос
+            response = self.client.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{"Id": str(i), "ReceiptHandle": r} for i, r in enumerate(receipts[start : start + 10])],
+            )
+            for failed in response.get("Failed", []):
+                # Квитанция устарела (сообщение пришло снова): повтор будет удалён как уже обработанный
+                logger.warning(f"Could not delete S3 notification: {failed.get('Message', failed)}")
+
+
+def keys_from_notification(body: str) -> List[str]:
+    """Ключи созданных объектов из события S3 (в том числе завернутого в SNS)"""
+    try:
+        event = json.loads(body)
+        if "Message" in event and "Records" not in event:
+            event = json.loads(event["Message"])
+    except (json.JSONDecodeError, TypeError):
+        logger.warning(f"Skipping malformed S3 notification: {body[:200]}")
+        return []
+    return [
+        unquote_plus(record["s3"]["object"]["key"])
+        for record in event.get("Records", [])
+        if record.get("eventName", "").startswith("ObjectCreated")
+    ]
+
+
+class NotificationFeed:
+    """
+    Ключи из уведомлений S3. Пачка копится, пока уведомления идут чаще чем
+    раз в debounce секунд (но не дольше poll_interval), затем отдаётся
+    по key_order без ключей, которые SeenKeys не считает новыми. Сообщение
+    удаляется из источника, когда обработаны все его ключи, а сообщение без
+    новых ключей — сразу.
+    """
+
+    def __init__(
+        self,
+        source,
+        prefix: str,
+        start_after: Optional[str],
+        poll_interval: float,
+        debounce: float,
+        lookback_hours: int = 24,
+    ):
+        self.source = source
+        self.prefix = prefix
+        self.seen = SeenKeys(start_after, lookback_hours)
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        pending: Dict[str, List[object]] = {}  # ключ → квитанции сообщений с ним
+        unfinished: Dict[object, int] = {}  # квитанция → сколько её ключей ещё не обработано
+        quiet_since = batch_started = time.monotonic()
+        while True:
+            wait = self.debounce if pending else self.poll_interval
+            messages = await asyncio.to_thread(self.source.receive, wait)
+            finished = []
+            for body, receipt in messages:
+                keys = {
+                    key
+                    for key in keys_from_notification(body)
+                    if is_direct_child(key, self.prefix) and self.seen.is_new(key)
+                }
+                if not keys:
+                    finished.append(receipt)
+                    continue
+                unfinished[receipt] = len(keys)
+                for key in keys:
+                    if not pending:
+                        batch_started = time.monotonic()
+                    pending.setdefault(key, []).append(receipt)
+                    quiet_since = time.monotonic()
+            if finished:
+                await asyncio.to_thread(self.source.delete, finished)
+            now = time.monotonic()
+            if pending and (
+                now - quiet_since >= self.debounce or now - batch_started >= self.poll_interval
+            ):
+                for key in sorted(pending, key=key_order):
+                    self.seen.add(key)
+                    yield key
+                    # Сюда возвращаемся, когда файл обработан
+                    finished = []
+                    for receipt in pending[key]:
+                        unfinished[receipt] -= 1
+                        if not unfinished[receipt]:
+                            del unfinished[receipt]
+                            finished.append(receipt)
+                    if finished:
+                        await asyncio.to_thread(self.source.delete, finished)
+                pending.clear()
+
+
+def make_feed(prefix: str, start_after: Optional[str], options, source=None):
+    """Feed для follow-режима: уведомления, если есть источник или очередь SQS, иначе опрос"""
+    poll_interval = options.get("poll_interval")
+    debounce = options.get("debounce")
+    lookback_hours = get_settings().ingest.follow_lookback_hours
+    s3 = get_settings().s3
+    if source is None and s3.notification_queue_url:
+        source = SqsSource(s3.notification_queue_url, s3.notification_endpoint_url)
+    if source is not None:
+        logger.info(f"Following {prefix} via S3 notifications after {start_after}")
+        return NotificationFeed(source, prefix, start_after, poll_interval, debounce, lookback_hours)
+    logger.info(f"Following {prefix} by polling every {poll_interval}s after {start_after}")
+    return PollingFeed(prefix, start_after, poll_interval, debounce, lookback_hours)
@@ -0,0 +1,150 @@
+"""
+Адаптивное торможение записи по нагрузке на Postgres. Раз в interval секунд
+отдельным подключением снимаются сигналы сервера: ожидания блокировок
+(pg_stat_activity), скорость генерации WAL, запрошенные чекпоинты (признак
+того, что WAL упирается в max_wal_size) и отставание реплик (pg_stat_replication).
+По самому сильному из них писатель меняет паузу перед батчем, размер батча и
+число батчей в полёте (конвейер из двух или строго по одному) — в пределах
+настроек. Под нагрузкой торможение растёт быстро, после — снимается плавно.
+"""
+import asyncio
+import time
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.config import get_settings
+from app.database import get_async_engine
+from app.memory import MIN_BATCH_SIZE
+from app.logger import logger
+
+LOCK_WAITS_SQL = "SELECT count(*) FROM pg_stat_activity WHERE wait_event_type = 'Lock'"
+WAL_LSN_SQL = "SELECT pg_current_wal_lsn() - '0/0'::pg_lsn"
+REPLICA_LAG_SQL = (
+    "SELECT coalesce(max(extract(epoch FROM greatest(write_lag, flush_lag, replay_lag))), 0) "
+    "FROM pg_stat_replication"
+)
+# В Postgres 17 счётчики чекпоинтов переехали в pg_stat_checkpointer
+CHECKPOINTS_SQL = "SELECT num_requested FROM pg_stat_checkpointer"
+CHECKPOINTS_LEGACY_SQL = "SELECT checkpoints_req FROM pg_stat_bgwriter"
+
+RELAX_BELOW = 0.5  # давление, ниже которого торможение снимается
+
+
+class DbThrottle:
+    """Состояние торможения задания; enabled=False — ничего не делает"""
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        interval: float = 10.0,
+        max_delay: float = 5.0,
+        max_lock_waits: int = 5,
+        max_wal_rate: int = 64 * 1024 * 1024,
+        max_replica_lag: float = 30.0,
+        min_batch_scale: float = 0.1,
+    ):
+        self.enabled = enabled
+        self.interval = interval
+        self.max_delay = max_delay
+        self.max_lock_waits = max_lock_waits
+        self.max_wal_rate = max_wal_rate
+        self.max_replica_lag = max_replica_lag
+        self.min_batch_scale = min_batch_scale
+        self.delay = 0.0
+        self.batch_scale = 1.0
+        self.in_flight = 2
+        self.signals: Dict[str, float] = {}
+        self._last_sample = 0.0
+        self._last_wal: Optional[Tuple[float, float]] = None
+        self._last_checkpoints: Optional[int] = None
+        self._checkpoints_sql: Optional[str] = None
+        self._failed = False
+
+    @classmethod
+    def from_options(cls, options) -> "DbThrottle":
+        ingest = get_settings().ingest
+        return cls(
+            options.get("throttle"),
+            ingest.throttle_interval,
+            ingest.throttle_max_delay,
+            ingest.throttle_max_lock_waits,
+            ingest.throttle_max_wal_rate,
+            ingest.throttle_max_replica_lag,
+            ingest.throttle_min_batch_scale,
+        )
+
+    def batch_size(self, base: int) -> int:
+        if self.batch_scale >= 1.0:
+            return base
+        return max(min(base, MIN_BATCH_SIZE), int(base * self.batch_scale))
+
+    async def before_write(self):
+        """Вызывается писателем перед каждым батчем: обновить сигналы и выждать паузу"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if now - self._last_sample >= self.interval:
+            self._last_sample = now
+            await self._sample()
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+    async def _sample(self):
+        try:
+            signals = await self._read_signals()
+        except Exception as e:
+            # Нет прав на статистику или сервер недоступен — оставляем текущий режим
+            if not self._failed:
+                logger.warning(f"DB throttle cannot read server stats: {e}")
+                self._failed = True
+            return
+        self._failed = False
+        self.signals = signals
+        pressure = max(
+            signals["lock_waits"] / self.max_lock_waits if self.max_lock_waits else 0.0,
+            signals["wal_rate"] / self.max_wal_rate if self.max_wal_rate else 0.0,
+            signals["replica_lag"] / self.max_replica_lag if self.max_replica_lag else 0.0,
+            1.0 if signals["checkpoints_requested"] else 0.0,
+        )
+        self._adjust(pressure)
+
+    def _adjust(self, pressure: float):
+        before = (self.delay, self.batch_scale, self.in_flight)
+        if pressure >= 1.0:
+            self.delay = min(self.max_delay, max(self.delay * 2, 0.1))
+            self.batch_scale = max(self.min_batch_scale, self.batch_scale / 2)
+            self.in_flight = 1
+        elif pressure < RELAX_BELOW:
+            self.delay = self.delay / 2 if self.delay > 0.05 else 0.0
+            self.batch_scale = min(1.0, self.batch_scale + 0.1)
+            if not self.delay:
+                self.in_flight = 2
+        if (self.delay, self.batch_scale, self.in_flight) != before:
+            logger.info(f"DB throttle: pressure={pressure:.2f} {self.summary()}")
+
+    async def _read_signals(self) -> Dict[str, float]:
+        async with get_async_engine().connect() as conn:
+            if self._checkpoints_sql is None:
+                version = int((await conn.execute(text("SHOW server_version_num"))).scalar())
+                self._checkpoints_sql = CHECKPOINTS_SQL if version >= 170000 else CHECKPOINTS_LEGACY_SQL
+            lock_waits = (await conn.execute(text(LOCK_WAITS_SQL))).scalar()
+            wal = float((await conn.execute(text(WAL_LSN_SQL))).scalar())
+            checkpoints = (await conn.execute(text(self._checkpoints_sql))).scalar()
+            replica_lag = float((await conn.execute(text(REPLICA_LAG_SQL))).scalar())
+        now = time.monotonic()
+        wal_rate = 0.0
+        if self._last_wal is not None:
+            wal_rate = (wal - self._last_wal[0]) / max(now - self._last_wal[1], 1e-3)
+        requested = self._last_checkpoints is not None and checkpoints > self._last_checkpoints
+        self._last_wal = (wal, now)
+        self._last_checkpoints = checkpoints
+        return {
+            "lock_waits": lock_waits,
+            "wal_rate": wal_rate,
+            "checkpoints_requested": requested,
+            "replica_lag": replica_lag,
+        }
+
+    def summary(self) -> str:
+        return f"delay={self.delay:.2f}s batch_scale={self.batch_scale:.2f} in_flight={self.in_flight}"
@@ -0,0 +1,111 @@
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+from app.config import get_settings
+
+
+def to_naive_utc(value: datetime) -> datetime:
+    """client_event_time хранится без таймзоны (UTC), границы окна приводим к тому же виду"""
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _hour_in_key(key_pattern: "re.Pattern", key: str) -> Optional[Tuple[datetime, "re.Match"]]:
+    """Начало часа из имени файла и совпадение шаблона (позиции считаются от имени)"""
+    match = key_pattern.search(key.rsplit("/", 1)[-1])
+    if not match:
+        return None
+    try:
+        hour_start = datetime.strptime(match.group("date"), "%Y-%m-%d") + timedelta(
+            hours=int(match.group("hour"))
+        )
+    except ValueError:
+        return None
+    return hour_start, match
+
+
+def key_order(key: str) -> Tuple[datetime, str]:
+    """
+    Порядок появления выгрузок: час из имени файла, затем сам ключ. Часы в именах
+    Amplitude без ведущего нуля, поэтому лексикографически _10#0 идет раньше _9#0.
+    Ключи не по шаблону идут первыми, между собой — по ключу.
+    """
+    hour = _hour_in_key(re.compile(get_settings().ingest.key_time_pattern), key)
+    return (hour[0] if hour else datetime.min), key
+
+
+def day_start_after(key: str, before: timedelta = timedelta(0)) -> str:
+    """
+    StartAfter для листинга, в который попадут все ключи дня key и следующих
+    дней: ключ, обрезанный после даты. before сдвигает день назад от часа key.
+    Для ключа не по шаблону — сам ключ.
+    """
+    hour = _hour_in_key(re.compile(get_settings().ingest.key_time_pattern), key)
+    if hour is None:
+        return key
+    name_start = key.rfind("/") + 1
+    day = (hour[0] - before).strftime("%Y-%m-%d")
+    return key[: name_start + hour[1].start("date")] + day
+
+
+class TimeWindow:
+    """
+    Окно [start, end) по client_event_time. Файлы, час которых записан в ключе
+    (Amplitude: <project>_<YYYY-MM-DD>_<H>#<N>...), отсекаются до скачивания;
+    строки вне окна отбрасываются при разборе. slack_hours расширяет окно для
+    отсечения файлов: час в ключе — время выгрузки, события могут приходить с опозданием.
+    """
+
+    def __init__(
+        self,
+        start: Optional[datetime],
+        end: Optional[datetime],
+        key_pattern: str,
+        slack_hours: int = 0,
+    ):
+        self.start = to_naive_utc(start) if start else None
+        self.end = to_naive_utc(end) if end else None
+        self.key_pattern = re.compile(key_pattern)
+        self.slack = timedelta(hours=slack_hours)
+
+    @classmethod
+    def from_options(cls, options) -> "TimeWindow":
+        ingest = get_settings().ingest
+        return cls(
+            options.event_time_from,
+            options.event_time_to,
+            ingest.key_time_pattern,
+            ingest.window_slack_hours,
+        )
+
+    def __bool__(self) -> bool:
+        return self.start is not None or self.end is not None
+
+    def contains(self, value: datetime) -> bool:
+        value = to_naive_utc(value)
+        if self.start is not None and value < self.start:
+            return False
+        if self.end is not None and value >= self.end:
+            return False
+        return True
+
+    def key_hour(self, key: str) -> Optional[Tuple[datetime, datetime]]:
+        """Час [from, to), закодированный в имени файла, или None, если имя не по шаблону"""
+        hour = _hour_in_key(self.key_pattern, key)
+        if hour is None:
+            return None
+        return hour[0], hour[0] + timedelta(hours=1)
+
+    def may_contain(self, key: str) -> bool:
+        """Может ли файл содержать события окна; файлы с непонятным именем не отсекаем"""
+        hour = self.key_hour(key)
+        if hour is None:
+            return True
+        hour_start, hour_end = hour
+        if self.start is not None and hour_end + self.slack <= self.start:
+            return False
+        if self.end is not None and hour_start - self.slack >= self.end:
+            return False
+        return True
@@ -0,0 +1,335 @@
+import asyncio
+import json
+import time
+from operator import itemgetter
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import JSON, insert
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import AsyncSessionLocal
+from app.journal import update_current_progress
+from app.logger import logger, flush_logs
+from app.schemas import JobOptions
+from app.dead_letter import DeadLetterSink
+from app.routing import TableTarget
+from app.memory import MemoryGovernor
+from app.rollups import RollupAccumulator
+from app.ledger import LedgerCounts
+from app.throttle import DbThrottle
+from app.dictionary import DictionaryEncoder
+
+MAX_PARAMS = 20000  # лимит параметров на execute в asyncpg
+COMMIT_POLICIES = ("batch", "batches", "interval", "file")
+WRITE_METHODS = ("values", "unnest")
+
+
+# ---------------- ВСТАВКА БАТЧЕЙ ---------------- #
+async def insert_batch(
+    session: AsyncSession, table_model, data_list: List[dict], skip_existing: bool = False
+) -> Optional[Set[str]]:
+    """
+    Вставка батча с разделением на под-батчи. Коммит делает вызывающий.
+    skip_existing — ON CONFLICT DO NOTHING; тогда возвращает insert_id реально вставленных строк.
+    """
+    if not data_list:
+        return set() if skip_existing else None
+
+    num_columns = len(data_list[0]) or 1
+    chunk_size = max(1, MAX_PARAMS // num_columns)
+    inserted: Set[str] = set()
+
+    for i in range(0, len(data_list), chunk_size):
+        sub_chunk = data_list[i : i + chunk_size]
+        if skip_existing:
+            stmt = (
+                pg_insert(table_model)
+                .values(sub_chunk)
+                .on_conflict_do_nothing(index_elements=["insert_id"])
+                .returning(table_model.insert_id)
+            )
+            inserted.update((await session.execute(stmt)).scalars())
+        else:
+            stmt = insert(table_model).values(sub_chunk)
+            await session.execute(stmt)
+
+    logger.debug(f"Inserted {len(data_list)} rows into {table_model.__tablename__}")
+    return inserted if skip_existing else None
+
+
+# Текст unnest-вставки по (таблица, skip_existing): SQL, колонки, признаки JSON-колонок
+_unnest_sql: Dict[Tuple[str, bool], Tuple[str, Callable[[dict], tuple], List[bool]]] = {}
+
+
+def unnest_insert_sql(table, skip_existing: bool) -> Tuple[str, List[str], List[bool]]:
+    """
+    INSERT ... SELECT FROM unnest($1::type[], ...) с одним массивом на колонку:
+    текст запроса не зависит ни от числа строк, ни от того, какие поля были в строках.
+    JSON-колонки передаются текстом и приводятся в SELECT (кодек json у asyncpg
+    в SQLAlchemy ждёт строку). Возвращает SQL, колонки и признаки JSON-колонок.
+    """
+    dialect = postgresql.dialect()
+    columns = [c.name for c in table.columns]
+    is_json = [isinstance(c.type, JSON) for c in table.columns]
+    quoted = [dialect.identifier_preparer.quote(name) for name in columns]
+    arrays = ", ".join(
+        f"${i}::{'text' if js else c.type.compile(dialect=dialect)}[]"
+        for i, (c, js) in enumerate(zip(table.columns, is_json), start=1)
+    )
+    select_list = ", ".join(
+        f"u.{q}::{table.c[name].type.compile(dialect=dialect)}" if js else f"u.{q}"
+        for name, q, js in zip(columns, quoted, is_json)
+    )
+    sql = (
+        f"INSERT INTO {dialect.identifier_preparer.format_table(table)} ({', '.join(quoted)}) "
+        f"SELECT {select_list} FROM unnest({arrays}) AS u({', '.join(quoted)})"
+    )
+    if skip_existing:
+        sql += " ON CONFLICT (insert_id) DO NOTHING RETURNING insert_id"
+    return sql, columns, is_json
+
+
+async def insert_batch_unnest(
+    session: AsyncSession, table_model, data_list: List[dict], skip_existing: bool = False
+) -> Optional[Set[str]]:
+    """
+    То же, что insert_batch, одним запросом с массивами вместо VALUES: без
+    лимита MAX_PARAMS и с повторным использованием плана сервером. Текст запроса
+    один на таблицу, поэтому его подготовку кэширует само соединение asyncpg.
+    Запрос идёт через соединение сессии и попадает в транзакцию батча.
+    """
+    if not data_list:
+        return set() if skip_existing else None
+
+    table = table_model.__table__
+    key = (table.name, skip_existing)
+    if key not in _unnest_sql:
+        sql, columns, is_json = unnest_insert_sql(table, skip_existing)
+        _unnest_sql[key] = (sql, itemgetter(*columns), is_json)
+    sql, get_row, is_json = _unnest_sql[key]
+
+    arrays = [list(values) for values in zip(*map(get_row, data_list))]
+    for i, js in enumerate(is_json):
+        if js:
+            arrays[i] = [None if v is None else json.dumps(v, ensure_ascii=False) for v in arrays[i]]
+    connection = await session.connection()
+    result = await connection.exec_driver_sql(sql, tuple(arrays))
+
+    logger.debug(f"Inserted {len(data_list)} rows into {table.name} via unnest")
+    return {r[0] for r in result} if skip_existing else None
+
+
+_event_time = itemgetter("client_event_time")
+
+
+# ---------------- ПОЛИТИКА КОММИТОВ ---------------- #
+class CommitPolicy:
+    """Решает, когда закрывать транзакцию: batch | batches | interval | file"""
+
+    def __init__(self, mode: str, every_batches: int = 1, interval: float = 0.0):
+        if mode not in COMMIT_POLICIES:
+            raise ValueError(f"Unknown commit policy: {mode}")
+        self.mode = mode
+        self.every_batches = max(1, every_batches)
+        self.interval = interval
+
+    @classmethod
+    def from_options(cls, options: JobOptions) -> "CommitPolicy":
+        return cls(
+            options.get("commit_policy"),
+            options.get("commit_every_batches"),
+            options.get("commit_interval"),
+        )
+
+    def due(self, pending_batches: int, last_commit: float) -> bool:
+        if self.mode == "batch":
+            return True
+        if self.mode == "batches":
+            return pending_batches >= self.every_batches
+        if self.mode == "interval":
+            return time.monotonic() - last_commit >= self.interval
+        return False  # file: коммит только в close()
+
+
+# ---------------- ПИСАТЕЛЬ ---------------- #
+class BatchWriter:
+    """
+    Пишет батчи одного файла (строки уже разложены по таблицам) в своей
+    сессии и коммитит по CommitPolicy.
+    Журнал (current_line) двигается только после коммита, поэтому
+    при падении повтор начинается ровно с первой незакоммиченной строки.
+    При pipelined=True запись идёт в отдельной задаче: следующий батч
+    парсится, пока предыдущий отправляется и подтверждается сервером.
+    ledger — счётчики file_ledger, растут в транзакции батча; prepare выполняется
+    в транзакции до первого батча (перезаливка удаляет им прежние строки файла).
+    dictionary — словарное кодирование колонок перед вставкой (роллапы видят значения).
+    Все вставки — с ON CONFLICT (insert_id) DO NOTHING: уже загруженные строки пропускаются.
+    """
+
+    def __init__(
+        self,
+        file_key: str,
+        policy: CommitPolicy,
+        pipelined: bool = True,
+        dead_letter: Optional[DeadLetterSink] = None,
+        governor: Optional[MemoryGovernor] = None,
+        rollups: bool = False,
+        ledger: Optional[LedgerCounts] = None,
+        prepare: Optional[Callable[[AsyncSession], Awaitable[None]]] = None,
+        journal: bool = True,
+        throttle: Optional[DbThrottle] = None,
+        write_method: str = "values",
+        sort_batches: bool = False,
+        dictionary: Optional[DictionaryEncoder] = None,
+    ):
+        self.file_key = file_key
+        self.policy = policy
+        self.pipelined = pipelined
+        self.dead_letter = dead_letter
+        self.governor = governor or MemoryGovernor()
+        # Роллапы вливаются в той же транзакции, что и батчи, до коммита
+        self.rollups = RollupAccumulator() if rollups else None
+        self.ledger = ledger
+        self.prepare = prepare
+        self.journal = journal
+        self.throttle = throttle or DbThrottle()
+        if write_method not in WRITE_METHODS:
+            raise ValueError(f"Unknown write method: {write_method}")
+        self.insert = insert_batch_unnest if write_method == "unnest" else insert_batch
+        self.sort_batches = sort_batches
+        self.dictionary = dictionary
+        self.session: Optional[AsyncSession] = None
+        self.committed_line = 0
+        self._pending_batches = 0
+        self._pending_line = 0
+        self._last_commit = time.monotonic()
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._error: Optional[BaseException] = None
+
+    async def __aenter__(self) -> "BatchWriter":
+        self.session = AsyncSessionLocal()
+        if self.prepare is not None:
+            await self.prepare(self.session)
+        if self.pipelined:
+            self._queue = asyncio.Queue(maxsize=1)
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                await self.close()
+            elif self._task is not None:
+                self._task.cancel()
+                await asyncio.gather(self._task, return_exceptions=True)
+                while not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is not None:
+                        self.governor.release("write", item[2])
+        finally:
+            await self.session.close()
+
+    async def write(self, batch: Dict[TableTarget, List[dict]], line_num: int, nbytes: int = 0):
+        """
+        Принять батч, прочитанный до строки line_num включительно. Батч переходит
+        писателю; nbytes, занятые вызывающим в стадии write, освобождаются после вставки.
+        """
+        try:
+            self._raise_if_failed()
+        except Exception:
+            self.governor.release("write", nbytes)
+            raise
+        if not self.pipelined:
+            await self._write(batch, line_num, nbytes)
+            return
+        await self._queue.put((batch, line_num, nbytes))
+        # Даём задаче записи отправить батч до того, как продолжим парсинг
+        await asyncio.sleep(0)
+        if self.throttle.in_flight < 2:
+            # Под нагрузкой на сервер — по одному батчу в полёте
+            await self._queue.join()
+
+    async def close(self):
+        """Дописать хвост и закоммитить всё, что осталось"""
+        if self.pipelined:
+            await self._queue.put(None)
+            await self._task
+            self._raise_if_failed()
+        else:
+            await self._commit()
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                if item is None:
+                    if self._error is None:
+                        try:
+                            await self._commit()
+                        except Exception as e:
+                            self._error = e
+                    return
+                if self._error is not None:
+                    self.governor.release("write", item[2])
+                    continue  # после ошибки только вычерпываем очередь
+                try:
+                    await self._write(*item)
+                except Exception as e:
+                    self._error = e
+            finally:
+                self._queue.task_done()
+
+    async def _write(self, batch: Dict[TableTarget, List[dict]], line_num: int, nbytes: int = 0):
+        try:
+            await self.throttle.before_write()
+            for target, rows in batch.items():
+                if self.sort_batches and target.events:
+                    # Соседние по времени строки попадают в соседние страницы — диапазоны BRIN узкие
+                    rows.sort(key=_event_time)
+                stored = rows
+                if self.dictionary and target.events:
+                    stored = await self.dictionary.encode(target, rows)
+                # Повтор insert_id (продолжение после падения между коммитом и журналом,
+                # start_file без удаления) пропускается — и в таблицах событий, и в event_raw
+                inserted = await self.insert(self.session, target.model, stored, skip_existing=True)
+                if not target.events:
+                    continue
+                if self.rollups is not None:
+                    self.rollups.add(target.name, (r for r in rows if r["insert_id"] in inserted))
+                if self.ledger is not None:
+                    self.ledger.add(target.name, len(inserted))
+        finally:
+            self.governor.release("write", nbytes)
+        self._pending_batches += 1
+        self._pending_line = line_num
+        if self.policy.due(self._pending_batches, self._last_commit):
+            await self._commit()
+
+    async def _commit(self):
+        if not self._pending_batches:
+            return
+        if self.dead_letter:
+            await self.dead_letter.flush_to_session(self.session, self.file_key, self._pending_line)
+        if self.rollups is not None:
+            await self.rollups.flush(self.session)
+        if self.ledger is not None:
+            await self.ledger.flush(self.session)
+        await self.session.commit()
+        self.committed_line = self._pending_line
+        if self.dead_letter:
+            self.dead_letter.flush_to_file(self.file_key, self.committed_line)
+        if self.journal:
+            update_current_progress(self.file_key, self.committed_line)
+        logger.debug(
+            f"Committed {self._pending_batches} batches of {self.file_key} up to line {self.committed_line}"
+        )
+        self._pending_batches = 0
+        self._last_commit = time.monotonic()
+        flush_logs()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
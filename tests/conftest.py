@@ -0,0 +1,169 @@
+"""
+Общие фикстуры тестов. Settings берутся из переменных окружения (не из .env),
+архивы — из LocalSource во временном каталоге. Тесты с базой (фикстура db)
+работают с отдельной базой TEST_DB_NAME на сервере db_host/db_port: она
+пересоздаётся и мигрируется до head один раз за сессию; если сервер
+недоступен, такие тесты пропускаются.
+"""
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import zipfile
+from pathlib import Path
+from typing import Iterable, Optional
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+TEST_DB_NAME = os.environ.get("TEST_DB_NAME", "s3topostgres_test")
+
+_ENV = {
+    "title": "test",
+    "description": "test",
+    "version": "0",
+    "log_file": os.path.join(tempfile.gettempdir(), "s3topostgres-tests.log"),
+    "db_host": "localhost",
+    "db_user": "postgres",
+    "db_password": "postgres",
+    "s3_access_key_id": "test",
+    "s3_secret_access_key": "test",
+    "s3_region": "test",
+    "s3_endpoint_url": "http://localhost",
+    "s3_bucket_name": "test",
+}
+for _name, _value in _ENV.items():
+    os.environ.setdefault(_name, _value)
+# Тесты никогда не трогают рабочую базу, даже если db_name задан в окружении
+os.environ["db_name"] = TEST_DB_NAME
+
+
+def event(insert_id: str, client_event_time: str = "2024-01-01T10:15:00", **fields) -> dict:
+    return {"insert_id": insert_id, "client_event_time": client_event_time, **fields}
+
+
+def make_archive(lines: Iterable[str]) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("events.ndjson", "".join(line + "\n" for line in lines))
+    return buffer.getvalue()
+
+
+def write_archive(root: Path, key: str, events: Iterable, mtime: Optional[float] = None) -> str:
+    """Архив key в каталоге LocalSource: события (dict) или готовые строки NDJSON"""
+    path = root.joinpath(*key.split("/"))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(make_archive(e if isinstance(e, str) else json.dumps(e) for e in events))
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return key
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Журнал, кэши и отчёты заданий пишутся относительно cwd — у каждого теста свой каталог"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def local_root(tmp_path, monkeypatch):
+    """Каталог LocalSource, выбранного источником процесса"""
+    from app import sources
+    from app.config import get_settings
+
+    root = tmp_path / "mirror"
+    root.mkdir()
+    monkeypatch.setattr(get_settings().local, "root", str(root))
+    monkeypatch.setattr(sources, "_source", None)
+    monkeypatch.setattr(sources, "_source_name", "local")
+    return root
+
+
+def run(coro):
+    """Выполнить корутину в новом цикле; соединения движка закрываются в нём же"""
+    from app.database import get_async_engine
+
+    async def main():
+        try:
+            return await coro
+        finally:
+            await get_async_engine().dispose()
+
+    return asyncio.run(main())
+
+
+def alembic_config():
+    from alembic.config import Config
+
+    config = Config()
+    config.set_main_option("script_location", str(ROOT / "app" / "migrations"))
+    return config
+
+
+def run_python(code: str, cwd: Path, **env: str) -> str:
+    """
+    Выполнить код в отдельном процессе с дополнительными переменными окружения:
+    модели и metadata собираются по настройкам один раз на процесс, поэтому
+    тесты других ingest_dictionary_columns / ingest_promoted идут в своём процессе
+    """
+    path = os.pathsep.join(filter(None, [str(ROOT), os.environ.get("PYTHONPATH")]))
+    environ = {**os.environ, **env, "PYTHONPATH": path}
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=cwd, env=environ, capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+
+def _admin_connect():
+    import psycopg2
+
+    from app.config import get_settings
+
+    db = get_settings().db
+    conn = psycopg2.connect(
+        host=db.host, port=db.port, user=db.user, password=db.password, dbname="postgres", connect_timeout=3
+    )
+    conn.autocommit = True
+    return conn
+
+
+@pytest.fixture(scope="session")
+def migrated_db():
+    try:
+        conn = _admin_connect()
+    except Exception as e:
+        pytest.skip(f"Postgres is not available: {e}")
+    with conn.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{TEST_DB_NAME}"')
+        cur.execute(f'CREATE DATABASE "{TEST_DB_NAME}"')
+    conn.close()
+
+    from alembic import command
+    from sqlalchemy import text
+
+    from app.database import get_sync_engine
+
+    with get_sync_engine().begin() as connection:
+        # Первая миграция удаляет таблицу test, оставшуюся в исходной базе
+        connection.execute(text("CREATE TABLE test (id integer)"))
+    command.upgrade(alembic_config(), "head")
+    return TEST_DB_NAME
+
+
+@pytest.fixture
+def db(migrated_db):
+    """Мигрированная база; данные, записанные тестом, удаляются после него"""
+    from sqlalchemy import inspect, text
+
+    from app.database import get_sync_engine
+
+    yield get_sync_engine()
+    engine = get_sync_engine()
+    tables = [t for t in inspect(engine).get_table_names() if t not in ("alembic_version",)]
+    with engine.begin() as connection:
+        connection.execute(text(f"TRUNCATE {', '.join(tables)} RESTART IDENTITY CASCADE"))
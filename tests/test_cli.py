@@ -0,0 +1,39 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import text
+
+from app import cli
+from tests.conftest import event, run, write_archive
+
+
+@pytest.fixture
+def main(monkeypatch):
+    # Задание в цикле conftest.run: соединения движка закрываются в нём же
+    monkeypatch.setattr(cli, "asyncio", SimpleNamespace(run=run))
+    return cli.main
+
+
+def test_run_exit_code_reports_failed_files(db, local_root, main):
+    write_archive(local_root, "exports/a_2024-01-01_1#0.json.zip", [event("a")])
+    assert main(["run", "--prefix", "exports/", "--table", "web", "--source", "local"]) == 0
+
+    (local_root / "exports" / "a_2024-01-01_2#0.json.zip").write_bytes(b"not a zip")
+    assert main(["run", "--prefix", "exports/", "--table", "web", "--source", "local"]) == 1
+    assert main(["run-multi", "--prefix", "exports/", "web", "--source", "local"]) == 1
+
+
+def test_run_exit_code_reports_error_budget(db, local_root, main):
+    write_archive(local_root, "exports/a_2024-01-01_1#0.json.zip", ["{broken", "{broken", event("a")])
+    args = ["--source", "local", "--dead-letter", "table", "--error-budget", "1"]
+    assert main(["run", "--prefix", "exports/", "--table", "web", *args]) == 1
+    # Отказы, на которых кончился бюджет, не теряются вместе с незакоммиченным батчем
+    with db.connect() as connection:
+        assert connection.execute(text("SELECT line_num FROM dead_letter ORDER BY 1")).scalars().all() == [1, 2]
+
+
+def test_invalid_options_are_rejected_like_api(main, capsys):
+    assert main(["run", "--prefix", "exports/", "--table", "nope"]) == 2
+    assert "Table must be one of" in capsys.readouterr().err
+    assert main(["run-multi", "--prefix", "exports/", "web", "--write-method", "copy"]) == 2
+    assert "write_method must be one of" in capsys.readouterr().err
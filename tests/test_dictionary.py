@@ -0,0 +1,51 @@
+from alembic import command
+from sqlalchemy import text
+
+from app import dictionary, processor
+from app.config import get_settings
+from app.schemas import JobOptions
+from tests.conftest import alembic_config, event, run, write_archive
+
+
+def load(key: str):
+    run(processor.process_file(key, "web", JobOptions()))
+
+
+def rows(db, query: str):
+    with db.connect() as connection:
+        return [tuple(r) for r in connection.execute(text(query))]
+
+
+def test_encoded_strings_are_read_through_web_view(db, local_root, monkeypatch):
+    # Строка до включения словаря остаётся как была
+    write_archive(local_root, "exports/a_2024-01-01_1#0.json.zip", [event("a", country="DE")])
+    load("exports/a_2024-01-01_1#0.json.zip")
+
+    monkeypatch.setattr(get_settings().ingest, "dictionary_columns", ["country"])
+    monkeypatch.setattr(dictionary, "_encoder", None)
+    write_archive(local_root, "exports/a_2024-01-01_2#0.json.zip", [event("b", country="FR")])
+    load("exports/a_2024-01-01_2#0.json.zip")
+
+    # В строке только id, строковая колонка не пишется
+    assert rows(db, "SELECT insert_id, country, country_id IS NOT NULL FROM web_rows ORDER BY 1") == [
+        ("a", "DE", False),
+        ("b", None, True),
+    ]
+    # Запросы к web видят исходные значения
+    assert rows(db, "SELECT insert_id, country FROM web ORDER BY 1") == [("a", "DE"), ("b", "FR")]
+
+
+def test_downgrade_restores_strings_from_dictionary(db, local_root, monkeypatch):
+    monkeypatch.setattr(get_settings().ingest, "dictionary_columns", ["country", "os_name"])
+    monkeypatch.setattr(dictionary, "_encoder", None)
+    write_archive(local_root, "exports/a_2024-01-01_1#0.json.zip", [event("a", country="DE", os_name="ios")])
+    load("exports/a_2024-01-01_1#0.json.zip")
+
+    config = alembic_config()
+    command.downgrade(config, "e2a7c4d91f35")
+    try:
+        assert rows(db, "SELECT insert_id, country, os_name FROM web") == [("a", "DE", "ios")]
+        assert rows(db, "SELECT to_regclass('dim_country'), to_regclass('web_rows')") == [(None, None)]
+    finally:
+        command.upgrade(config, "head")
+    assert rows(db, "SELECT insert_id, country, os_name FROM web") == [("a", "DE", "ios")]
@@ -0,0 +1,46 @@
+import io
+
+import pytest
+
+from app.framing import decode_line, get_decoder, iter_lines, line_text
+
+DATA = b'{"a": 1}\n  {"b": 2}  \r\n\n[\n{"c": "\xd0\xb9"}\n{"tail": true}'
+
+
+def lines(data: bytes, block_size: int):
+    return [(n, bytes(line)) for n, line in iter_lines(io.BytesIO(data), block_size)]
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 3, 7, 16, 1 << 20])
+def test_lines_do_not_depend_on_block_size(block_size):
+    assert lines(DATA, block_size) == [
+        (1, b'{"a": 1}'),
+        (2, b'{"b": 2}'),
+        (3, b""),
+        (4, b"["),
+        (5, b'{"c": "\xd0\xb9"}'),
+        (6, b'{"tail": true}'),
+    ]
+
+
+def test_numbering_matches_line_by_line_reading():
+    expected = [(n, line.strip()) for n, line in enumerate(io.BytesIO(DATA), start=1)]
+    assert lines(DATA, 4) == expected
+
+
+def test_trailing_newline_does_not_add_line():
+    assert lines(b"x\ny\n", 3) == [(1, b"x"), (2, b"y")]
+    assert lines(b"", 3) == []
+
+
+def test_on_block_sees_whole_stream():
+    seen = []
+    list(iter_lines(io.BytesIO(DATA), 5, seen.append))
+    assert b"".join(seen) == DATA
+
+
+def test_decode_line_falls_back_on_broken_utf8():
+    decode = get_decoder("auto")
+    line = memoryview(b'{"name": "ab\xff"}')
+    assert decode_line(decode, line) == {"name": "ab"}
+    assert line_text(line) == '{"name": "ab"}'
@@ -0,0 +1,144 @@
+import os
+import random
+from datetime import datetime, timezone
+
+import pytest
+
+from app import s3_client
+from app.s3_client import S3Client, is_direct_child, split_range
+from app.sources import LocalSource
+
+ALPHABET = sorted("0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ")
+
+
+class FakeS3Api:
+    """list_objects_v2 поверх списка ключей: StartAfter, Delimiter, MaxKeys, IsTruncated"""
+
+    def __init__(self, keys):
+        self.keys = sorted(keys)
+        self.calls = 0
+
+    def list_objects_v2(self, Bucket, Prefix, Delimiter, MaxKeys, StartAfter=""):
+        self.calls += 1
+        contents, folders = [], []
+        truncated = False
+        for key in self.keys:
+            if not key.startswith(Prefix) or key <= StartAfter:
+                continue
+            if len(contents) + len(folders) == MaxKeys:
+                truncated = True
+                break
+            rest = key[len(Prefix):]
+            if Delimiter in rest:
+                folder = Prefix + rest.split(Delimiter, 1)[0] + Delimiter
+                if not folders or folders[-1]["Prefix"] != folder:
+                    folders.append({"Prefix": folder})
+                continue
+            contents.append(
+                {"Key": key, "LastModified": datetime(2024, 1, 1, tzinfo=timezone.utc), "ETag": f'"{key}"'}
+            )
+        return {"Contents": contents, "CommonPrefixes": folders, "IsTruncated": truncated}
+
+
+def fake_client(keys) -> S3Client:
+    client = S3Client.__new__(S3Client)
+    client.client = FakeS3Api(keys)
+    client.bucket = "test"
+    return client
+
+
+def amplitude_keys(prefix: str, days: int = 3, parts: int = 2):
+    return [
+        f"{prefix}123_2024-01-{day:02d}_{hour}#{part}.json.zip"
+        for day in range(1, days + 1)
+        for hour in range(24)
+        for part in range(parts)
+    ]
+
+
+def covering(ranges, key):
+    return [r for r in ranges if key > (r[0] or "") and (r[1] is None or key < r[1])]
+
+
+def test_split_range_covers_rest_of_range_exactly_once():
+    prefix = "exports/"
+    first, last = "exports/123_2024-01-01_0#0.json.zip", "exports/123_2024-01-03_7#1.json.zip"
+    ranges = split_range(prefix, first, last, None, ALPHABET)
+    assert ranges[0][0] == last and ranges[-1][1] is None
+    assert len(ranges) > 1
+    rng = random.Random(1)
+    keys = amplitude_keys(prefix, days=30) + [
+        prefix + "".join(rng.choice("019azAZ_#.-~") for _ in range(rng.randint(1, 30))) for _ in range(500)
+    ]
+    for key in keys:
+        expected = 0 if key <= last else 1
+        assert len(covering(ranges, key)) == expected, key
+
+
+def test_split_range_respects_end():
+    prefix = "p/"
+    ranges = split_range(prefix, "p/a000", "p/a500", "p/c", ALPHABET)
+    assert ranges[-1][1] == "p/c"
+    assert all(r[1] is None or r[1] <= "p/c" for r in ranges)
+
+
+@pytest.mark.parametrize("page", [1, 7, 1000])
+def test_iter_objects_yields_direct_children_in_key_order(monkeypatch, page):
+    monkeypatch.setattr(s3_client, "LIST_PAGE", page)
+    prefix = "exports/"
+    keys = amplitude_keys(prefix) + [prefix + "sub/nested.zip", prefix + "sub/", "other/x.zip"]
+    client = fake_client(keys)
+    listed = [obj["Key"] for obj in client.iter_objects(prefix)]
+    expected = sorted(k for k in keys if is_direct_child(k, prefix))
+    assert listed == expected
+    assert [obj["Key"] for obj in client.iter_objects(prefix, expected[10])] == expected[11:]
+
+
+def test_local_source_lists_direct_children(tmp_path):
+    for name, mtime in (("b.zip", 300), ("a.zip", 200), ("c.zip", 100)):
+        path = tmp_path / "p" / name
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(b"zip")
+        os.utime(path, (mtime, mtime))
+    (tmp_path / "p" / "sub").mkdir()
+    (tmp_path / "p" / "sub" / "d.zip").write_bytes(b"zip")
+    source = LocalSource(str(tmp_path))
+
+    assert [o["Key"] for o in source.iter_objects("p")] == ["p/a.zip", "p/b.zip", "p/c.zip"]
+    assert [o["Key"] for o in source.iter_objects("p/", "p/a.zip")] == ["p/b.zip", "p/c.zip"]
+    # list_objects, как у S3Client, — по LastModified
+    assert [o["Key"] for o in source.list_objects("p/")] == ["p/c.zip", "p/a.zip", "p/b.zip"]
+    etag = source.head_etag("p/a.zip")
+    assert etag == next(o["ETag"] for o in source.iter_objects("p/") if o["Key"] == "p/a.zip")
+
+
+def test_local_source_reads_archive_without_copy(tmp_path):
+    (tmp_path / "f.bin").write_bytes(b"0123456789")
+    source = LocalSource(str(tmp_path))
+    with source.open_object("f.bin") as f:
+        f.seek(3)
+        assert f.read(4) == b"3456"
+        assert f.tell() == 7
+    with pytest.raises(ValueError):
+        source.open_object("../outside")
+
+
+def test_object_stream_orders_day_by_hour_and_resumes_after_journal(local_root):
+    import asyncio
+
+    from app.processor import _ObjectStream
+    from app.window import TimeWindow
+    from tests.conftest import event, write_archive
+
+    day1 = [f"exports/123_2024-01-01_{h}#0.json.zip" for h in (8, 9, 10, 11)]
+    day2 = ["exports/123_2024-01-02_0#0.json.zip"]
+    for key in day1 + day2:
+        write_archive(local_root, key, [event("a")])
+
+    async def keys(journal):
+        stream = _ObjectStream("exports/", None, journal, TimeWindow(None, None, r"$^"))
+        return [obj["Key"] async for obj in stream], stream.last_key
+
+    assert asyncio.run(keys({})) == (day1 + day2, day2[0])
+    # _10#0 и _11#0 лексикографически меньше _9#0, но идут после него
+    assert asyncio.run(keys({"last_completed_file": day1[1]})) == (day1[2:] + day2, day2[0])
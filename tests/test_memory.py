@@ -0,0 +1,25 @@
+from app import processor
+from app.memory import MemoryGovernor
+from app.schemas import JobOptions
+from tests.conftest import event, run, write_archive
+
+
+class RecordingGovernor(MemoryGovernor):
+    def __init__(self):
+        super().__init__()
+        self.stage_peaks = {}
+
+    def hold(self, stage: str, nbytes: int):
+        super().hold(stage, nbytes)
+        self.stage_peaks[stage] = max(self.stage_peaks.get(stage, 0), self.held[stage])
+
+
+def test_parsed_batch_is_accounted_until_written(db, local_root):
+    key = "exports/a_2024-01-01_1#0.json.zip"
+    write_archive(local_root, key, [event(str(i)) for i in range(25)])
+    governor = RecordingGovernor()
+    assert run(processor.process_file(key, "web", JobOptions(batch_size=10), governor=governor))
+
+    # Набираемый батч учтён в parse и переходит во write целиком
+    assert 0 < governor.stage_peaks["parse"] <= governor.stage_peaks["write"]
+    assert governor.held["parse"] == 0 and governor.held["write"] == 0
@@ -0,0 +1,24 @@
+from alembic import command
+from sqlalchemy import text
+
+from tests.conftest import alembic_config
+
+
+def test_primary_key_migration_drops_duplicate_insert_ids(db):
+    config = alembic_config()
+    command.downgrade(config, "8d3a5b0e6c21")
+    try:
+        with db.begin() as connection:
+            connection.execute(
+                text(
+                    "INSERT INTO web (insert_id, client_event_time, event_type) VALUES "
+                    "('a', '2024-01-01 10:00', 'first'), ('a', '2024-01-01 10:00', 'second'), "
+                    "('b', '2024-01-01 11:00', 'only')"
+                )
+            )
+        command.upgrade(config, "e2a7c4d91f35")
+        with db.connect() as connection:
+            rows = connection.execute(text("SELECT insert_id, event_type FROM web ORDER BY 1")).all()
+        assert rows == [("a", "first"), ("b", "only")]
+    finally:
+        command.upgrade(config, "head")
@@ -0,0 +1,99 @@
+import os
+
+from app import parsed_cache
+from app.parsed_cache import ParsedCache
+
+
+def items(n: int):
+    for i in range(1, n + 1):
+        if i % 10 == 0:
+            yield (i, None, "Invalid JSON", "{broken", 7, b"{broken")
+        else:
+            record = {"insert_id": f"id{i}", "event_properties_json": {"n": i}}
+            yield (i, record, {"unmapped": i}, {"insert_id": f"id{i}"}, 40, b"{...}")
+
+
+def fill(cache: ParsedCache, key: str, etag: str, n: int, raw: bool = False):
+    writer = cache.writer(key, etag, raw)
+    for item in items(n):
+        writer.add(item)
+    writer.finish(n + 1, f"checksum-{n}")
+
+
+def test_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(parsed_cache, "FRAME_LINES", 7)
+    cache = ParsedCache(str(tmp_path / "cache"), 1 << 30)
+    fill(cache, "p/a.zip", '"e1"', 25, raw=True)
+
+    with cache.open("p/a.zip", '"e1"', raw=True) as archive:
+        assert archive.lines == 26 and archive.checksum == "checksum-25"
+        # Исходная строка не хранится: из кэша на её месте None
+        assert list(archive) == [item[:5] + (None,) for item in items(25)]
+    assert cache.open("p/a.zip", '"e2"') is None
+    assert cache.open("p/b.zip", '"e1"') is None
+    assert cache.open("p/a.zip", None) is None
+
+
+def test_writer_copies_records(tmp_path):
+    cache = ParsedCache(str(tmp_path), 1 << 30)
+    writer = cache.writer("k", "e")
+    record = {"insert_id": "x"}
+    writer.add((1, record, None, {}, 1, b""))
+    record["source_file_id"] = 5  # вызывающий дописывает служебные поля после разбора
+    writer.finish(1, "c")
+    with cache.open("k", "e") as archive:
+        assert next(iter(archive))[1] == {"insert_id": "x"}
+
+
+def test_unfinished_entry_is_invisible(tmp_path):
+    cache = ParsedCache(str(tmp_path), 1 << 30)
+    writer = cache.writer("k", "e")
+    writer.add(next(items(1)))
+    assert cache.open("k", "e") is None
+    writer.abort()
+    assert os.listdir(tmp_path) == []
+
+
+def test_broken_entry_is_ignored(tmp_path):
+    cache = ParsedCache(str(tmp_path), 1 << 30)
+    fill(cache, "k", "e", 3)
+    with open(cache.path("k", "e"), "r+b") as f:
+        f.truncate(5)
+    assert cache.open("k", "e") is None
+
+
+def test_eviction_drops_least_recently_read(tmp_path):
+    cache = ParsedCache(str(tmp_path), 1 << 30)
+    for i, key in enumerate(("a", "b", "c")):
+        fill(cache, key, "e", 200)
+        os.utime(cache.path(key, "e"), (1000 + i, 1000 + i))
+    size = os.path.getsize(cache.path("a", "e"))
+    cache.open("a", "e").close()  # чтение делает запись свежей
+
+    cache.max_bytes = size * 2
+    cache.evict()
+    assert cache.open("b", "e") is None
+    assert cache.open("a", "e") is not None
+    assert cache.open("c", "e") is not None
+
+
+def test_entry_of_other_parse_version_is_ignored(tmp_path):
+    fill(ParsedCache(str(tmp_path), 1 << 30, version="old"), "k", "e", 3)
+    cache = ParsedCache(str(tmp_path), 1 << 30, version="new")
+    assert cache.open("k", "e") is None
+    fill(cache, "k", "e", 3)  # новый разбор перезаписывает запись на том же месте
+    with cache.open("k", "e") as archive:
+        assert archive.version == "new"
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_raw_objects_are_kept_only_on_request(tmp_path):
+    cache = ParsedCache(str(tmp_path), 1 << 30)
+    fill(cache, "k", "e", 10)
+    # Без сырых объектов запись не годится заданию, которому они нужны
+    assert cache.open("k", "e", raw=True) is None
+    with cache.open("k", "e") as archive:
+        rows = list(archive)
+    assert rows[0] == (1, {"insert_id": "id1", "event_properties_json": {"n": 1}}, {"unmapped": 1}, None, 40, None)
+    # Текст отказа нужен dead_letter и хранится всегда
+    assert rows[9] == (10, None, "Invalid JSON", "{broken", 7, None)
@@ -0,0 +1,83 @@
+import json
+
+from sqlalchemy import text
+
+from app import processor
+from app.schemas import JobOptions
+from tests.conftest import event, run, run_python, write_archive
+
+PROMOTED = {
+    "ingest_promoted": json.dumps(
+        [
+            {"path": "event_properties.plan", "column": "ep_plan", "type": "text"},
+            {"path": "event_properties.seats", "column": "ep_seats", "type": "bigint", "index": None},
+            {"path": "user_properties.since", "column": "up_since", "type": "timestamp", "tables": ["web"]},
+        ]
+    )
+}
+
+# Ревизия пишется во временный каталог и применяется в отдельном процессе со своими настройками
+MIGRATE = """
+import json, os, sys
+from alembic import command
+from sqlalchemy import inspect, text
+from app.database import get_sync_engine
+from app.promoted import write_migration
+from tests.conftest import alembic_config
+
+directory = sys.argv[1:] and sys.argv[1]
+config = alembic_config()
+config.set_main_option("version_path_separator", "os")
+config.set_main_option(
+    "version_locations", os.pathsep.join([config.get_main_option("script_location") + "/versions", directory])
+)
+path = write_migration("add promoted", config, directory)
+command.upgrade(config, "head")
+engine = get_sync_engine()
+with engine.connect() as connection:
+    rows = connection.execute(text("SELECT insert_id, ep_plan, ep_seats, up_since::text FROM web ORDER BY 1"))
+    indexes = connection.execute(text(
+        "SELECT c.relname, i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname LIKE 'ix\\\\_%\\\\_ep\\\\_%' OR c.relname LIKE 'ix\\\\_%\\\\_up\\\\_%' ORDER BY 1"
+    ))
+    result = {"rows": [list(r) for r in rows], "indexes": [list(i) for i in indexes]}
+# Вторая генерация: все колонки уже в ревизии
+result["again"] = write_migration("again", config, directory)
+command.downgrade(config, "-1")
+with engine.connect() as connection:
+    result["after_downgrade"] = connection.execute(text(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_name IN ('web', 'web_rows', 'mp_rows') AND column_name IN ('ep_plan', 'ep_seats', 'up_since')"
+    )).scalars().all()
+print(json.dumps(result))
+"""
+
+
+def test_promoted_migration_adds_backfills_and_indexes_columns(db, local_root, tmp_path):
+    # Строки загружены до появления колонок: их заполняет ревизия
+    key = "exports/a_2024-01-01_1#0.json.zip"
+    write_archive(
+        local_root,
+        key,
+        [
+            event("a", event_properties={"plan": "pro", "seats": "3"}, user_properties={"since": 1704067200000}),
+            event("b", event_properties={"seats": 2.5}, user_properties={"since": "2024-01-02T03:00:00Z"}),
+            event("c", event_properties={"seats": True}, user_properties={"since": "not a date"}),
+        ],
+    )
+    run(processor.process_file(key, "web", JobOptions()))
+
+    code = MIGRATE.replace("sys.argv[1:] and sys.argv[1]", repr(str(tmp_path)))
+    output = run_python(code, local_root.parent, **PROMOTED)
+    assert json.loads(output.splitlines()[-1]) == {
+        "rows": [
+            ["a", "pro", 3, "2024-01-01 00:00:00"],
+            ["b", None, None, "2024-01-02 03:00:00"],
+            ["c", None, 1, None],
+        ],
+        "indexes": [["ix_mp_ep_plan", True], ["ix_web_ep_plan", True], ["ix_web_up_since", True]],
+        "again": None,
+        "after_downgrade": [],
+    }
+    with db.connect() as connection:
+        assert connection.execute(text("SELECT count(*) FROM web")).scalar() == 3
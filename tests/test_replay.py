@@ -0,0 +1,66 @@
+from sqlalchemy import func, select, text
+
+from app import processor
+from app.dictionary import create_views
+from app.models import EventRaw, EventRollupHourly, MpEvent, WebEvent
+from app.schemas import JobOptions
+from tests.conftest import event, run, write_archive
+
+KEY = "exports/123_2024-01-01_10#0.json.zip"
+
+
+def load(options: JobOptions, replay: bool = False):
+    run(processor.process_file(KEY, "web", options, replay=replay))
+
+
+def rollup_counts(db):
+    with db.connect() as connection:
+        return dict(
+            connection.execute(
+                select(EventRollupHourly.event_type, EventRollupHourly.event_count).order_by(
+                    EventRollupHourly.event_type
+                )
+            ).all()
+        )
+
+
+def count(db, model) -> int:
+    with db.connect() as connection:
+        return connection.execute(select(func.count()).select_from(model)).scalar_one()
+
+
+def events(n: int):
+    return [event(f"i{i}", event_type="open" if i % 3 else "buy", user_id=f"u{i}") for i in range(n)]
+
+
+def test_replay_keeps_rollups_correct(db, local_root):
+    write_archive(local_root, KEY, events(30))
+    options = JobOptions(rollups=True, raw_payload="side")
+    load(options)
+    assert rollup_counts(db) == {"buy": 10, "open": 20}
+
+    # Архив перезаписан: перезаливка заменяет строки файла, а роллапы следуют за ними
+    write_archive(local_root, KEY, events(33))
+    load(options, replay=True)
+    assert rollup_counts(db) == {"buy": 11, "open": 22}
+    assert count(db, WebEvent) == 33
+    assert count(db, EventRaw) == 33
+
+
+def test_replay_skips_tables_without_source_file_id(db, local_root):
+    write_archive(local_root, KEY, [event(f"i{i}") for i in range(5)])
+    load(JobOptions())
+    with db.begin() as connection:
+        connection.execute(text("DROP VIEW mp"))
+        connection.execute(text("ALTER TABLE mp_rows DROP COLUMN source_file_id"))
+    try:
+        write_archive(local_root, KEY, [event(f"i{i}") for i in range(7)])
+        load(JobOptions(), replay=True)
+        assert count(db, WebEvent) == 7
+        assert run(processor.ledger.reconcile("exports/")) == []
+    finally:
+        with db.begin() as connection:
+            connection.execute(text("ALTER TABLE mp_rows ADD COLUMN source_file_id integer"))
+            connection.execute(text("CREATE INDEX ix_mp_source_file_id ON mp_rows (source_file_id)"))
+            create_views(connection)
+    assert count(db, MpEvent) == 0
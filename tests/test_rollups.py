@@ -0,0 +1,144 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select, text
+
+from app.database import AsyncSessionLocal
+from app.models import EventRaw, EventRollupHourly, WebEvent
+from app.raw_payload import compress_payload, raw_target
+from app.rollups import HLL_REGISTERS, RollupAccumulator, hll_add, user_key
+from app.routing import TableTarget
+from app.writer import BatchWriter, CommitPolicy
+from tests.conftest import run
+
+
+def sketch(users) -> bytearray:
+    registers = bytearray(HLL_REGISTERS)
+    for user in users:
+        hll_add(registers, user)
+    return registers
+
+
+def estimate(engine, registers) -> float:
+    with engine.connect() as connection:
+        return connection.execute(
+            text("SELECT hll_estimate(CAST(:r AS smallint[]))"), {"r": list(registers)}
+        ).scalar_one()
+
+
+def test_hll_add_is_idempotent_and_order_free():
+    users = [f"user{i}" for i in range(500)]
+    assert sketch(users) == sketch(reversed(users + users))
+
+
+def test_user_key_prefers_user_id():
+    assert user_key({"user_id": "u", "device_id": "d"}) == "u"
+    assert user_key({"user_id": None, "device_id": "d"}) == "d"
+    assert user_key({"amplitude_id": 42}) == "42"
+    assert user_key({}) is None
+
+
+@pytest.mark.parametrize("n", [10, 300, 20000])
+def test_hll_estimate(db, n):
+    assert estimate(db, sketch(f"user{i}" for i in range(n))) == pytest.approx(n, rel=0.1)
+
+
+def test_hll_merge_is_union(db):
+    a = sketch(f"user{i}" for i in range(0, 6000))
+    b = sketch(f"user{i}" for i in range(4000, 10000))
+    with db.connect() as connection:
+        merged = connection.execute(
+            text("SELECT hll_merge(CAST(:a AS smallint[]), CAST(:b AS smallint[]))"),
+            {"a": list(a), "b": list(b)},
+        ).scalar_one()
+        again = connection.execute(
+            text("SELECT hll_merge(CAST(:a AS smallint[]), CAST(:a AS smallint[]))"), {"a": merged}
+        ).scalar_one()
+    assert merged == [max(x, y) for x, y in zip(a, b)]
+    assert again == merged
+    assert estimate(db, merged) == pytest.approx(10000, rel=0.1)
+
+
+def test_accumulator_flush_adds_counts_and_merges_sketches(db):
+    hour = datetime(2024, 1, 1, 10)
+
+    def rows(users):
+        return [
+            {"client_event_time": hour.replace(minute=i % 60), "event_type": "open", "platform": "iOS", "user_id": u}
+            for i, u in enumerate(users)
+        ]
+
+    async def flush(users):
+        accumulator = RollupAccumulator()
+        accumulator.add("web", rows(users))
+        async with AsyncSessionLocal() as session:
+            await accumulator.flush(session)
+            await session.commit()
+
+    run(flush([f"u{i}" for i in range(100)]))
+    run(flush([f"u{i}" for i in range(50, 150)]))
+
+    with db.connect() as connection:
+        row = connection.execute(select(EventRollupHourly)).one()
+        users = connection.execute(text("SELECT hll_estimate(users_hll) FROM event_rollup_hourly")).scalar_one()
+    assert (row.source_table, row.hour, row.event_type, row.platform, row.country) == ("web", hour, "open", "iOS", "")
+    assert row.event_count == 200
+    assert users == pytest.approx(150, rel=0.1)
+
+
+def test_accumulator_upserts_groups_in_key_order(db):
+    # Порядок вставки (ctid в пустой таблице) — порядок, в котором upsert берёт блокировки
+    types = ["zoom", "Buy", "open", "buy", "_x"]
+
+    async def flush():
+        accumulator = RollupAccumulator()
+        accumulator.add("web", [{"client_event_time": datetime(2024, 1, 1, 10), "event_type": t} for t in types])
+        async with AsyncSessionLocal() as session:
+            await accumulator.flush(session)
+            await session.commit()
+
+    run(flush())
+    with db.connect() as connection:
+        stored = connection.execute(text("SELECT event_type FROM event_rollup_hourly ORDER BY ctid")).scalars().all()
+        by_key = connection.execute(
+            text('SELECT event_type FROM event_rollup_hourly ORDER BY event_type COLLATE "C"')
+        ).scalars().all()
+    assert stored == by_key == sorted(types)
+
+
+def test_writer_counts_repeated_file_once(db):
+    target = TableTarget("web", WebEvent)
+    rows = [
+        target.encode({"insert_id": f"i{i}", "client_event_time": datetime(2024, 1, 1, 10, i), "user_id": f"u{i}"})
+        for i in range(10)
+    ]
+
+    async def load(batch):
+        async with BatchWriter("p/a.zip", CommitPolicy("batch"), False, rollups=True, journal=False) as writer:
+            await writer.write({target: list(batch)}, len(batch))
+
+    run(load(rows[:6]))
+    run(load(rows))  # повтор файла после падения: первые 6 строк уже в таблице
+    with db.connect() as connection:
+        assert connection.execute(select(EventRollupHourly.event_count)).scalar_one() == 10
+
+
+def test_writer_skips_repeated_raw_payload_with_rollups(db):
+    target = TableTarget("web", WebEvent)
+    rows = [
+        target.encode({"insert_id": f"i{i}", "client_event_time": datetime(2024, 1, 1, 10, i)}) for i in range(4)
+    ]
+    raw = [
+        {"insert_id": f"i{i}", "source_table": "web", "payload": compress_payload(b"{}")} for i in range(4)
+    ]
+
+    async def load(n):
+        async with BatchWriter("p/a.zip", CommitPolicy("batch"), False, rollups=True, journal=False) as writer:
+            await writer.write({target: rows[:n], raw_target(): raw[:n]}, n)
+
+    run(load(2))
+    run(load(4))  # повтор файла: event_raw первых строк уже есть, вставка не падает на ключе
+    with db.connect() as connection:
+        stored = connection.execute(select(EventRaw.insert_id).order_by(EventRaw.insert_id)).scalars().all()
+        assert stored == ["i0", "i1", "i2", "i3"]
+        assert connection.execute(select(EventRollupHourly.event_count)).scalar_one() == 4
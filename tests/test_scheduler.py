@@ -0,0 +1,83 @@
+import asyncio
+from collections import Counter
+
+from app.scheduler import FairShareScheduler
+
+
+def files(prefix: str, n: int):
+    return [{"Key": f"{prefix}{i:03d}.zip"} for i in range(n)]
+
+
+async def drain(scheduler: FairShareScheduler, workers: int, log: list):
+    async def worker():
+        while True:
+            taken = await scheduler.take()
+            if taken is None:
+                return
+            log.append(taken)
+            await asyncio.sleep(0)
+            await scheduler.release(taken[0])
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+
+
+def test_weights_split_slots_when_prefixes_outnumber_them():
+    queues = {"a/": files("a/", 40), "b/": files("b/", 40), "c/": files("c/", 40)}
+    scheduler = FairShareScheduler(queues, {"a/": 2, "b/": 1, "c/": 1})
+    log = []
+    asyncio.run(drain(scheduler, 1, log))
+    first = Counter(prefix for prefix, _ in log[:40])
+    assert first["a/"] == 20 and first["b/"] == 10 and first["c/"] == 10
+
+
+def test_files_of_prefix_go_in_order_and_one_at_a_time():
+    queues = {"a/": files("a/", 10), "b/": files("b/", 3)}
+    scheduler = FairShareScheduler(queues, {})
+    in_flight = Counter()
+    order = {"a/": [], "b/": []}
+
+    async def worker():
+        while True:
+            taken = await scheduler.take()
+            if taken is None:
+                return
+            prefix, obj = taken
+            in_flight[prefix] += 1
+            assert in_flight[prefix] == 1
+            order[prefix].append(obj["Key"])
+            await asyncio.sleep(0)
+            in_flight[prefix] -= 1
+            await scheduler.release(prefix)
+
+    async def main():
+        await asyncio.gather(*(worker() for _ in range(4)))
+
+    asyncio.run(main())
+    assert order["a/"] == [f["Key"] for f in files("a/", 10)]
+    assert order["b/"] == [f["Key"] for f in files("b/", 3)]
+    assert scheduler.issued == {"a/": 10, "b/": 3}
+
+
+def test_close_wakes_waiting_workers():
+    scheduler = FairShareScheduler({"a/": files("a/", 5)}, {})
+
+    async def main():
+        prefix, _ = await scheduler.take()
+        waiting = asyncio.create_task(scheduler.take())
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        await scheduler.close()
+        assert await waiting is None
+        await scheduler.release(prefix)
+        assert await scheduler.take() is None
+
+    asyncio.run(main())
+
+
+def test_weights_do_not_matter_when_every_prefix_has_a_slot():
+    queues = {"a/": files("a/", 20), "b/": files("b/", 20)}
+    scheduler = FairShareScheduler(queues, {"a/": 2, "b/": 1})
+    log = []
+    asyncio.run(drain(scheduler, 2, log))
+    first = Counter(prefix for prefix, _ in log[:20])
+    assert first["a/"] == first["b/"] == 10
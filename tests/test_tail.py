@@ -0,0 +1,110 @@
+import asyncio
+import json
+import queue
+import time
+
+from app.tail import NotificationFeed, PollingFeed, QueueSource
+from app.window import day_start_after, key_order
+from tests.conftest import event, write_archive
+
+PREFIX = "exports/"
+
+
+def key(day: str, hour: int, n: int = 0) -> str:
+    return f"{PREFIX}123_{day}_{hour}#{n}.json.zip"
+
+
+def notification(*keys: str) -> str:
+    return json.dumps(
+        {"Records": [{"eventName": "ObjectCreated:Put", "s3": {"object": {"key": k}}} for k in keys]}
+    )
+
+
+async def take(feed, n: int):
+    keys = []
+    async for file_key in feed:
+        keys.append(file_key)
+        if len(keys) == n:
+            return keys
+
+
+def test_key_order_follows_hour_not_text():
+    keys = [key("2024-01-02", 0), key("2024-01-01", 10), key("2024-01-01", 9, 1), key("2024-01-01", 9)]
+    assert sorted(keys, key=key_order) == [
+        key("2024-01-01", 9),
+        key("2024-01-01", 9, 1),
+        key("2024-01-01", 10),
+        key("2024-01-02", 0),
+    ]
+    assert day_start_after(key("2024-01-01", 10)) == f"{PREFIX}123_2024-01-01"
+    assert day_start_after(f"{PREFIX}other.zip") == f"{PREFIX}other.zip"
+
+
+def test_polling_feed_picks_up_later_hours(local_root):
+    old = time.time() - 3600
+    for k in (key("2024-01-01", 8), key("2024-01-01", 9)):
+        write_archive(local_root, k, [event("a")], mtime=old)
+    # _10#0 лексикографически меньше _9#0: StartAfter от последнего ключа его бы не увидел
+    for k in (key("2024-01-01", 10), key("2024-01-01", 9, 1), key("2024-01-02", 0)):
+        write_archive(local_root, k, [event("b")], mtime=old)
+
+    feed = PollingFeed(PREFIX, key("2024-01-01", 9), poll_interval=0.01, debounce=0, lookback_hours=0)
+    assert asyncio.run(take(feed, 3)) == [
+        key("2024-01-01", 9, 1),
+        key("2024-01-01", 10),
+        key("2024-01-02", 0),
+    ]
+
+
+def test_notification_feed_orders_by_hour():
+    messages = queue.Queue()
+    messages.put(notification(key("2024-01-01", 10), key("2024-01-01", 8), key("2024-01-01", 9, 1)))
+    feed = NotificationFeed(
+        QueueSource(messages), PREFIX, key("2024-01-01", 9), poll_interval=0.05, debounce=0, lookback_hours=0
+    )
+    assert asyncio.run(take(feed, 2)) == [key("2024-01-01", 9, 1), key("2024-01-01", 10)]
+
+
+def test_polling_feed_takes_late_keys_within_lookback(local_root):
+    old = time.time() - 3600
+    for k in (key("2024-01-01", 8), key("2024-01-01", 10)):
+        write_archive(local_root, k, [event("a")], mtime=old)
+    feed = PollingFeed(PREFIX, key("2024-01-01", 10), poll_interval=0.01, debounce=0, lookback_hours=3)
+    feed.seen.update([key("2024-01-01", 8)])
+
+    async def main():
+        keys = []
+        async for file_key in feed:
+            keys.append(file_key)
+            if len(keys) == 1:
+                # Архивы пришли позже 11-го часа: 9-й ещё в окне, 6-й уже нет, 8-й загружен раньше
+                for k in (key("2024-01-01", 11), key("2024-01-01", 9), key("2024-01-01", 6)):
+                    write_archive(local_root, k, [event("b")], mtime=old)
+            if len(keys) == 3:
+                return keys
+
+    write_archive(local_root, key("2024-01-01", 11, 1), [event("c")], mtime=old)
+    assert asyncio.run(main()) == [key("2024-01-01", 11, 1), key("2024-01-01", 9), key("2024-01-01", 11)]
+
+
+def test_notification_deleted_only_after_its_files_are_processed():
+    messages = queue.Queue()
+    messages.put(notification(key("2024-01-01", 9)))  # уже отдан: удаляется сразу
+    messages.put(notification(key("2024-01-01", 11), key("2024-01-01", 8)))
+    messages.put(notification(key("2024-01-01", 12)))
+    source = QueueSource(messages)
+    feed = NotificationFeed(source, PREFIX, key("2024-01-01", 9), poll_interval=0.05, debounce=0)
+
+    async def main():
+        deleted = []
+        async for file_key in feed:
+            deleted.append((file_key, list(source.deleted)))
+            if len(deleted) == 3:
+                return deleted
+
+    # Опоздавший 8-й час в окне; сообщение с ним и 11-м удаляется, только когда обработаны оба
+    assert asyncio.run(main()) == [
+        (key("2024-01-01", 8), [1]),
+        (key("2024-01-01", 11), [1]),
+        (key("2024-01-01", 12), [1, 2]),
+    ]
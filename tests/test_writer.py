@@ -0,0 +1,90 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, select
+
+from app.database import AsyncSessionLocal
+from app.models import WebEvent
+from app.writer import insert_batch, insert_batch_unnest
+from tests.conftest import run
+
+ROWS = [
+    {"insert_id": "a", "client_event_time": datetime(2024, 1, 1, 10), "event_properties_json": {"k": [1, "ü"]}},
+    {"insert_id": "b", "client_event_time": datetime(2024, 1, 1, 11), "event_properties_json": None},
+]
+
+
+def full(row: dict) -> dict:
+    return {c.name: row.get(c.name) for c in WebEvent.__table__.columns}
+
+
+def count(db) -> int:
+    with db.connect() as connection:
+        return connection.execute(select(func.count()).select_from(WebEvent)).scalar_one()
+
+
+@pytest.mark.parametrize("insert", [insert_batch, insert_batch_unnest])
+def test_rollback_discards_inserted_rows(db, insert):
+    async def main():
+        async with AsyncSessionLocal() as session:
+            # Первый запрос сессии: вставка обязана открыть транзакцию батча
+            await insert(session, WebEvent, [full(r) for r in ROWS])
+            assert await session.scalar(select(func.count()).select_from(WebEvent)) == 2
+            await session.rollback()
+            await insert(session, WebEvent, [full(ROWS[0])])
+            await session.rollback()
+
+    run(main())
+    assert count(db) == 0
+
+
+@pytest.mark.parametrize("insert", [insert_batch, insert_batch_unnest])
+def test_skip_existing_returns_inserted_ids(db, insert):
+    async def main():
+        async with AsyncSessionLocal() as session:
+            first = await insert(session, WebEvent, [full(ROWS[0])], skip_existing=True)
+            second = await insert(session, WebEvent, [full(r) for r in ROWS], skip_existing=True)
+            await session.commit()
+            stored = await session.scalar(
+                select(WebEvent.event_properties_json).where(WebEvent.insert_id == "a")
+            )
+        return first, second, stored
+
+    first, second, stored = run(main())
+    assert first == {"a"} and second == {"b"}
+    assert stored == {"k": [1, "ü"]}
+    assert count(db) == 2
+
+
+class RecordedCounts:
+    """Счётчики file_ledger без базы: что писатель насчитал по таблицам"""
+
+    def __init__(self):
+        self.rows = {}
+
+    def add(self, table_name: str, rows: int):
+        self.rows[table_name] = self.rows.get(table_name, 0) + rows
+
+    async def flush(self, session):
+        pass
+
+
+@pytest.mark.parametrize("write_method", ["values", "unnest"])
+def test_writer_skips_rows_already_loaded_without_rollups(db, write_method):
+    from app.routing import TableTarget
+    from app.writer import BatchWriter, CommitPolicy
+
+    target = TableTarget("web", WebEvent)
+    counts = RecordedCounts()
+
+    async def load(rows):
+        async with BatchWriter(
+            "p/a.zip", CommitPolicy("batch"), False, ledger=counts, journal=False, write_method=write_method
+        ) as writer:
+            await writer.write({target: [target.encode(r) for r in rows]}, len(rows))
+
+    run(load(ROWS[:1]))
+    # Повтор после падения между коммитом и журналом: первая строка уже в таблице
+    run(load(ROWS))
+    assert count(db) == 2
+    assert counts.rows == {"web": 2}